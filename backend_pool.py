@@ -0,0 +1,397 @@
+import heapq
+import itertools
+import json
+import queue
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def create_session(pool_size=10):
+    """Create a requests session whose connection pool is shared by all generators using it"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class RateLimiter:
+    """Thread-safe token bucket limiting how many requests per second start across all books"""
+
+    def __init__(self, requests_per_second, burst=None):
+        self.rate = float(requests_per_second)
+        self.capacity = float(burst if burst is not None else max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may start; returns the time spent waiting in seconds"""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+# Priority classes of LLM calls, lower runs first
+PRIORITY_DRAFTING = 0  # chapter drafting and everything on its critical path
+PRIORITY_ANALYSIS = 1  # summaries, character tracking, timeline, emotional arc
+PRIORITY_POLISH = 2  # final passes such as the title
+
+
+class PriorityLimiter:
+    """Caps the requests in flight to one backend endpoint, handing free slots out by priority
+
+    Waiters are served lowest priority value first and in arrival order within a priority,
+    so latency-sensitive calls jump ahead of queued batch work.
+    """
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self.waiters = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+
+    def acquire(self, priority=PRIORITY_DRAFTING):
+        """Block until a slot is free for this priority; returns the time spent waiting in seconds"""
+        started = time.monotonic()
+        with self.condition:
+            ticket = (priority, next(self.sequence))
+            heapq.heappush(self.waiters, ticket)
+            while self.active >= self.max_concurrency or self.waiters[0] != ticket:
+                self.condition.wait()
+            heapq.heappop(self.waiters)
+            self.active += 1
+            # The next waiter may also fit if several slots are free
+            self.condition.notify_all()
+        return time.monotonic() - started
+
+    def release(self):
+        """Give a slot back"""
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_DRAFTING):
+        """Hold a slot for the duration of a with block, yielding the time spent waiting for it"""
+        waited = self.acquire(priority)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+
+# One limiter per endpoint, shared by every generator in the process
+BACKEND_LIMITERS = {}
+BACKEND_LIMITERS_LOCK = threading.Lock()
+
+
+def get_backend_limiter(endpoint, max_concurrency):
+    """Return the process-wide limiter of an endpoint, creating it on first use"""
+    # "http://host:11434" and "http://host:11434/" are the same backend
+    key = ",".join(split_ollama_urls(endpoint))
+    with BACKEND_LIMITERS_LOCK:
+        limiter = BACKEND_LIMITERS.get(key)
+        if limiter is None:
+            limiter = PriorityLimiter(max_concurrency)
+            BACKEND_LIMITERS[key] = limiter
+        elif limiter.max_concurrency != max_concurrency:
+            print(f"[pool] {key} already has a limit of {limiter.max_concurrency} requests in flight, "
+                  f"ignoring max_concurrency={max_concurrency}")
+        return limiter
+
+
+def split_ollama_urls(urls):
+    """Turn a comma-separated --ollama_url value (or a list) into clean endpoint URLs"""
+    if isinstance(urls, str):
+        urls = urls.split(",")
+    return [url.strip().rstrip("/") for url in urls if url.strip()]
+
+
+class OllamaHostPool:
+    """Routes Ollama requests over several hosts
+
+    Hosts are health-checked through /api/ps, which also lists the models each one has
+    loaded. A request goes to the healthy host with the fewest requests in flight,
+    preferring hosts that already have its model in memory until they are busy, and fails
+    over to the next host when one cannot be reached or answers with an error.
+    """
+
+    def __init__(self, urls, check_interval=30, check_timeout=3, spill_after=2, pool_size=10):
+        self.hosts = [
+            {"url": url, "healthy": True, "outstanding": 0, "requests": 0, "models": set()}
+            for url in split_ollama_urls(urls)
+        ]
+        if not self.hosts:
+            raise ValueError("No Ollama endpoints given")
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        # Requests in flight on the best host with the model loaded before other hosts are used too
+        self.spill_after = spill_after
+        # Recent time-to-first-token samples per model and the counters of the hedge budget
+        self.first_token_times = {}
+        self.hedge_min_samples = 10
+        self.hedge_min_delay = 1.0
+        self.hedgeable_requests = 0
+        self.hedges = 0
+        self.checked_at = 0.0
+        self.checking = False
+        self.session = create_session(pool_size=pool_size * len(self.hosts))
+        self.lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """Health-check every host and record its loaded models, at most once per check interval"""
+        with self.lock:
+            if self.checking or (not force and time.monotonic() - self.checked_at < self.check_interval):
+                return
+            self.checking = True
+        try:
+            for host in self.hosts:
+                try:
+                    response = self.session.get(host["url"] + "/api/ps", timeout=self.check_timeout)
+                    response.raise_for_status()
+                    models = {model.get("name") or model.get("model") for model in response.json().get("models", [])}
+                    healthy = True
+                except (requests.exceptions.RequestException, ValueError):
+                    models, healthy = set(), False
+                with self.lock:
+                    if healthy != host["healthy"]:
+                        print(f"[pool] {host['url']} is {'up' if healthy else 'down'}")
+                    host["healthy"] = healthy
+                    host["models"] = models
+        finally:
+            with self.lock:
+                self.checked_at = time.monotonic()
+                self.checking = False
+
+    def acquire(self, model, exclude=()):
+        """Pick a host for a request of the model and count it as outstanding; None when all are excluded"""
+        if len(self.hosts) > 1:
+            self.refresh()
+        with self.lock:
+            candidates = [host for host in self.hosts if host["url"] not in exclude]
+            # With every host marked down, still try them rather than failing without a request
+            candidates = [host for host in candidates if host["healthy"]] or candidates
+            if not candidates:
+                return None
+            least_busy = lambda host: (host["outstanding"], host["requests"])
+            host = min(candidates, key=least_busy)
+            # A host with the model loaded skips the load time, which is minutes on CPU boxes
+            loaded = [candidate for candidate in candidates if model in candidate["models"]]
+            if loaded and min(loaded, key=least_busy)["outstanding"] < self.spill_after:
+                host = min(loaded, key=least_busy)
+            host["outstanding"] += 1
+            host["requests"] += 1
+            return host
+
+    def release(self, host, model, ok):
+        """Finish a request on a host, marking it down on failure and the model loaded on success"""
+        with self.lock:
+            host["outstanding"] -= 1
+            if ok:
+                host["healthy"] = True
+                host["models"].add(model)
+            else:
+                host["healthy"] = False
+
+    @contextmanager
+    def request(self, path, model, payload, stream=False, timeout=300, tried=None):
+        """POST to the best host, failing over to the others, and yield the successful response
+
+        Hosts already in tried are skipped, and every host used is appended to it.
+        """
+        tried = tried if tried is not None else []
+        last_error = None
+        while True:
+            host = self.acquire(model, exclude=tried)
+            if host is None:
+                raise last_error or requests.exceptions.ConnectionError("No Ollama host available")
+            tried.append(host["url"])
+            response = None
+            try:
+                response = self.session.post(host["url"] + path, json=payload, stream=stream, timeout=timeout)
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                # Give an error response's connection back to the pool before failing over
+                if response is not None:
+                    response.close()
+                print(f"[pool] {host['url']} failed, trying another host: {e}")
+                self.release(host, model, ok=False)
+                last_error = e
+                continue
+            ok = True
+            try:
+                with response:
+                    yield response
+            except requests.exceptions.RequestException:
+                # Failures while reading a streamed body count against the host too
+                ok = False
+                raise
+            finally:
+                self.release(host, model, ok)
+            return
+
+    def hedged_request(self, path, model, payload, percentile, budget, timeout=300):
+        """Non-streaming request that is duplicated on another host when it is slow to start
+
+        The request is streamed to measure its time to first token. When no token arrives
+        within the given percentile of the model's recent first-token times, and hedges stay
+        under the budget (a fraction of all hedgeable requests), the same request is sent to
+        another host. The first attempt to complete wins and closes the other attempt's
+        response, even while it still waits for its first token, which stops the generation
+        on its host and frees the host's slot. Returns the response body in the shape of a
+        non-streaming reply.
+        """
+        payload = dict(payload, stream=True)
+        tried = []
+        results = queue.Queue()
+        cancel = threading.Event()
+        first_token = threading.Event()
+        # Open responses of the attempts, closed by the winner
+        responses = []
+
+        def attempt():
+            try:
+                results.put(("ok", self.read_hedged_stream(path, model, payload, timeout, tried, cancel, first_token, responses)))
+            except Exception as e:
+                results.put(("error", e))
+
+        with self.lock:
+            self.hedgeable_requests += 1
+        deadline = self.hedge_deadline(model, percentile)
+        hedge_at = time.monotonic() + deadline if deadline is not None else None
+        threading.Thread(target=attempt, daemon=True).start()
+        pending = 1
+        error = None
+        while pending:
+            wait = None if hedge_at is None else max(0.0, hedge_at - time.monotonic())
+            try:
+                status, value = results.get(timeout=wait)
+            except queue.Empty:
+                hedge_at = None
+                if not first_token.is_set() and self.take_hedge(budget):
+                    print(f"[pool] no first token from {model} after {deadline:.1f}s, hedging on another host")
+                    threading.Thread(target=attempt, daemon=True).start()
+                    pending += 1
+                continue
+            pending -= 1
+            if status == "ok":
+                with self.lock:
+                    cancel.set()
+                    losers = list(responses)
+                for response in losers:
+                    abort_response(response)
+                return value
+            error = value
+        raise error
+
+    def read_hedged_stream(self, path, model, payload, timeout, tried, cancel, first_token, responses):
+        """One attempt of a hedged request; returns the assembled body, or None once cancelled"""
+        started = time.monotonic()
+        parts = []
+        last_chunk = None
+        with self.request(path, model, payload, stream=True, timeout=timeout, tried=tried) as response:
+            with self.lock:
+                if cancel.is_set():
+                    return None
+                responses.append(response)
+            try:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if last_chunk is None:
+                        self.record_first_token(model, time.monotonic() - started)
+                        first_token.set()
+                    if cancel.is_set():
+                        return None
+                    parts.append(chunk.get("message", {}).get("content", "") or chunk.get("response", ""))
+                    last_chunk = chunk
+                    if chunk.get("done"):
+                        break
+            except Exception:
+                # The winner closed this response; that is no failure of the host
+                if cancel.is_set():
+                    return None
+                raise
+        body = dict(last_chunk or {})
+        if "message" in body:
+            body["message"] = dict(body["message"], content="".join(parts))
+        else:
+            body["response"] = "".join(parts)
+        return body
+
+    def record_first_token(self, model, seconds):
+        """Keep the model's latest first-token times for the hedge deadline"""
+        with self.lock:
+            self.first_token_times.setdefault(model, deque(maxlen=200)).append(seconds)
+
+    def hedge_deadline(self, model, percentile):
+        """Seconds without a first token after which a request is hedged; None until enough samples exist"""
+        with self.lock:
+            samples = sorted(self.first_token_times.get(model, ()))
+        if len(samples) < self.hedge_min_samples or len(self.hosts) < 2:
+            return None
+        index = min(len(samples) - 1, int(round(percentile / 100.0 * (len(samples) - 1))))
+        return max(samples[index], self.hedge_min_delay)
+
+    def take_hedge(self, budget):
+        """Count a hedge if the budget allows one more"""
+        with self.lock:
+            if self.hedges + 1 > budget * self.hedgeable_requests:
+                return False
+            self.hedges += 1
+            return True
+
+
+def abort_response(response):
+    """Close a streamed response from another thread, waking a read blocked on it
+
+    Closing alone does not interrupt a thread waiting in recv on the socket, so the
+    connection is shut down first.
+    """
+    sock = getattr(getattr(response.raw, "_connection", None), "sock", None)
+    if sock is None:
+        # With "Connection: close" the socket only hangs off the response's file object
+        fp = getattr(getattr(response.raw, "_fp", None), "fp", None)
+        sock = getattr(getattr(fp, "raw", None), "_sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
+
+# One host pool per endpoint list, shared by every generator in the process
+HOST_POOLS = {}
+HOST_POOLS_LOCK = threading.Lock()
+
+
+def get_host_pool(urls):
+    """Return the process-wide pool of an endpoint list, creating it on first use"""
+    key = ",".join(split_ollama_urls(urls))
+    with HOST_POOLS_LOCK:
+        pool = HOST_POOLS.get(key)
+        if pool is None:
+            pool = OllamaHostPool(key)
+            HOST_POOLS[key] = pool
+        return pool
@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+import threading
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from backend_pool import RateLimiter, create_session
+from novel_generator import PIPELINE_PROFILES, BookGenerator
+
+
+# Manifest keys and the BookGenerator arguments they map to
+MANIFEST_OPTIONS = {
+    "premise": "story_premise",
+    "chapters": "num_chapters",
+    "model": "model",
+    "language": "language",
+    "genre": "genre",
+    "audience": "audience",
+    "tone": "tone",
+    "style": "style",
+    "setting": "setting",
+    "themes": "themes",
+    "names": "names",
+    "validation_threshold": "validation_threshold",
+    "fix_mode": "fix_mode",
+    "speculative": "speculative",
+    "interactive": "interactive",
+    "chapter_pause": "chapter_pause_seconds",
+    "profile": "profile",
+}
+
+
+def load_manifest(path):
+    """Read a JSONL manifest, one book per line; blank lines and # comments are skipped"""
+    books = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line)
+            if not entry.get("premise"):
+                raise ValueError(f"Manifest line {line_number} has no premise")
+            entry.setdefault("id", f"book_{line_number:04d}")
+            books.append(entry)
+    return books
+
+
+class BatchRunner:
+    """Generate many books with a bounded worker pool sharing one connection pool and rate limiter"""
+
+    def __init__(
+        self,
+        books,
+        model,
+        base_url,
+        workers=4,
+        max_rps=0,
+        max_concurrency=None,
+        hedge_percentile=None,
+        hedge_budget=0.1,
+        profile="balanced",
+        output_dir="./output/batch",
+    ):
+        self.books = books
+        self.model = model
+        self.base_url = base_url
+        self.workers = workers
+        self.output_dir = output_dir
+        # Every book's calls go through the same pooled session and the same global limiter
+        self.session = create_session(pool_size=workers * 4)
+        self.rate_limiter = RateLimiter(max_rps) if max_rps else None
+        self.max_concurrency = max_concurrency
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        # Pipeline profile of the books that do not set one
+        self.profile = profile
+        self.results_path = os.path.join(output_dir, "batch_results.jsonl")
+        self.results_lock = threading.Lock()
+
+    def build_generator(self, book):
+        """Create a BookGenerator for one manifest entry"""
+        # Batch books yield to interactive ones on a shared backend unless the manifest says otherwise
+        kwargs = {"model": self.model, "base_url": self.base_url, "interactive": False, "profile": self.profile}
+        for key, value in book.items():
+            if key in ("id", "output"):
+                continue
+            if key not in MANIFEST_OPTIONS:
+                raise ValueError(f"Unknown manifest option: {key}")
+            kwargs[MANIFEST_OPTIONS[key]] = value
+        return BookGenerator(
+            session=self.session,
+            rate_limiter=self.rate_limiter,
+            max_concurrency=self.max_concurrency,
+            hedge_percentile=self.hedge_percentile,
+            hedge_budget=self.hedge_budget,
+            **kwargs,
+        )
+
+    def run_book(self, book):
+        """Generate and save one book, returning its result record"""
+        started = time.time()
+        result = {"id": book["id"], "status": "failed", "output": None, "error": None}
+        try:
+            generator = self.build_generator(book)
+            filename = book.get("output") or os.path.join(self.output_dir, f"{book['id']}.md")
+            result["output"] = generator.write_book(filename=filename)
+            result["chapters"] = len(generator.chapters)
+            result["words"] = generator.book_writer.words
+            result["status"] = "done"
+        except SystemExit:
+            # create_story_outline exits the process on fatal LLM failures in CLI mode
+            result["error"] = "generation aborted"
+        except Exception as e:
+            result["error"] = str(e)
+        result["duration_seconds"] = round(time.time() - started, 1)
+        self.record_result(result)
+        return result
+
+    def record_result(self, result):
+        """Append a finished book's result to the results file as soon as it is known"""
+        with self.results_lock:
+            with open(self.results_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result) + "\n")
+        print(f"[batch] {result['id']}: {result['status']} in {result['duration_seconds']}s")
+
+    def run(self):
+        """Run every book of the manifest and return the summary report"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        started = time.time()
+        results = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.run_book, book) for book in self.books]
+            for future in as_completed(futures):
+                results.append(future.result())
+
+        results.sort(key=lambda result: result["id"])
+        finished = [result for result in results if result["status"] == "done"]
+        report = {
+            "finished_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "model": self.model,
+            "base_url": self.base_url,
+            "workers": self.workers,
+            "books": len(results),
+            "succeeded": len(finished),
+            "failed": len(results) - len(finished),
+            "wall_time_seconds": round(time.time() - started, 1),
+            "total_words": sum(result.get("words", 0) for result in finished),
+            "results": results,
+        }
+        report_path = os.path.join(self.output_dir, "batch_report.json")
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"[batch] {report['succeeded']}/{report['books']} books generated, report saved as {report_path}")
+        return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate many books from a JSONL manifest of premises.")
+    parser.add_argument("--manifest", type=str, required=True, help="JSONL file, one book per line: {\"premise\": ..., \"chapters\": ..., \"genre\": ...}")
+    parser.add_argument("--model", type=str, default="gemma3:12b", help="Default language model for books that do not set one.")
+    parser.add_argument("--ollama_url", type=str, default="http://localhost:11434", help="The URL of the Ollama API, or several comma-separated URLs to balance requests across.")
+    parser.add_argument("--workers", type=int, default=4, help="How many books are generated at the same time (default: 4)")
+    parser.add_argument("--max_rps", type=float, default=0, help="Global limit of LLM requests started per second, 0 for no limit (default: 0)")
+    parser.add_argument("--max_concurrency", type=int, default=None, help="Requests in flight to the backend at once across all books, served by priority (default: no limit)")
+    parser.add_argument("--hedge_percentile", type=float, default=None, help="Hedge an Ollama call on another host when it has no first token after this percentile of recent first-token times (default: off)")
+    parser.add_argument("--hedge_budget", type=float, default=0.1, help="Largest share of calls that may be hedged (default: 0.1)")
+    parser.add_argument("--profile", type=str, default="balanced", choices=sorted(PIPELINE_PROFILES), help="Pipeline profile of the books that do not set one: fast, balanced or thorough (default: balanced)")
+    parser.add_argument("--output_dir", type=str, default="./output/batch", help="Directory for the books, results and report (default: ./output/batch)")
+
+    args = parser.parse_args()
+
+    runner = BatchRunner(
+        load_manifest(args.manifest),
+        model=args.model,
+        base_url=args.ollama_url,
+        workers=args.workers,
+        max_rps=args.max_rps,
+        max_concurrency=args.max_concurrency,
+        hedge_percentile=args.hedge_percentile,
+        hedge_budget=args.hedge_budget,
+        profile=args.profile,
+        output_dir=args.output_dir,
+    )
+    runner.run()
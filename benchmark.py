@@ -0,0 +1,188 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from batch_generator import BatchRunner
+from mock_llm_server import MockLLMServer, add_behaviour_arguments, behaviour_from_args
+from novel_generator import BookGenerator
+from story_idea_generation import run_story_generation
+
+
+BENCHMARK_PREMISE = "A young cartographer discovers that the streets of her harbour city rearrange themselves every night."
+SCENARIOS = ["book", "book_openai", "batch", "story_ideas"]
+
+
+class Benchmark:
+    """Runs the generation pipelines end to end against a mock LLM server and measures them"""
+
+    def __init__(self, server, chapters=3, books=4, workers=4, keep_pauses=False, verbose=False, generator_options=None):
+        self.server = server
+        self.chapters = chapters
+        self.books = books
+        self.workers = workers
+        self.chapter_pause = 3 if keep_pauses else 0
+        self.verbose = verbose
+        self.generator_options = generator_options or {}
+
+    def build_generator(self, base_url):
+        """A BookGenerator for the benchmark premise"""
+        return BookGenerator(
+            base_url=base_url,
+            story_premise=BENCHMARK_PREMISE,
+            num_chapters=self.chapters,
+            premise_from_file=False,
+            chapter_pause_seconds=self.chapter_pause,
+            **self.generator_options,
+        )
+
+    def run_book(self):
+        """One book over the Ollama API"""
+        generator = self.build_generator(self.server.url)
+        generator.generate_book()
+        return 1
+
+    def run_book_openai(self):
+        """One book over the OpenAI chat-completions API"""
+        # The OpenAI client reads these, the generator only needs "openai" in its base URL;
+        # restore them afterwards so later scenarios and the caller see the real settings
+        saved = {name: os.environ.get(name) for name in ("OPENAI_BASE_URL", "OPENAI_API_KEY")}
+        os.environ["OPENAI_BASE_URL"] = self.server.url + "/v1"
+        # Never send a real key to the mock server
+        os.environ["OPENAI_API_KEY"] = "mock"
+        try:
+            generator = self.build_generator("https://api.openai.com")
+            generator.generate_book()
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+        return 1
+
+    def run_batch(self):
+        """Several books at once through the batch runner"""
+        books = [
+            {
+                "id": f"bench_{index:02d}",
+                "premise": f"{BENCHMARK_PREMISE} Variation {index}.",
+                "chapters": self.chapters,
+                "chapter_pause": self.chapter_pause,
+                **self.generator_options,
+            }
+            for index in range(self.books)
+        ]
+        with tempfile.TemporaryDirectory() as output_dir:
+            runner = BatchRunner(books, model="gemma3:12b", base_url=self.server.url, workers=self.workers, output_dir=output_dir)
+            report = runner.run()
+        if report["failed"]:
+            raise RuntimeError(f"{report['failed']} benchmark books failed")
+        return len(books)
+
+    def run_story_ideas(self):
+        """The multi-agent plot discussion of story_idea_generation.py"""
+        run_story_generation(self.server.url, theme="a city whose streets move at night")
+        return 1
+
+    def measure(self, scenario):
+        """Run a scenario once and return its measurements"""
+        self.server.stats.reset()
+        output = io.StringIO()
+        started = time.monotonic()
+        with contextlib.ExitStack() as stack:
+            if not self.verbose:
+                # The pipelines print a lot; keep the report readable
+                stack.enter_context(contextlib.redirect_stdout(output))
+            books = getattr(self, f"run_{scenario}")()
+        wall = time.monotonic() - started
+        stats = self.server.stats.snapshot()
+        calls = stats["requests"]
+        return {
+            "scenario": scenario,
+            "wall_seconds": round(wall, 3),
+            "calls": calls,
+            "calls_per_book": round(calls / books, 1),
+            "errors": stats["errors"],
+            "server_busy_seconds": stats["busy_seconds"],
+            # Time with no request in flight is spent in the pipeline itself
+            "overhead_per_call_ms": round(max(0.0, wall - stats["busy_seconds"]) / calls * 1000, 2) if calls else 0.0,
+            "average_concurrency": stats["average_concurrency"],
+            "max_concurrency": stats["max_concurrency"],
+            "output_tokens": stats["output_tokens"],
+        }
+
+    def run(self, scenarios, repeat=1):
+        """Run the scenarios, keeping the median-wall-time run of each"""
+        results = []
+        for scenario in scenarios:
+            runs = [self.measure(scenario) for _ in range(repeat)]
+            runs.sort(key=lambda run: run["wall_seconds"])
+            result = dict(runs[len(runs) // 2])
+            if repeat > 1:
+                result["wall_seconds_min"] = runs[0]["wall_seconds"]
+                result["wall_seconds_stdev"] = round(statistics.stdev(run["wall_seconds"] for run in runs), 3)
+            results.append(result)
+            print_result(result)
+        return results
+
+
+def print_result(result):
+    """Print one scenario's measurements on a line"""
+    print(
+        f"{result['scenario']:<12} wall {result['wall_seconds']:>8.2f}s  calls {result['calls']:>4} "
+        f"({result['calls_per_book']}/book)  overhead {result['overhead_per_call_ms']:>7.2f} ms/call  "
+        f"concurrency avg {result['average_concurrency']:.2f} max {result['max_concurrency']}  errors {result['errors']}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the generation pipelines against a local mock LLM server.")
+    parser.add_argument("--scenarios", type=str, default=",".join(SCENARIOS), help=f"Comma-separated scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--chapters", type=int, default=3, help="Chapters per book (default: 3)")
+    parser.add_argument("--books", type=int, default=4, help="Books in the batch scenario (default: 4)")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel books in the batch scenario (default: 4)")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per scenario, the median is reported (default: 1)")
+    parser.add_argument("--speculative", action="store_true", help="Benchmark the books with speculative chapter analysis")
+    parser.add_argument("--profile", type=str, default="balanced", help="Generator pipeline profile: fast, balanced or thorough (default: balanced)")
+    parser.add_argument("--validation_threshold", type=int, default=2, help="Generator validation threshold (default: 2)")
+    parser.add_argument("--keep_pauses", action="store_true", help="Keep the pause between chapters that protects a real server")
+    parser.add_argument("--port", type=int, default=0, help="Port of the mock server, 0 picks a free one (default: 0)")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipelines' own output")
+    parser.add_argument("--output", type=str, default=None, help="Also write the results to this JSON file")
+    add_behaviour_arguments(parser)
+
+    args = parser.parse_args()
+
+    # The generators load their prompt files relative to the repository
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(",") if scenario.strip()]
+    unknown = [scenario for scenario in scenarios if scenario not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+
+    server = MockLLMServer(port=args.port, behaviour=behaviour_from_args(args)).start()
+    print(f"Mock LLM server on {server.url}")
+    benchmark = Benchmark(
+        server,
+        chapters=args.chapters,
+        books=args.books,
+        workers=args.workers,
+        keep_pauses=args.keep_pauses,
+        verbose=args.verbose,
+        generator_options={
+            "speculative": args.speculative,
+            "validation_threshold": args.validation_threshold,
+            "profile": args.profile,
+        },
+    )
+    results = benchmark.run(scenarios, repeat=args.repeat)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+        print(f"Results saved as {args.output}")
+    server.shutdown()
@@ -0,0 +1,341 @@
+import argparse
+import datetime
+import json
+import os
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from book_writer import iter_chapters, read_title
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL UNIQUE,
+    book_mtime REAL NOT NULL,
+    book_size INTEGER NOT NULL,
+    metadata_mtime REAL,
+    title TEXT,
+    premise TEXT,
+    world_name TEXT,
+    model TEXT,
+    created_at TEXT,
+    chapters INTEGER NOT NULL DEFAULT 0,
+    words INTEGER NOT NULL DEFAULT 0,
+    ingested_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chapters (
+    book_id INTEGER NOT NULL REFERENCES books(id),
+    chapter INTEGER NOT NULL,
+    heading TEXT,
+    words INTEGER NOT NULL,
+    summary TEXT,
+    PRIMARY KEY (book_id, chapter)
+);
+CREATE TABLE IF NOT EXISTS characters (
+    book_id INTEGER NOT NULL REFERENCES books(id),
+    name TEXT NOT NULL COLLATE NOCASE,
+    description TEXT,
+    status TEXT,
+    first_appearance INTEGER,
+    developments INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (book_id, name)
+);
+CREATE TABLE IF NOT EXISTS motifs (
+    book_id INTEGER NOT NULL REFERENCES books(id),
+    motif TEXT NOT NULL COLLATE NOCASE
+);
+CREATE TABLE IF NOT EXISTS run_steps (
+    book_id INTEGER NOT NULL REFERENCES books(id),
+    step TEXT NOT NULL,
+    calls INTEGER NOT NULL,
+    failed INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    queue_wait REAL NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    PRIMARY KEY (book_id, step)
+);
+CREATE INDEX IF NOT EXISTS books_world ON books (world_name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS books_created ON books (created_at);
+CREATE INDEX IF NOT EXISTS characters_name ON characters (name);
+CREATE INDEX IF NOT EXISTS motifs_motif ON motifs (motif);
+CREATE INDEX IF NOT EXISTS motifs_book ON motifs (book_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS chapter_text USING fts5 (
+    heading, text, book_id UNINDEXED, chapter UNINDEXED, tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS summary_text USING fts5 (
+    text, book_id UNINDEXED, chapter UNINDEXED, tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+# Full-text rows of a book use rowids book_id * FTS_ROWIDS_PER_BOOK + chapter, so a book's
+# rows are one rowid range that FTS5 deletes without scanning the index
+FTS_ROWIDS_PER_BOOK = 100000
+# Timestamp that timestamped_filename adds to book file names
+FILENAME_TIMESTAMP = re.compile(r"_(\d{8}_\d{6})\.md$")
+
+
+class BookCatalog:
+    """SQLite catalog of the generated books in an output directory
+
+    Books, chapters, characters, motifs and the per-step run telemetry go into plain
+    tables; chapter text and chapter summaries go into FTS5 tables for full-text search.
+    Ingesting is incremental: a book is only read again when its file or its metadata
+    changed since the last ingest.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    @contextmanager
+    def transaction(self):
+        """Run a write transaction that takes the database lock up front"""
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def ingest(self, directory, prune=False):
+        """Add new and changed books of a directory tree; returns (added, updated, unchanged, removed)"""
+        known = {
+            row["path"]: row for row in self.connection.execute(
+                "SELECT id, path, book_mtime, book_size, metadata_mtime FROM books"
+            )
+        }
+        added = updated = unchanged = 0
+        seen = set()
+        for book_path in find_books(directory):
+            path = os.path.abspath(book_path)
+            seen.add(path)
+            stat = os.stat(path)
+            metadata_path = path[:-3] + "_metadata.json"
+            metadata_mtime = os.path.getmtime(metadata_path) if os.path.exists(metadata_path) else None
+            row = known.get(path)
+            if row is not None and (row["book_mtime"], row["book_size"], row["metadata_mtime"]) == (
+                stat.st_mtime, stat.st_size, metadata_mtime
+            ):
+                unchanged += 1
+                continue
+            with self.transaction():
+                if row is not None:
+                    self.delete_book(row["id"])
+                self.add_book(path, stat, metadata_path, metadata_mtime)
+            if row is None:
+                added += 1
+            else:
+                updated += 1
+        removed = 0
+        if prune:
+            with self.transaction():
+                for path, row in known.items():
+                    if path not in seen and path.startswith(os.path.abspath(directory) + os.sep):
+                        self.delete_book(row["id"])
+                        removed += 1
+        return added, updated, unchanged, removed
+
+    def add_book(self, path, stat, metadata_path, metadata_mtime):
+        """Insert one book and everything derived from it (must run inside a transaction)"""
+        metadata = {}
+        if metadata_mtime is not None:
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+        title, chapters = read_book(path, metadata.get("premise"))
+        telemetry = metadata.get("telemetry") or {}
+        models = {call.get("model") for call in telemetry.get("calls", []) if call.get("model")}
+        cursor = self.connection.execute(
+            "INSERT INTO books (path, book_mtime, book_size, metadata_mtime, title, premise, world_name, model, "
+            "created_at, chapters, words, ingested_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                path, stat.st_mtime, stat.st_size, metadata_mtime, title, metadata.get("premise"),
+                metadata.get("world_name") or None, ",".join(sorted(models)) or None, created_at(path, stat),
+                len(chapters), sum(len(text.split()) for _, _, text in chapters), time.time(),
+            ),
+        )
+        book_id = cursor.lastrowid
+        summaries = {int(chapter): text for chapter, text in (metadata.get("chapter_summaries") or {}).items()}
+        for chapter, heading, text in chapters:
+            self.connection.execute(
+                "INSERT INTO chapters (book_id, chapter, heading, words, summary) VALUES (?, ?, ?, ?, ?)",
+                (book_id, chapter, heading, len(text.split()), summaries.get(chapter)),
+            )
+            self.connection.execute(
+                "INSERT INTO chapter_text (rowid, heading, text, book_id, chapter) VALUES (?, ?, ?, ?, ?)",
+                (book_id * FTS_ROWIDS_PER_BOOK + chapter, heading, text, book_id, chapter),
+            )
+        self.connection.executemany(
+            "INSERT INTO summary_text (rowid, text, book_id, chapter) VALUES (?, ?, ?, ?)",
+            [
+                (book_id * FTS_ROWIDS_PER_BOOK + chapter, text, book_id, chapter)
+                for chapter, text in summaries.items() if text and 0 <= chapter < FTS_ROWIDS_PER_BOOK
+            ],
+        )
+        for name, character in (metadata.get("characters") or {}).items():
+            self.connection.execute(
+                "INSERT OR REPLACE INTO characters (book_id, name, description, status, first_appearance, developments) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    book_id, name, character.get("description"), character.get("status"),
+                    character.get("first_appearance"), len(character.get("development") or []),
+                ),
+            )
+        self.connection.executemany(
+            "INSERT INTO motifs (book_id, motif) VALUES (?, ?)",
+            [(book_id, motif.strip("•*- ")) for motif in metadata.get("recurring_motifs") or [] if isinstance(motif, str)],
+        )
+        self.connection.executemany(
+            "INSERT INTO run_steps (book_id, step, calls, failed, seconds, queue_wait, prompt_tokens, output_tokens) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    book_id, step, figures["calls"], figures["failed"], figures["seconds"], figures["queue_wait"],
+                    figures["prompt_tokens"], figures["output_tokens"],
+                )
+                for step, figures in (telemetry.get("steps") or {}).items()
+            ],
+        )
+
+    def delete_book(self, book_id):
+        """Remove a book and everything derived from it (must run inside a transaction)"""
+        for table in ("chapters", "characters", "motifs", "run_steps"):
+            self.connection.execute(f"DELETE FROM {table} WHERE book_id = ?", (book_id,))
+        # book_id is not indexed in the full-text tables, the rowid range is
+        first = book_id * FTS_ROWIDS_PER_BOOK
+        for table in ("chapter_text", "summary_text"):
+            self.connection.execute(
+                f"DELETE FROM {table} WHERE rowid BETWEEN ? AND ?", (first, first + FTS_ROWIDS_PER_BOOK - 1)
+            )
+        self.connection.execute("DELETE FROM books WHERE id = ?", (book_id,))
+
+    def search(self, query, target="chapters", limit=20):
+        """Full-text search over chapter text or chapter summaries, best matches first"""
+        table = "chapter_text" if target == "chapters" else "summary_text"
+        column = 1 if target == "chapters" else 0
+        return self.connection.execute(
+            f"""
+            SELECT b.path, b.title, t.chapter, snippet({table}, {column}, '[', ']', '...', 12) AS snippet
+            FROM {table} t JOIN books b ON b.id = t.book_id
+            WHERE {table} MATCH ? ORDER BY rank LIMIT ?
+            """,
+            (query, limit),
+        ).fetchall()
+
+    def find_books(self, character=None, world=None, motif=None):
+        """Books with a character, world name or motif, matched case-insensitively as substrings"""
+        conditions, params = [], []
+        if character:
+            conditions.append("EXISTS (SELECT 1 FROM characters c WHERE c.book_id = b.id AND c.name LIKE ?)")
+            params.append(f"%{character}%")
+        if world:
+            conditions.append("b.world_name LIKE ?")
+            params.append(f"%{world}%")
+        if motif:
+            conditions.append("EXISTS (SELECT 1 FROM motifs m WHERE m.book_id = b.id AND m.motif LIKE ?)")
+            params.append(f"%{motif}%")
+        where = " AND ".join(conditions) or "1"
+        return self.connection.execute(
+            f"SELECT b.* FROM books b WHERE {where} ORDER BY b.created_at DESC", params
+        ).fetchall()
+
+    def stats(self):
+        """Library totals and the LLM calls, time and tokens per pipeline step"""
+        totals = self.connection.execute(
+            "SELECT COUNT(*) AS books, COALESCE(SUM(chapters), 0) AS chapters, COALESCE(SUM(words), 0) AS words, "
+            "MIN(created_at) AS first, MAX(created_at) AS last FROM books"
+        ).fetchone()
+        steps = self.connection.execute(
+            """
+            SELECT step, COUNT(*) AS books, SUM(calls) AS calls, SUM(failed) AS failed, SUM(seconds) AS seconds,
+                   SUM(prompt_tokens) AS prompt_tokens, SUM(output_tokens) AS output_tokens
+            FROM run_steps GROUP BY step ORDER BY SUM(seconds) DESC
+            """
+        ).fetchall()
+        return totals, steps
+
+    def close(self):
+        self.connection.close()
+
+
+def find_books(directory):
+    """Yield the generated book files of a directory tree"""
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.endswith(".md") and os.path.exists(os.path.join(root, name[:-3] + "_metadata.json")):
+                yield os.path.join(root, name)
+            elif name.endswith(".md") and os.path.exists(os.path.join(root, name[:-3] + "_index.json")):
+                # A book still being written, or one whose run crashed before saving the metadata
+                yield os.path.join(root, name)
+
+
+def created_at(path, stat):
+    """Creation time of a book from its file name, or the file's modification time"""
+    match = FILENAME_TIMESTAMP.search(path)
+    if match:
+        return datetime.datetime.strptime(match.group(1), "%Y%m%d_%H%M%S").isoformat()
+    return datetime.datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds")
+
+
+def read_book(path, premise=None):
+    """Return the title and the (number, heading, text) of each chapter of a book file"""
+    return read_title(path), list(iter_chapters(path, premise))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Catalog and search the generated books of an output directory.")
+    parser.add_argument("--db", type=str, default="./output/catalog.sqlite", help="SQLite catalog database (default: ./output/catalog.sqlite)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Add new and changed books to the catalog")
+    ingest_parser.add_argument("--dir", type=str, default="./output", help="Directory tree with the generated books (default: ./output)")
+    ingest_parser.add_argument("--prune", action="store_true", help="Drop catalogued books of that directory whose files are gone")
+
+    search_parser = subparsers.add_parser("search", help="Full-text search over chapters or chapter summaries")
+    search_parser.add_argument("query", type=str, help="FTS5 query, e.g. 'lighthouse NEAR(keeper storm)'")
+    search_parser.add_argument("--in", dest="target", type=str, default="chapters", choices=["chapters", "summaries"], help="What to search (default: chapters)")
+    search_parser.add_argument("--limit", type=int, default=20, help="Maximum number of matches (default: 20)")
+
+    find_parser = subparsers.add_parser("find", help="Find books by character, world name or motif")
+    find_parser.add_argument("--character", type=str, default=None, help="Part of a character name")
+    find_parser.add_argument("--world", type=str, default=None, help="Part of the world name")
+    find_parser.add_argument("--motif", type=str, default=None, help="Part of a recurring motif")
+
+    subparsers.add_parser("stats", help="Show library totals and the run telemetry per pipeline step")
+
+    args = parser.parse_args()
+    catalog = BookCatalog(args.db)
+
+    if args.command == "ingest":
+        started = time.monotonic()
+        added, updated, unchanged, removed = catalog.ingest(args.dir, prune=args.prune)
+        print(f"Catalog {args.db}: {added} added, {updated} updated, {unchanged} unchanged, {removed} removed "
+              f"in {time.monotonic() - started:.2f}s")
+    elif args.command == "search":
+        for row in catalog.search(args.query, target=args.target, limit=args.limit):
+            print(f"{row['path']} chapter {row['chapter']}: {row['snippet']}")
+    elif args.command == "find":
+        if not (args.character or args.world or args.motif):
+            parser.error("Give --character, --world or --motif")
+        for row in catalog.find_books(character=args.character, world=args.world, motif=args.motif):
+            print(f"{row['path']} ({row['created_at']}, {row['chapters']} chapters, {row['words']} words) world: {row['world_name'] or '-'}")
+    elif args.command == "stats":
+        totals, steps = catalog.stats()
+        print(f"{totals['books']} books, {totals['chapters']} chapters, {totals['words']} words "
+              f"({totals['first'] or '-'} to {totals['last'] or '-'})")
+        if steps:
+            print(f"{'step':<32}{'books':>7}{'calls':>8}{'failed':>8}{'seconds':>10}{'prompt tok':>12}{'output tok':>12}")
+            for row in steps:
+                print(f"{row['step']:<32}{row['books']:>7}{row['calls']:>8}{row['failed']:>8}{row['seconds']:>10.1f}"
+                      f"{row['prompt_tokens']:>12}{row['output_tokens']:>12}")
+    catalog.close()
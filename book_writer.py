@@ -0,0 +1,193 @@
+import json
+import os
+import re
+import shutil
+
+
+# Chapter headings of books written before the _index.json files: "## Chapter 3: Title",
+# "## Title" or "**Chapter 3: Title**", in the languages the generator writes
+CHAPTER_HEADING = re.compile(r"^(## (?!Story Premise\s*$)|\*\*\s*(Chapter|Capitolo|Chapitre|Capítulo|Kapitel)\s+\d+)")
+
+
+class BookWriter:
+    """Writes a book's markdown file chapter by chapter, as each chapter becomes final
+
+    The title is only known once every chapter is written, so the header starts with a
+    blank title slot; set_title rewrites the header to the title's exact length, leaving
+    no padding in the finished book. A sidecar _index.json file
+    holds the byte offset and length of every written chapter; it is what lets a
+    resumed writer (another job queue worker) continue the file, and lets readers pull
+    single chapters without loading the book.
+    """
+
+    def __init__(self, path, resume=False, title_slot=512, guard=None):
+        self.path = path
+        # Optional callable run before every write, raising to stop a writer that must not write
+        self.guard = guard
+        self.index_path = path[:-3] + "_index.json" if path.endswith(".md") else path + ".index.json"
+        self.title_slot = title_slot
+        if resume and os.path.exists(self.index_path) and os.path.exists(path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+            self.file = open(path, "r+b")
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.index = {"title": None, "title_offset": None, "title_size": title_slot, "header_end": None, "chapters": []}
+            self.file = open(path, "w+b")
+
+    @property
+    def started(self):
+        return self.index["header_end"] is not None
+
+    @property
+    def words(self):
+        return sum(entry["words"] for entry in self.index["chapters"])
+
+    def start(self, premise):
+        """Write the header: the empty title slot and the story premise"""
+        if self.guard is not None:
+            self.guard()
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(b"# ")
+        self.index["title_offset"] = self.file.tell()
+        self.file.write(b" " * self.title_slot + b"\n\n")
+        self.file.write(f"## Story Premise\n\n{premise}\n\n".encode("utf-8"))
+        self.index["header_end"] = self.file.tell()
+        self.index["chapters"] = []
+        self.sync()
+
+    def write_chapter(self, chapter_num, text):
+        """Append a final chapter; writing a chapter again replaces it and everything after it"""
+        if self.guard is not None:
+            self.guard()
+        chapters = [entry for entry in self.index["chapters"] if entry["chapter"] < chapter_num]
+        end = chapters[-1]["offset"] + chapters[-1]["length"] + 2 if chapters else self.index["header_end"]
+        data = text.encode("utf-8")
+        self.file.seek(end)
+        self.file.truncate()
+        self.file.write(data + b"\n\n")
+        chapters.append({"chapter": chapter_num, "offset": end, "length": len(data), "words": len(text.split())})
+        self.index["chapters"] = chapters
+        self.sync()
+
+    def read_chapter(self, chapter_num):
+        """Read one written chapter back from the file"""
+        for entry in self.index["chapters"]:
+            if entry["chapter"] == chapter_num:
+                self.file.seek(entry["offset"])
+                return self.file.read(entry["length"]).decode("utf-8")
+        raise KeyError(f"Chapter {chapter_num} has not been written")
+
+    def set_title(self, title):
+        """Fill in the title slot, rewriting the file once unless the title fills it exactly"""
+        if self.guard is not None:
+            self.guard()
+        data = title.encode("utf-8")
+        self.index["title"] = title
+        if len(data) == self.index["title_size"]:
+            self.file.seek(self.index["title_offset"])
+            self.file.write(data)
+            self.sync()
+            return
+        # Copy the file behind a header of the title's size in chunks, so the book is never
+        # held in memory and no padding is left behind
+        shift = len(data) - self.index["title_size"]
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as target:
+            target.write(b"# " + data)
+            self.file.seek(self.index["title_offset"] + self.index["title_size"])
+            shutil.copyfileobj(self.file, target)
+        self.file.close()
+        os.replace(temp_path, self.path)
+        self.file = open(self.path, "r+b")
+        self.index["title_size"] = len(data)
+        self.index["header_end"] += shift
+        for entry in self.index["chapters"]:
+            entry["offset"] += shift
+        self.sync()
+
+    def sync(self):
+        """Flush the file to disk and replace the index, so a crash leaves a consistent pair"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(temp_path, self.index_path)
+
+    def close(self):
+        """Close the book file"""
+        if not self.file.closed:
+            self.file.close()
+
+
+def read_title(path):
+    """Title of a book file, from its index or from the lines before the premise"""
+    index_path = path[:-3] + "_index.json"
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            return (json.load(f)["title"] or "").strip() or None
+    title_lines = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("## Story Premise"):
+                break
+            title_lines.append(line)
+    title = "".join(title_lines).strip()
+    if title.startswith("# "):
+        title = title[2:]
+    return title or None
+
+
+def iter_chapters(path, premise=None):
+    """Yield the (number, heading, text) of each chapter of a book file, one at a time
+
+    Books with an _index.json file are split at the recorded chapter offsets; older books
+    at their chapter headings, one line at a time. An older book without any chapter
+    heading becomes one chapter holding everything after the premise.
+    """
+    index_path = path[:-3] + "_index.json"
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        with open(path, "rb") as f:
+            for entry in index["chapters"]:
+                f.seek(entry["offset"])
+                text = f.read(entry["length"]).decode("utf-8")
+                yield entry["chapter"], chapter_heading(text), text
+        return
+
+    premise_lines, lines, number = None, None, 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if premise_lines is None:
+                if line.startswith("## Story Premise"):
+                    premise_lines = []
+            elif CHAPTER_HEADING.match(line):
+                text = "".join(lines).strip() if lines is not None else ""
+                if text:
+                    number += 1
+                    yield number, chapter_heading(text), text
+                lines = [line]
+            elif lines is not None:
+                lines.append(line)
+            else:
+                premise_lines.append(line)
+    text = "".join(lines).strip() if lines is not None else ""
+    if text:
+        yield number + 1, chapter_heading(text), text
+    elif number == 0 and premise_lines:
+        body = "".join(premise_lines).strip()
+        if premise and body.startswith(premise.strip()):
+            body = body[len(premise.strip()):].strip()
+        if body:
+            yield 1, chapter_heading(body), body
+
+
+def chapter_heading(text):
+    """First line of a chapter without its markdown markers"""
+    first_line = text.strip().split("\n", 1)[0] if text.strip() else ""
+    return first_line.strip("#* ").strip() or None
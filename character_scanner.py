@@ -0,0 +1,93 @@
+from collections import deque
+
+
+class CharacterScanner:
+    """Aho-Corasick matcher that finds every cast member mentioned in a text in a single pass"""
+
+    def __init__(self, characters):
+        # Each node is a dict of transitions; fail links and outputs are kept in parallel lists
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        self.names = list(characters.keys())
+        for pattern, name in self.build_patterns(characters).items():
+            self.add_pattern(pattern, name)
+        self.build_fail_links()
+
+    def build_patterns(self, characters):
+        """Map every pattern (full name, aliases, unambiguous first/last names) to a character"""
+        patterns = {}
+        for name, data in characters.items():
+            patterns[name] = name
+            aliases = data.get("aliases", []) if isinstance(data, dict) else []
+            for alias in aliases:
+                if alias and alias not in patterns:
+                    patterns[alias] = name
+
+        # First and last names only count when a single character uses them
+        part_owners = {}
+        for name in characters:
+            parts = name.split()
+            if len(parts) < 2:
+                continue
+            for part in (parts[0], parts[-1]):
+                if len(part) >= 3 and part[0].isupper():
+                    part_owners.setdefault(part, set()).add(name)
+        for part, owners in part_owners.items():
+            if len(owners) == 1 and part not in patterns:
+                patterns[part] = next(iter(owners))
+        return patterns
+
+    def add_pattern(self, pattern, name):
+        """Insert a pattern into the trie"""
+        node = 0
+        for char in pattern:
+            if char not in self.goto[node]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[node][char] = len(self.goto) - 1
+            node = self.goto[node][char]
+        self.output[node].append((len(pattern), name))
+
+    def build_fail_links(self):
+        """Compute failure links breadth-first and merge outputs along them"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def scan(self, text):
+        """Return {name: {"count": int, "positions": [offsets]}} for every character mentioned in text"""
+        mentions = {}
+        if not text:
+            return mentions
+        span_ends = {}
+        node = 0
+        text_length = len(text)
+        for index, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for length, name in self.output[node]:
+                start = index - length + 1
+                # Only whole-word matches count ("Ann" must not match inside "Anna")
+                if start > 0 and text[start - 1].isalnum():
+                    continue
+                if index + 1 < text_length and text[index + 1].isalnum():
+                    continue
+                # Overlapping patterns of the same character ("Ann", "Ann Lee", "Lee") count once
+                if start < span_ends.get(name, 0):
+                    span_ends[name] = max(span_ends[name], index + 1)
+                    continue
+                span_ends[name] = index + 1
+                entry = mentions.setdefault(name, {"count": 0, "positions": []})
+                entry["count"] += 1
+                entry["positions"].append(start)
+        return mentions
@@ -0,0 +1,186 @@
+import contextlib
+import io
+import json
+import statistics
+
+from mock_llm_server import MOCK_WORDS, MockBehaviour, MockLLMServer
+from novel_generator import BookGenerator
+
+
+# Short real call used to measure a backend when no earlier run's telemetry is given
+PROBE_PROMPT = "Write a short paragraph of about 150 words describing a harbour town at dawn."
+# About 2000 tokens of context for the long probe call
+PROBE_CONTEXT = " ".join(MOCK_WORDS * 20)
+
+
+class RunEstimator:
+    """Projects the calls, tokens, time and cost of a book before it is generated
+
+    The pipeline runs for real against an in-process mock server that answers instantly
+    with replies of realistic shape and length, so the calls made and the tokens they
+    carry are counted per stage. Time is projected from the throughput of the selected
+    backend, measured by a probe call or taken from an earlier run's telemetry.
+    """
+
+    def __init__(self, generator_options, fix_rate=0.2, chapter_words=2000, price_input=0.0, price_output=0.0):
+        self.generator_options = dict(generator_options)
+        # Share of consistency checks that find issues and send the chapter to a fix
+        self.fix_rate = fix_rate
+        self.chapter_words = chapter_words
+        # Prices in USD per million tokens
+        self.price_input = price_input
+        self.price_output = price_output
+
+    def backend_options(self):
+        """Generator options without the ones that would make the estimate wait, record or trace"""
+        options = dict(self.generator_options)
+        for key in ("rate_limiter", "max_concurrency", "hedge_percentile", "trace_path", "cassette"):
+            options.pop(key, None)
+        return options
+
+    def simulate(self):
+        """Walk the pipeline against the mock server and return the telemetry per step"""
+        behaviour = MockBehaviour(
+            latency=0.0,
+            latency_distribution="fixed",
+            tokens_per_second=0,
+            prompt_tokens_per_second=0,
+            inconsistency_rate=self.fix_rate,
+            chapter_words=self.chapter_words,
+        )
+        server = MockLLMServer(port=0, behaviour=behaviour).start()
+        try:
+            generator = BookGenerator(**dict(self.backend_options(), base_url=server.url, chapter_pause_seconds=0))
+            # The pipeline prints every reply; only the estimate matters here
+            with contextlib.redirect_stdout(io.StringIO()):
+                generator.generate_book()
+        finally:
+            server.shutdown()
+        return generator.telemetry_summary()
+
+    def probe_throughput(self):
+        """Measure the selected backend with a few short calls; None when it cannot be reached"""
+        generator = BookGenerator(**self.backend_options())
+        # A short and a long prompt separate prompt evaluation from fixed latency; the first
+        # call may also load the model, which the load time in its telemetry accounts for
+        for context in (None, PROBE_CONTEXT, None):
+            if generator.generate_text(PROBE_PROMPT, context=context) is None:
+                return None
+        return throughput_from_records(generator.telemetry)
+
+    def estimate(self, throughput=None):
+        """Return the estimate per step and in total"""
+        steps = self.simulate()
+        report = {"steps": {}, "throughput": throughput}
+        totals = {"calls": 0, "prompt_tokens": 0, "output_tokens": 0, "seconds": 0.0 if throughput else None, "cost": 0.0}
+        for step, figures in steps.items():
+            entry = {
+                "calls": figures["calls"],
+                "prompt_tokens": figures["prompt_tokens"],
+                "output_tokens": figures["output_tokens"],
+                "seconds": project_seconds(figures, throughput),
+                "cost": round(
+                    figures["prompt_tokens"] / 1e6 * self.price_input + figures["output_tokens"] / 1e6 * self.price_output, 4
+                ),
+            }
+            report["steps"][step] = entry
+            for key in ("calls", "prompt_tokens", "output_tokens", "cost"):
+                totals[key] += entry[key]
+            if throughput:
+                totals["seconds"] += entry["seconds"]
+        totals["cost"] = round(totals["cost"], 4)
+        if throughput:
+            # Serial time: every call's time added up, plus the pauses between chapters. Speculative
+            # analysis and concurrent requests overlap calls, but how much that saves depends on
+            # how the backend shares its throughput, which the probe does not measure
+            report["overlapping"] = bool(
+                self.generator_options.get("speculative") or (self.generator_options.get("max_concurrency") or 1) > 1
+            )
+            chapters = self.generator_options.get("num_chapters", 3)
+            totals["seconds"] = round(totals["seconds"] + self.generator_options.get("chapter_pause_seconds", 3) * (chapters - 1), 1)
+        report["total"] = totals
+        return report
+
+
+def throughput_from_records(records):
+    """Output and prompt token rates and the fixed time per call, from call telemetry records
+
+    The prompt rate is fitted over the calls' prompt sizes and times to first token, so
+    the fixed latency of a call does not count as prompt evaluation. Returns None when
+    the records hold no usable token counts.
+    """
+    usable = [
+        record for record in records
+        if record.get("ok") and record.get("output_tokens") and record.get("tokens_per_second")
+    ]
+    if not usable:
+        return None
+    output_tokens = sum(record["output_tokens"] for record in usable)
+    output_seconds = sum(record["output_tokens"] / record["tokens_per_second"] for record in usable)
+    # Time to first token against prompt size, without any model load
+    samples = [
+        (record["prompt_tokens"], record["ttft"] - (record.get("load_seconds") or 0))
+        for record in usable
+        if record.get("prompt_tokens") and record.get("ttft")
+    ]
+    prompt_rate = None
+    if len({tokens for tokens, _ in samples}) > 1:
+        mean_tokens = statistics.mean(tokens for tokens, _ in samples)
+        mean_seconds = statistics.mean(seconds for _, seconds in samples)
+        covariance = sum((tokens - mean_tokens) * (seconds - mean_seconds) for tokens, seconds in samples)
+        variance = sum((tokens - mean_tokens) ** 2 for tokens, _ in samples)
+        if covariance > 0:
+            prompt_rate = variance / covariance
+    overheads = []
+    for record in usable:
+        seconds = record["total_seconds"] - record["queue_wait"] - record["output_tokens"] / record["tokens_per_second"]
+        if prompt_rate and record.get("prompt_tokens"):
+            seconds -= record["prompt_tokens"] / prompt_rate
+        overheads.append(max(0.0, seconds))
+    return {
+        "output_tokens_per_second": round(output_tokens / output_seconds, 2),
+        # Without a fitted prompt rate the prompt evaluation is part of the per-call overhead
+        "prompt_tokens_per_second": round(prompt_rate, 2) if prompt_rate else None,
+        "call_overhead_seconds": round(statistics.median(overheads), 3),
+        "calls": len(usable),
+    }
+
+
+def throughput_from_metadata(path):
+    """Throughput of the backend as seen by an earlier run, from its _metadata.json file"""
+    with open(path, "r", encoding="utf-8") as f:
+        metadata = json.load(f)
+    return throughput_from_records(metadata.get("telemetry", {}).get("calls", []))
+
+
+def project_seconds(figures, throughput):
+    """Time the calls of one step take at the given throughput"""
+    if not throughput:
+        return None
+    seconds = figures["calls"] * throughput["call_overhead_seconds"]
+    seconds += figures["output_tokens"] / throughput["output_tokens_per_second"]
+    if throughput["prompt_tokens_per_second"]:
+        seconds += figures["prompt_tokens"] / throughput["prompt_tokens_per_second"]
+    return round(seconds, 1)
+
+
+def print_estimate(report, chapters):
+    """Print the estimate as a table with one line per step"""
+    print("----------------- Estimate per step -----------------")
+    print(f"{'step':<32}{'calls':>7}{'prompt tok':>12}{'output tok':>12}{'time':>10}{'cost':>10}")
+    for step, entry in report["steps"].items():
+        seconds = f"{entry['seconds']:.0f}s" if entry["seconds"] is not None else "-"
+        print(f"{step:<32}{entry['calls']:>7}{entry['prompt_tokens']:>12}{entry['output_tokens']:>12}{seconds:>10}{entry['cost']:>10.4f}")
+    total = report["total"]
+    print(f"Total: {total['calls']} calls ({total['calls'] / chapters:.1f} per chapter), "
+          f"{total['prompt_tokens']} prompt and {total['output_tokens']} output tokens, cost {total['cost']:.4f} USD")
+    throughput = report["throughput"]
+    if throughput:
+        prompt_rate = f"{throughput['prompt_tokens_per_second']} prompt tok/s, " if throughput["prompt_tokens_per_second"] else ""
+        print(f"Projected serial time: {total['seconds'] / 60:.1f} minutes at {throughput['output_tokens_per_second']} output tok/s, "
+              f"{prompt_rate}{throughput['call_overhead_seconds']}s per call")
+        if report.get("overlapping"):
+            print("Calls run one after another in this figure; speculative or concurrent calls overlap, "
+                  "so the wall time can be shorter if the backend serves them in parallel.")
+    else:
+        print("No throughput measurement of the backend, time is not projected.")
@@ -0,0 +1,277 @@
+import argparse
+import datetime
+import html
+import json
+import os
+import re
+import shutil
+import uuid
+import zipfile
+
+from book_writer import iter_chapters, read_title
+
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+STYLESHEET = """body { font-family: serif; line-height: 1.5; margin: 0 5%; }
+h1 { text-align: center; margin: 2em 0 1em; }
+p { text-indent: 1.5em; margin: 0; }
+h1 + p, hr + p { text-indent: 0; }
+hr { border: none; text-align: center; margin: 1em 0; }
+hr::after { content: "* * *"; }
+.cover { text-align: center; margin: 0; padding: 0; }
+.cover img { max-width: 100%; max-height: 100%; }
+"""
+
+XHTML_PAGE = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="{language}" lang="{language}">
+<head>
+  <meta charset="UTF-8"/>
+  <title>{title}</title>
+  <link rel="stylesheet" type="text/css" href="style.css"/>
+</head>
+<body{body_class}>
+{body}
+</body>
+</html>
+"""
+
+# A chapter's first line naming it without markdown, e.g. "Chapter 3: The Storm"
+CHAPTER_LINE = re.compile(r"^(Chapter|Capitolo|Chapitre|Capítulo|Kapitel)\s+\d+\b.{0,100}$")
+
+COVER_MEDIA_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".gif": "image/gif", ".svg": "image/svg+xml"}
+
+
+class EpubWriter:
+    """Writes an EPUB 3 file section by section, as the chapters of a book arrive
+
+    Each chapter is converted from markdown to an XHTML entry of the zip container as soon
+    as it is added, and only its file name and title are kept. The package document, the
+    navigation document and an NCX table of contents for EPUB 2 readers are written by
+    close, once the title is known.
+    """
+
+    def __init__(self, path, language="en", author=None, cover=None):
+        self.path = path
+        self.language = language or "en"
+        self.author = author
+        self.title = None
+        self.sections = []
+        self.cover = None
+        if cover and os.path.splitext(cover)[1].lower() not in COVER_MEDIA_TYPES:
+            raise ValueError(f"Unsupported cover image type: {cover}")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.zip = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        # The mimetype must be the first entry, stored uncompressed
+        self.zip.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        self.zip.writestr("META-INF/container.xml", CONTAINER_XML)
+        self.zip.writestr("OEBPS/style.css", STYLESHEET)
+        if cover:
+            self.add_cover(cover)
+
+    def add_cover(self, image_path):
+        """Copy a cover image into the container, with a page that shows it"""
+        extension = os.path.splitext(image_path)[1].lower()
+        name = f"images/cover{extension}"
+        # Images are already compressed
+        with open(image_path, "rb") as source, self.zip.open(zipfile.ZipInfo(f"OEBPS/{name}"), "w") as target:
+            shutil.copyfileobj(source, target)
+        self.cover = (name, COVER_MEDIA_TYPES[extension])
+        body = f'<div class="cover"><img src="{name}" alt="Cover"/></div>'
+        self.zip.writestr("OEBPS/cover.xhtml", self.page("Cover", body, body_class="cover"))
+
+    def add_section(self, title, text):
+        """Convert a markdown section to an XHTML entry and add it to the reading order"""
+        name = f"section_{len(self.sections) + 1:03d}.xhtml"
+        self.zip.writestr(f"OEBPS/{name}", self.page(title, markdown_to_xhtml(text)))
+        self.sections.append((name, title))
+        return name
+
+    def add_chapter(self, chapter_num, text):
+        """Add a chapter, titled after its heading"""
+        return self.add_section(chapter_title(text) or f"Chapter {chapter_num}", text)
+
+    def set_title(self, title):
+        """Title of the book, written to the package and navigation documents by close"""
+        self.title = title
+
+    def page(self, title, body, body_class=None):
+        return XHTML_PAGE.format(
+            language=self.language,
+            title=html.escape(title),
+            body=body,
+            body_class=f' class="{body_class}"' if body_class else "",
+        )
+
+    def close(self):
+        """Write the navigation and package documents and finish the container"""
+        if self.zip.fp is None:
+            return
+        title = clean_title(self.title) or "Untitled"
+        identifier = f"urn:uuid:{uuid.uuid4()}"
+        links = "\n".join(
+            f'      <li><a href="{name}">{html.escape(section_title)}</a></li>' for name, section_title in self.sections
+        )
+        nav = f'<nav epub:type="toc" id="toc">\n    <h1>{html.escape(title)}</h1>\n    <ol>\n{links}\n    </ol>\n  </nav>'
+        self.zip.writestr("OEBPS/nav.xhtml", self.page(title, nav))
+        self.zip.writestr("OEBPS/toc.ncx", self.ncx(identifier, title))
+        self.zip.writestr("OEBPS/content.opf", self.package(identifier, title))
+        self.zip.close()
+
+    def ncx(self, identifier, title):
+        """NCX table of contents for EPUB 2 reading systems"""
+        points = "\n".join(
+            f'    <navPoint id="nav{number}" playOrder="{number}"><navLabel><text>{html.escape(section_title)}</text></navLabel>'
+            f'<content src="{name}"/></navPoint>'
+            for number, (name, section_title) in enumerate(self.sections, 1)
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">\n'
+            f'  <head><meta name="dtb:uid" content="{identifier}"/></head>\n'
+            f"  <docTitle><text>{html.escape(title)}</text></docTitle>\n"
+            f"  <navMap>\n{points}\n  </navMap>\n"
+            "</ncx>\n"
+        )
+
+    def package(self, identifier, title):
+        """Package document: metadata, manifest of every entry and the reading order"""
+        modified = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        metadata = [
+            f'<dc:identifier id="book-id">{identifier}</dc:identifier>',
+            f"<dc:title>{html.escape(title)}</dc:title>",
+            f"<dc:language>{html.escape(self.language)}</dc:language>",
+            f'<meta property="dcterms:modified">{modified}</meta>',
+        ]
+        if self.author:
+            metadata.append(f"<dc:creator>{html.escape(self.author)}</dc:creator>")
+        manifest = [
+            '<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>',
+            '<item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>',
+            '<item id="style" href="style.css" media-type="text/css"/>',
+        ]
+        spine = []
+        if self.cover:
+            # The meta element is how EPUB 2 readers find the cover image
+            metadata.append('<meta name="cover" content="cover-image"/>')
+            manifest.append(f'<item id="cover-image" href="{self.cover[0]}" media-type="{self.cover[1]}" properties="cover-image"/>')
+            manifest.append('<item id="cover" href="cover.xhtml" media-type="application/xhtml+xml"/>')
+            spine.append('<itemref idref="cover" linear="no"/>')
+        for number, (name, _) in enumerate(self.sections, 1):
+            manifest.append(f'<item id="s{number}" href="{name}" media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="s{number}"/>')
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">\n'
+            '  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n    ' + "\n    ".join(metadata) + "\n  </metadata>\n"
+            "  <manifest>\n    " + "\n    ".join(manifest) + "\n  </manifest>\n"
+            '  <spine toc="ncx">\n    ' + "\n    ".join(spine) + "\n  </spine>\n"
+            "</package>\n"
+        )
+
+
+def inline_markdown(text):
+    """Escape a line of text and convert its bold and italic markers"""
+    text = html.escape(text, quote=False)
+    text = re.sub(r"\*\*(.+?)\*\*", r"<strong>\1</strong>", text)
+    text = re.sub(r"(?<![\w*])\*(?!\s)(.+?)(?<!\s)\*(?![\w*])", r"<em>\1</em>", text)
+    text = re.sub(r"(?<!\w)_(?!\s)(.+?)(?<!\s)_(?!\w)", r"<em>\1</em>", text)
+    return text
+
+
+def markdown_to_xhtml(text):
+    """Convert the markdown the pipeline writes (headings, paragraphs, scene breaks, lists) to XHTML"""
+    blocks = []
+    for block in re.split(r"\n\s*\n", text.strip()):
+        lines = [line.strip() for line in block.strip().split("\n") if line.strip()]
+        if not lines:
+            continue
+        heading = re.match(r"^(#{1,6})\s+(.*)$", lines[0])
+        if heading:
+            level = min(len(heading.group(1)), 3) if blocks else 1
+            blocks.append(f"<h{level}>{inline_markdown(heading.group(2).strip('# '))}</h{level}>")
+            lines = lines[1:]
+        elif not blocks and (re.fullmatch(r"\*\*[^*]+\*\*", lines[0]) or CHAPTER_LINE.match(lines[0])):
+            # "**Chapter 1: Title**" or "Chapter 1: Title" opening a chapter
+            blocks.append(f"<h1>{inline_markdown(lines[0].strip('*'))}</h1>")
+            lines = lines[1:]
+        if not lines:
+            continue
+        if all(re.fullmatch(r"[*\-_ ]{3,}", line) for line in lines):
+            blocks.append("<hr/>")
+        elif all(re.match(r"^([*\-+]|\d+\.)\s+", line) for line in lines):
+            tag = "ol" if re.match(r"^\d+\.", lines[0]) else "ul"
+            items = "".join(f"<li>{inline_markdown(re.sub(r'^([*+-]|[0-9]+[.])[ ]+', '', line))}</li>" for line in lines)
+            blocks.append(f"<{tag}>{items}</{tag}>")
+        else:
+            blocks.append("<p>" + "<br/>".join(inline_markdown(line) for line in lines) + "</p>")
+    return "\n".join(blocks)
+
+
+def chapter_title(text):
+    """Title of a chapter for the table of contents, from its first line when that is a heading"""
+    first_line = text.strip().split("\n", 1)[0].strip() if text.strip() else ""
+    if first_line.startswith("#") or re.fullmatch(r"\*\*[^*]+\*\*", first_line) or CHAPTER_LINE.match(first_line):
+        return first_line.strip("#* ").strip() or None
+    return None
+
+
+def clean_title(title):
+    """First title of a generated title answer, without markdown, list numbering or quotes
+
+    Models often answer with an introduction ("Here are three title options:") and a list
+    of titles with explanations; the introduction is skipped and a bold title preferred.
+    """
+    for line in (title or "").split("\n"):
+        line = re.sub(r"^(#+|\d+\.|[*\-+](?=\s))\s*", "", line.strip()).strip()
+        if not line or line.endswith(":"):
+            continue
+        bold = re.search(r"\*\*(.+?)\*\*", line)
+        line = bold.group(1) if bold else line
+        line = line.strip("*\"' ")
+        if line:
+            return line
+    return None
+
+
+def export_epub(book_path, epub_path=None, cover=None, language="en", author=None):
+    """Convert a generated book file to EPUB, reading one chapter at a time; returns the EPUB path"""
+    epub_path = epub_path or os.path.splitext(book_path)[0] + ".epub"
+    metadata_path = book_path[:-3] + "_metadata.json"
+    premise = None
+    if os.path.exists(metadata_path):
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            premise = json.load(f).get("premise")
+    writer = EpubWriter(epub_path, language=language, author=author, cover=cover)
+    writer.set_title(read_title(book_path))
+    try:
+        if premise:
+            writer.add_section("Story Premise", f"## Story Premise\n\n{premise}")
+        for chapter_num, _, text in iter_chapters(book_path, premise):
+            writer.add_chapter(chapter_num, text)
+    finally:
+        writer.close()
+    return epub_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a generated book to EPUB.")
+    parser.add_argument("book", type=str, help="The generated markdown book")
+    parser.add_argument("--output", type=str, default=None, help="EPUB file to write (default: the book's name with .epub)")
+    parser.add_argument("--cover", type=str, default=None, help="Cover image (JPEG, PNG, GIF or SVG)")
+    parser.add_argument("--language", type=str, default="en", help="Language of the book (default: en)")
+    parser.add_argument("--author", type=str, default=None, help="Author shown by reading systems")
+
+    args = parser.parse_args()
+
+    epub_path = export_epub(args.book, args.output, cover=args.cover, language=args.language, author=args.author)
+    print(f"EPUB saved as {epub_path}")
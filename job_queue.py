@@ -0,0 +1,355 @@
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from multiprocessing import Process
+
+from batch_generator import MANIFEST_OPTIONS, load_manifest
+from book_writer import BookWriter
+from run_journal import RunJournal, journal_path
+from novel_generator import PIPELINE_PROFILES, BookGenerator
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    options TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    output TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER NOT NULL REFERENCES jobs(id),
+    seq INTEGER NOT NULL,
+    step TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    UNIQUE (job_id, seq)
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, lease_expires);
+"""
+
+
+class JobQueue:
+    """Durable SQLite-backed queue of book generation jobs split into step-level tasks
+
+    Each book becomes an ordered chain of tasks (outline, one per chapter, finish). A task can
+    be leased once the previous task of its book is done; leases expire, so work held by a
+    crashed worker is picked up again, up to max_attempts times. The book state is checkpointed
+    to state_dir after every task, and retries resume from the last checkpoint.
+    """
+
+    def __init__(self, db_path, state_dir=None, lease_seconds=900, max_attempts=3):
+        self.db_path = db_path
+        self.state_dir = state_dir or os.path.join(os.path.dirname(os.path.abspath(db_path)), "job_state")
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(self.state_dir, exist_ok=True)
+        self.connection = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def submit(self, name, options):
+        """Add a book job and its task chain; returns the job id"""
+        num_chapters = max(3, int(options.get("chapters", 3)))
+        options = dict(options, chapters=num_chapters)
+        steps = ["outline"] + [f"chapter:{i}" for i in range(1, num_chapters + 1)] + ["finish"]
+        with self.transaction():
+            cursor = self.connection.execute(
+                "INSERT INTO jobs (name, options, created_at) VALUES (?, ?, ?)",
+                (name, json.dumps(options), time.time()),
+            )
+            job_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO tasks (job_id, seq, step) VALUES (?, ?, ?)",
+                [(job_id, seq, step) for seq, step in enumerate(steps)],
+            )
+        return job_id
+
+    @contextmanager
+    def transaction(self):
+        """Run a write transaction that takes the database lock up front"""
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def lease(self, owner):
+        """Lease the next runnable task, or return None when nothing is runnable right now"""
+        now = time.time()
+        with self.transaction():
+            row = self.connection.execute(
+                """
+                SELECT t.*, j.options, j.name FROM tasks t JOIN jobs j ON j.id = t.job_id
+                WHERE j.status IN ('pending', 'running')
+                  AND (t.status = 'pending' OR (t.status = 'leased' AND t.lease_expires < ?))
+                  AND (t.seq = 0 OR EXISTS (
+                      SELECT 1 FROM tasks p WHERE p.job_id = t.job_id AND p.seq = t.seq - 1 AND p.status = 'done'))
+                ORDER BY t.job_id, t.seq
+                LIMIT 1
+                """,
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            if row["attempts"] >= self.max_attempts:
+                # The last lease of this task expired without completing it
+                self.mark_failed(row["id"], row["job_id"], row["lease_owner"], "lease expired after the last attempt")
+                return None
+            self.connection.execute(
+                "UPDATE tasks SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                (owner, now + self.lease_seconds, row["id"]),
+            )
+            self.connection.execute("UPDATE jobs SET status = 'running' WHERE id = ?", (row["job_id"],))
+        return dict(row)
+
+    def renew(self, task_id, owner):
+        """Extend a lease still held by owner; returns False if the lease was lost"""
+        with self.transaction():
+            cursor = self.connection.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+                (time.time() + self.lease_seconds, task_id, owner),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, task, owner, output=None):
+        """Mark a leased task done, and its job when it was the last step"""
+        with self.transaction():
+            cursor = self.connection.execute(
+                "UPDATE tasks SET status = 'done', lease_expires = NULL WHERE id = ? AND lease_owner = ?",
+                (task["id"], owner),
+            )
+            if cursor.rowcount == 1 and task["step"] == "finish":
+                self.connection.execute(
+                    "UPDATE jobs SET status = 'done', output = ?, finished_at = ? WHERE id = ?",
+                    (output, time.time(), task["job_id"]),
+                )
+
+    def fail(self, task, owner, error):
+        """Return a task to the queue after an error, or fail its job once attempts are used up"""
+        with self.transaction():
+            if task["attempts"] + 1 >= self.max_attempts:
+                self.mark_failed(task["id"], task["job_id"], owner, error)
+            else:
+                self.connection.execute(
+                    "UPDATE tasks SET status = 'pending', lease_owner = NULL, lease_expires = NULL, last_error = ? "
+                    "WHERE id = ? AND lease_owner = ?",
+                    (error, task["id"], owner),
+                )
+
+    def mark_failed(self, task_id, job_id, owner, error):
+        """Fail a task still leased by owner, and its job (must run inside a transaction)"""
+        cursor = self.connection.execute(
+            "UPDATE tasks SET status = 'failed', lease_expires = NULL, last_error = ? WHERE id = ? AND lease_owner IS ?",
+            (error, task_id, owner),
+        )
+        # A worker whose lease expired must not fail the task another worker is now running
+        if cursor.rowcount == 1:
+            self.connection.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ? WHERE id = ?", (time.time(), job_id)
+            )
+
+    def has_open_tasks(self):
+        """Check whether any job still has work left"""
+        row = self.connection.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')"
+        ).fetchone()
+        return row[0] > 0
+
+    def status(self):
+        """Return a summary of the jobs and their task progress"""
+        rows = self.connection.execute(
+            """
+            SELECT j.id, j.name, j.status, j.output,
+                   SUM(t.status = 'done') AS done, COUNT(t.id) AS total
+            FROM jobs j JOIN tasks t ON t.job_id = j.id
+            GROUP BY j.id ORDER BY j.id
+            """
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def state_path(self, job_id):
+        """Path of the checkpoint file of a job"""
+        return os.path.join(self.state_dir, f"job_{job_id}.json")
+
+
+class LeaseLost(RuntimeError):
+    """The lease of a running task expired and another worker may have taken it over"""
+
+
+def build_generator(options):
+    """Create a BookGenerator from a job's stored options"""
+    kwargs = {}
+    for key, value in options.items():
+        if key in ("id", "output"):
+            continue
+        kwargs[MANIFEST_OPTIONS.get(key, key)] = value
+    return BookGenerator(**kwargs)
+
+
+def run_task(queue, task, lease_lost=None):
+    """Run one step of a book, resuming from and checkpointing the job's state file
+
+    lease_lost is set by the worker's heartbeat when the lease could not be renewed; the
+    step then stops before its next write to the book file, the checkpoint or the metadata,
+    which the worker now holding the task resumes from.
+    """
+    def ensure_lease():
+        if lease_lost is not None and lease_lost.is_set():
+            raise LeaseLost(f"Lost the lease on task {task['id']}, abandoning the step without writing")
+
+    options = json.loads(task["options"])
+    generator = build_generator(options)
+    state_path = queue.state_path(task["job_id"])
+    if os.path.exists(state_path):
+        generator.load_state(state_path)
+
+    step = task["step"]
+    output = None
+    if step == "outline":
+        # Chapters go to the book file as they are finished, whichever worker runs them
+        generator.book_path = generator.timestamped_filename(options.get("output") or f"./output/{task['name']}.md")
+    # Every step appends its state changes to the book's journal
+    generator.journal = RunJournal(journal_path(generator.book_path))
+    try:
+        if step == "outline":
+            generator.get_user_input()
+            generator.journal_event("premise", text=generator.story_premise)
+            generator.create_story_outline()
+            ensure_lease()
+            writer = BookWriter(generator.book_path, guard=ensure_lease)
+            writer.start(generator.story_premise)
+            writer.close()
+        else:
+            generator.book_writer = BookWriter(generator.book_path, resume=True, guard=ensure_lease)
+            try:
+                if step.startswith("chapter:"):
+                    chapter_num = int(step.split(":")[1])
+                    # A crash after the checkpoint but before the task was marked done must not add the chapter twice
+                    if len(generator.chapters) < chapter_num:
+                        generator.chapters.append(generator.generate_chapter(chapter_num))
+                        generator.finalize_chapter(chapter_num)
+                elif step == "finish":
+                    generator.compile_book()
+                    output = generator.book_path
+            finally:
+                generator.book_writer.close()
+    finally:
+        generator.journal.close()
+    ensure_lease()
+    if output:
+        generator.save_metadata(output)
+    generator.save_state(state_path)
+    return output
+
+
+def run_worker(db_path, state_dir=None, worker_id=None, lease_seconds=900, max_attempts=3, poll_seconds=5,
+               exit_when_idle=False):
+    """Lease and run tasks until stopped (or until no work is left with exit_when_idle)"""
+    queue = JobQueue(db_path, state_dir=state_dir, lease_seconds=lease_seconds, max_attempts=max_attempts)
+    owner = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    print(f"[worker {owner}] started on {db_path}")
+    while True:
+        task = queue.lease(owner)
+        if task is None:
+            if exit_when_idle and not queue.has_open_tasks():
+                print(f"[worker {owner}] no work left, exiting")
+                return
+            time.sleep(poll_seconds)
+            continue
+
+        print(f"[worker {owner}] job {task['job_id']} ({task['name']}): {task['step']} (attempt {task['attempts'] + 1})")
+        # Keep the lease alive from a separate connection while the step runs
+        stop_heartbeat = threading.Event()
+        lease_lost = threading.Event()
+
+        def heartbeat():
+            heartbeat_queue = JobQueue(db_path, state_dir=state_dir, lease_seconds=lease_seconds)
+            while not stop_heartbeat.wait(lease_seconds / 3):
+                if not heartbeat_queue.renew(task["id"], owner):
+                    print(f"[worker {owner}] lost the lease on task {task['id']}")
+                    lease_lost.set()
+                    return
+
+        heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+        heartbeat_thread.start()
+        try:
+            output = run_task(queue, task, lease_lost)
+            queue.complete(task, owner, output)
+        except (Exception, SystemExit) as e:
+            # SystemExit comes from create_story_outline aborting on LLM failures
+            error = traceback.format_exc() if isinstance(e, Exception) else "generation aborted"
+            print(f"[worker {owner}] task {task['id']} failed: {e}")
+            queue.fail(task, owner, error)
+        finally:
+            stop_heartbeat.set()
+            heartbeat_thread.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Durable job queue for book generation.")
+    parser.add_argument("--db", type=str, default="./output/jobs.sqlite", help="SQLite queue database (default: ./output/jobs.sqlite)")
+    parser.add_argument("--state_dir", type=str, default=None, help="Directory for the per-job state checkpoints (default: next to the database)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = subparsers.add_parser("submit", help="Queue the books of a JSONL manifest")
+    submit_parser.add_argument("--manifest", type=str, required=True, help="JSONL manifest, same format as batch_generator.py")
+    submit_parser.add_argument("--model", type=str, default="gemma3:12b", help="Default model for books that do not set one.")
+    submit_parser.add_argument("--profile", type=str, default="balanced", choices=sorted(PIPELINE_PROFILES), help="Pipeline profile of the books that do not set one: fast, balanced or thorough (default: balanced)")
+    submit_parser.add_argument("--ollama_url", type=str, default="http://localhost:11434", help="The URL of the Ollama API, or several comma-separated URLs to balance requests across.")
+
+    worker_parser = subparsers.add_parser("worker", help="Run worker processes that lease and execute tasks")
+    worker_parser.add_argument("--processes", type=int, default=1, help="Worker processes to start on this machine (default: 1)")
+    worker_parser.add_argument("--lease_seconds", type=int, default=900, help="Lease duration before a silent worker's task is retried (default: 900)")
+    worker_parser.add_argument("--max_attempts", type=int, default=3, help="Attempts per task before its book fails (default: 3)")
+    worker_parser.add_argument("--exit_when_idle", action="store_true", help="Exit once every job is finished or failed")
+
+    subparsers.add_parser("status", help="Show job progress")
+
+    args = parser.parse_args()
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+
+    if args.command == "submit":
+        queue = JobQueue(args.db, state_dir=args.state_dir)
+        for book in load_manifest(args.manifest):
+            options = {"model": args.model, "base_url": args.ollama_url, "profile": args.profile}
+            for key, value in book.items():
+                if key != "id" and key not in MANIFEST_OPTIONS and key != "output":
+                    raise ValueError(f"Unknown manifest option: {key}")
+                options[key] = value
+            job_id = queue.submit(book["id"], options)
+            print(f"Queued {book['id']} as job {job_id}")
+    elif args.command == "worker":
+        worker_kwargs = {
+            "state_dir": args.state_dir,
+            "lease_seconds": args.lease_seconds,
+            "max_attempts": args.max_attempts,
+            "exit_when_idle": args.exit_when_idle,
+        }
+        processes = [
+            Process(target=run_worker, args=(args.db,), kwargs=worker_kwargs) for _ in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    elif args.command == "status":
+        queue = JobQueue(args.db, state_dir=args.state_dir)
+        for job in queue.status():
+            print(f"job {job['id']} {job['name']}: {job['status']} ({job['done']}/{job['total']} steps) {job['output'] or ''}")
@@ -0,0 +1,112 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class CassetteMiss(LookupError):
+    """A replayed run made an LLM call the cassette has no recording for"""
+
+
+class Cassette:
+    """Records the LLM calls of a run to a JSONL file and replays them later
+
+    Each line holds one reply with a hash of its request and the pipeline step and
+    chapter that made it; a ".gz" path is compressed. Replay matches calls either
+    exactly, by request hash, or by step: the n-th call of a step for a chapter gets
+    the n-th reply recorded for it, which survives prompt wording changes.
+    """
+
+    def __init__(self, path, mode="replay", match="exact"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        if match not in ("exact", "step"):
+            raise ValueError(f"Unknown cassette match: {match}")
+        self.path = path
+        self.mode = mode
+        self.match = match
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.entries = {}
+        self.calls = 0
+        self.file = None
+        if mode == "record":
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.file = self.open(path, "wt")
+            self.file.write(json.dumps({"cassette": 1, "created": time.strftime("%Y-%m-%dT%H:%M:%S")}) + "\n")
+            self.file.flush()
+        else:
+            self.load()
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    def open(self, path, mode):
+        if path.endswith(".gz"):
+            return gzip.open(path, mode, encoding="utf-8")
+        return open(path, mode, encoding="utf-8")
+
+    def load(self):
+        """Index the recorded replies by request hash or by step, in recording order
+
+        A cassette cut short by a killed run (a truncated gzip stream or a partial last
+        line) replays the replies recorded before the cut.
+        """
+        with self.open(self.path, "rt") as f:
+            try:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if "reply" not in entry:
+                        continue
+                    key = entry["key"] if self.match == "exact" else (entry["step"], entry["chapter"], entry["index"])
+                    self.entries.setdefault(key, []).append(entry["reply"])
+            except (EOFError, gzip.BadGzipFile):
+                print(f"Cassette {self.path} is truncated, replaying the replies recorded before the cut")
+
+    def request_key(self, *parts):
+        """Stable hash of everything that determines a reply"""
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    def next_index(self, step, chapter):
+        """Number the calls of each step and chapter; call with the lock held"""
+        index = self.counters.get((step, chapter), 0)
+        self.counters[(step, chapter)] = index + 1
+        return index
+
+    def record(self, key, step, chapter, reply):
+        """Append one reply to the cassette file"""
+        with self.lock:
+            entry = {"key": key, "step": step, "chapter": chapter, "index": self.next_index(step, chapter), "reply": reply}
+            self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.file.flush()
+            self.calls += 1
+
+    def replay(self, key, step, chapter):
+        """Return the recorded reply of a call, or raise CassetteMiss"""
+        with self.lock:
+            index = self.next_index(step, chapter)
+            lookup = key if self.match == "exact" else (step, chapter, index)
+            replies = self.entries.get(lookup)
+            if not replies:
+                raise CassetteMiss(f"No recorded reply for step {step} (chapter {chapter}, call {index + 1}) in {self.path}")
+            self.calls += 1
+            # Identical requests made several times get their replies in recording order
+            return replies.pop(0) if len(replies) > 1 else replies[0]
+
+    def close(self):
+        """Finish writing a recorded cassette"""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
@@ -0,0 +1,495 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Fixed story material, so every canned reply is consistent with the others
+MOCK_CHARACTERS = [
+    ("Mara Quell", "a young cartographer who maps the shifting streets of Veridia"),
+    ("Tobin Ash", "a retired lamplighter who knows the old tunnels"),
+    ("Ilse Varn", "the harbour magistrate hiding a debt to the guild"),
+    ("Corin Hale", "a smuggler with a conscience and a fast boat"),
+]
+MOCK_WORLD = "Veridia"
+MOCK_MOTIFS = ["a cracked brass compass", "gulls circling before a storm", "the phrase 'the tide keeps its promises'"]
+MOCK_WORDS = (
+    "the harbour lamps flickered while rain crossed the old stone quay and the bells of the tower counted the hour "
+    "a narrow street climbed toward the market where traders argued over salt and rope and the smell of tar "
+    "someone had left a map on the table with a line drawn through the river and a question written in the margin "
+    "footsteps echoed in the tunnel and the water below carried whispers of ships that never returned"
+).split()
+
+
+def approximate_tokens(text):
+    """Rough token count of a text, about four tokens for every three words"""
+    return max(1, len(text.split()) * 4 // 3)
+
+
+class MockBehaviour:
+    """Latency, throughput and failure settings of the mock server"""
+
+    def __init__(
+        self,
+        latency=0.05,
+        latency_distribution="lognormal",
+        tokens_per_second=2000.0,
+        prompt_tokens_per_second=50000.0,
+        error_rate=0.0,
+        straggler_rate=0.0,
+        straggler_factor=20.0,
+        inconsistency_rate=0.0,
+        chapter_words=1800,
+        seed=0,
+    ):
+        self.latency = latency
+        self.latency_distribution = latency_distribution
+        self.tokens_per_second = tokens_per_second
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.error_rate = error_rate
+        self.straggler_rate = straggler_rate
+        self.straggler_factor = straggler_factor
+        self.inconsistency_rate = inconsistency_rate
+        self.chapter_words = chapter_words
+        self.seed = seed
+
+    def first_token_delay(self, rng, prompt_tokens):
+        """Sample the time to first token: base latency, prompt evaluation and the odd straggler"""
+        if self.latency_distribution == "fixed":
+            delay = self.latency
+        elif self.latency_distribution == "uniform":
+            delay = rng.uniform(0, 2 * self.latency)
+        elif self.latency_distribution == "exponential":
+            delay = rng.expovariate(1 / self.latency) if self.latency > 0 else 0.0
+        else:
+            # Lognormal with the requested mean, the usual shape of real serving latencies
+            delay = self.latency * rng.lognormvariate(-0.125, 0.5)
+        if self.prompt_tokens_per_second > 0:
+            delay += prompt_tokens / self.prompt_tokens_per_second
+        if rng.random() < self.straggler_rate:
+            delay *= self.straggler_factor
+        return delay
+
+
+class MockResponder:
+    """Builds deterministic, format-correct replies for the prompts the generators send"""
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+
+    def paragraph(self, rng, words, names=True):
+        """Prose of about the given number of words, mentioning the mock characters and world"""
+        sentences = []
+        count = 0
+        while count < words:
+            length = rng.randint(8, 18)
+            sentence = [rng.choice(MOCK_WORDS) for _ in range(length)]
+            if names and rng.random() < 0.5:
+                name = rng.choice(MOCK_CHARACTERS)[0]
+                sentence.insert(rng.randint(0, len(sentence)), f"{name} said softly")
+            if rng.random() < 0.2:
+                sentence.append(f"in {MOCK_WORLD}")
+            text = " ".join(sentence)
+            sentences.append(text[0].upper() + text[1:] + ".")
+            count += len(text.split())
+        return " ".join(sentences)
+
+    def chapter(self, rng, chapter_num):
+        """A chapter with a title line and paragraphs of the configured length"""
+        paragraphs = [f"Chapter {chapter_num}: The Tide Keeps Its Promises"]
+        remaining = self.behaviour.chapter_words
+        while remaining > 0:
+            words = min(remaining, rng.randint(90, 160))
+            paragraphs.append(self.paragraph(rng, words))
+            remaining -= words
+        return "\n\n".join(paragraphs)
+
+    def schema_value(self, rng, schema, key=""):
+        """Build a value matching a JSON schema, filling names and text from the mock story"""
+        kind = schema.get("type")
+        if kind == "object":
+            return {name: self.schema_value(rng, sub, name) for name, sub in schema.get("properties", {}).items()}
+        if kind == "array":
+            items = schema.get("items", {})
+            if key == "characters":
+                return [self.schema_character(rng, index, items) for index in range(len(MOCK_CHARACTERS))]
+            if key == "patches":
+                return []
+            return [self.schema_value(rng, items, key) for _ in range(2)]
+        if kind == "integer":
+            return 1 if key in ("first_appearance", "paragraph") else rng.randint(1, 10)
+        if kind == "number":
+            return round(rng.random(), 3)
+        if kind == "boolean":
+            return False
+        if key == "status":
+            return "alive"
+        return self.paragraph(rng, 12, names=False)
+
+    def schema_character(self, rng, index, schema):
+        """One entry of a characters array, using the fixed cast"""
+        name, description = MOCK_CHARACTERS[index]
+        character = self.schema_value(rng, schema, "character")
+        character["name"] = name
+        if "description" in character:
+            character["description"] = description
+        return character
+
+    def reply(self, prompt, rng, schema=None, json_mode=False):
+        """Pick the canned reply for a prompt"""
+        if schema:
+            return json.dumps(self.schema_value(rng, schema))
+        if json_mode and "patches" in prompt:
+            return json.dumps({"patches": []})
+        if json_mode or ("JSON" in prompt and "character" in prompt):
+            characters = [
+                {"name": name, "description": description, "first_appearance": 1, "status": "alive",
+                 "development": "grows bolder", "relationships": "", "location": MOCK_WORLD, "emotional_state": "hopeful"}
+                for name, description in MOCK_CHARACTERS
+            ]
+            return json.dumps({"characters": characters})
+        if "consistency issues" in prompt and "Analyze this chapter" in prompt:
+            if rng.random() < self.behaviour.inconsistency_rate:
+                return f"INCONSISTENT\n1. {MOCK_CHARACTERS[0][0]} is in two places at once in paragraph 2."
+            return "CONSISTENT"
+        if "Analyze the transition" in prompt:
+            return "TRANSITION: SMOOTH"
+        match = re.search(r"(?:Write|Rewrite) (?:this )?Chapter (\d+)|Rewrite this chapter", prompt)
+        if match:
+            return self.chapter(rng, int(match.group(1) or 1))
+        if "How much time has passed" in prompt:
+            return "TIME_ELAPSED: one night\nEND_TIME: dawn of the second day\nTIME_MARKERS: the tower bells, first light"
+        if "emotional tone" in prompt:
+            return "EMOTION: uneasy hope\nTENSION: 6\nUNRESOLVED: who drew the line through the river?"
+        if "Extract the world name" in prompt:
+            return MOCK_WORLD
+        if "opening paragraph" in prompt or "transition paragraph" in prompt or "extract ONLY the plan" in prompt:
+            return self.paragraph(rng, 90)
+        if "title" in prompt.lower() and "Title Option" in prompt:
+            return "1. The Tide Keeps Its Promises\n2. Salt and Lamplight\n3. The Veridia Map"
+        if "motif" in prompt.lower():
+            return "\n".join(f"- {motif}" for motif in MOCK_MOTIFS)
+        if "character guide" in prompt or "CHARACTER NAME" in prompt:
+            return "\n\n".join(
+                f"**{name.upper()}**\n• Role: {'Protagonist' if index == 0 else 'Supporting'}\n• Background: {description}"
+                for index, (name, description) in enumerate(MOCK_CHARACTERS)
+            )
+        if "summary" in prompt.lower():
+            return self.paragraph(rng, 150)
+        # Outlines, plot proposals and anything else get a few paragraphs of prose
+        return "\n\n".join(self.paragraph(rng, 120) for _ in range(3))
+
+
+class MockStats:
+    """Request counters and the server-side concurrency of a mock server"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Start counting from zero"""
+        with self.lock:
+            self.requests = 0
+            self.errors = 0
+            self.by_path = {}
+            self.in_flight = 0
+            self.max_in_flight = 0
+            self.busy_seconds = 0.0
+            self.request_seconds = 0.0
+            self.output_tokens = 0
+            self.changed_at = time.monotonic()
+
+    def advance(self):
+        """Account the time since the last change; call with the lock held"""
+        now = time.monotonic()
+        if self.in_flight:
+            self.busy_seconds += now - self.changed_at
+            self.request_seconds += self.in_flight * (now - self.changed_at)
+        self.changed_at = now
+
+    def started(self, path):
+        with self.lock:
+            self.advance()
+            self.requests += 1
+            self.by_path[path] = self.by_path.get(path, 0) + 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def finished(self, output_tokens=0, error=False):
+        with self.lock:
+            self.advance()
+            self.in_flight -= 1
+            self.output_tokens += output_tokens
+            self.errors += 1 if error else 0
+
+    def snapshot(self):
+        """Counters so far; average concurrency is measured over the time any request was in flight"""
+        with self.lock:
+            self.advance()
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "by_path": dict(self.by_path),
+                "max_concurrency": self.max_in_flight,
+                "busy_seconds": round(self.busy_seconds, 3),
+                "request_seconds": round(self.request_seconds, 3),
+                "average_concurrency": round(self.request_seconds / self.busy_seconds, 2) if self.busy_seconds else 0.0,
+                "output_tokens": self.output_tokens,
+            }
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    """Speaks enough of the Ollama and OpenAI HTTP APIs for the generators"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            print(f"[mock] {format % args}")
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            models = [{"name": name, "model": name} for name in self.server.models]
+            self.send_json(200, {"models": models})
+        elif self.path == "/api/ps":
+            models = [{"name": name, "model": name} for name in sorted(self.server.loaded_models)]
+            self.send_json(200, {"models": models})
+        elif self.path in ("/v1/models", "/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": name, "object": "model"} for name in self.server.models]})
+        elif self.path == "/mock/stats":
+            self.send_json(200, self.server.stats.snapshot())
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self.send_json(400, {"error": "invalid JSON"})
+            return
+        if self.path == "/api/generate":
+            prompt, kind = body.get("prompt", ""), "generate"
+        elif self.path == "/api/chat":
+            prompt, kind = self.last_user_message(body), "chat"
+        elif self.path in ("/v1/chat/completions", "/chat/completions"):
+            prompt, kind = self.last_user_message(body), "openai"
+        else:
+            self.send_json(404, {"error": "not found"})
+            return
+
+        behaviour = self.server.behaviour
+        stats = self.server.stats
+        # Same request, same reply and same latency
+        rng = random.Random(f"{behaviour.seed}:{self.path}:{body.get('model')}:{prompt}")
+        stats.started(self.path)
+        output_tokens = 0
+        error = False
+        try:
+            if rng.random() < behaviour.error_rate:
+                error = True
+                self.send_json(500, {"error": "injected failure"})
+                return
+            schema, json_mode = self.requested_format(body)
+            text = self.server.responder.reply(prompt, rng, schema=schema, json_mode=json_mode)
+            prompt_tokens = approximate_tokens(json.dumps(body.get("messages") or body.get("prompt", "")))
+            first_token = behaviour.first_token_delay(rng, prompt_tokens)
+            self.server.loaded_models.add(body.get("model"))
+            if body.get("stream", kind != "openai"):
+                output_tokens = self.stream_reply(kind, body, text, prompt_tokens, first_token)
+            else:
+                output_tokens = approximate_tokens(text)
+                generation = output_tokens / behaviour.tokens_per_second if behaviour.tokens_per_second > 0 else 0.0
+                time.sleep(first_token + generation)
+                self.send_json(200, self.reply_body(kind, body, text, prompt_tokens, output_tokens, first_token, generation))
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, like a generator closing a verdict stream early
+            pass
+        finally:
+            stats.finished(output_tokens, error)
+
+    def last_user_message(self, body):
+        """The per-call prompt; the book context lives in the earlier messages"""
+        for message in reversed(body.get("messages", [])):
+            if message.get("role") == "user":
+                content = message.get("content", "")
+                return content if isinstance(content, str) else json.dumps(content)
+        return ""
+
+    def requested_format(self, body):
+        """Return (schema, json_mode) from an Ollama format or an OpenAI response_format"""
+        fmt = body.get("format")
+        if isinstance(fmt, dict):
+            return fmt, True
+        if fmt == "json":
+            return None, True
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            return response_format.get("json_schema", {}).get("schema"), True
+        return None, response_format.get("type") == "json_object"
+
+    def reply_body(self, kind, body, text, prompt_tokens, output_tokens, first_token, generation):
+        """Non-streaming response body in the protocol of the endpoint"""
+        model = body.get("model", "mock")
+        if kind == "openai":
+            return {
+                "id": f"chatcmpl-mock-{self.server.stats.requests}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": output_tokens,
+                    "total_tokens": prompt_tokens + output_tokens,
+                    "prompt_tokens_details": {"cached_tokens": 0},
+                },
+            }
+        reply = {
+            "model": model,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((first_token + generation) * 1e9),
+            "load_duration": 0,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(first_token * 1e9),
+            "eval_count": output_tokens,
+            "eval_duration": int(generation * 1e9),
+        }
+        if kind == "chat":
+            reply["message"] = {"role": "assistant", "content": text}
+        else:
+            reply["response"] = text
+        return reply
+
+    def stream_reply(self, kind, body, text, prompt_tokens, first_token):
+        """Stream the reply word by word at the configured token rate; returns the tokens sent"""
+        behaviour = self.server.behaviour
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if kind == "openai" else "application/x-ndjson")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        time.sleep(first_token)
+        started = time.monotonic()
+        words = re.findall(r"\S+\s*", text) or [""]
+        sent = 0
+        for word in words:
+            tokens = approximate_tokens(word)
+            if behaviour.tokens_per_second > 0:
+                time.sleep(tokens / behaviour.tokens_per_second)
+            self.write_chunk(kind, body, word, done=False)
+            sent += tokens
+        generation = time.monotonic() - started
+        if kind == "openai":
+            self.wfile.write(b"data: [DONE]\n\n")
+        else:
+            final = self.reply_body(kind, body, "", prompt_tokens, sent, first_token, generation)
+            self.wfile.write((json.dumps(final) + "\n").encode("utf-8"))
+        self.wfile.flush()
+        return sent
+
+    def write_chunk(self, kind, body, piece, done):
+        """Write one streamed chunk"""
+        if kind == "openai":
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        else:
+            chunk = {"model": body.get("model", "mock"), "done": done}
+            if kind == "chat":
+                chunk["message"] = {"role": "assistant", "content": piece}
+            else:
+                chunk["response"] = piece
+            self.wfile.write((json.dumps(chunk) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """Local stand-in for Ollama and the OpenAI API with deterministic canned replies"""
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=11435, behaviour=None, models=None, verbose=False):
+        super().__init__((host, port), MockRequestHandler)
+        self.behaviour = behaviour or MockBehaviour()
+        self.responder = MockResponder(self.behaviour)
+        self.stats = MockStats()
+        self.models = models or ["gemma3:12b", "gemma2:27b", "mistral:latest", "hermes3:latest"]
+        self.loaded_models = set()
+        self.verbose = verbose
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve from a background thread and return the server"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def add_behaviour_arguments(parser):
+    """Command line options of MockBehaviour, shared with benchmark.py"""
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean time to first token in seconds (default: 0.05)")
+    parser.add_argument("--latency_distribution", type=str, default="lognormal", choices=["fixed", "uniform", "exponential", "lognormal"], help="Shape of the first-token latency (default: lognormal)")
+    parser.add_argument("--tokens_per_second", type=float, default=2000.0, help="Output token rate, 0 for instant replies (default: 2000)")
+    parser.add_argument("--prompt_tokens_per_second", type=float, default=50000.0, help="Prompt evaluation rate added to the first-token time, 0 to ignore prompt size (default: 50000)")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Share of requests answered with HTTP 500 (default: 0)")
+    parser.add_argument("--straggler_rate", type=float, default=0.0, help="Share of requests whose first token is delayed by --straggler_factor (default: 0)")
+    parser.add_argument("--straggler_factor", type=float, default=20.0, help="First-token delay multiplier of stragglers (default: 20)")
+    parser.add_argument("--inconsistency_rate", type=float, default=0.0, help="Share of consistency checks that report issues (default: 0)")
+    parser.add_argument("--chapter_words", type=int, default=1800, help="Words per generated chapter (default: 1800)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the replies and latencies (default: 0)")
+
+
+def behaviour_from_args(args):
+    """Build a MockBehaviour from parsed add_behaviour_arguments options"""
+    return MockBehaviour(
+        latency=args.latency,
+        latency_distribution=args.latency_distribution,
+        tokens_per_second=args.tokens_per_second,
+        prompt_tokens_per_second=args.prompt_tokens_per_second,
+        error_rate=args.error_rate,
+        straggler_rate=args.straggler_rate,
+        straggler_factor=args.straggler_factor,
+        inconsistency_rate=args.inconsistency_rate,
+        chapter_words=args.chapter_words,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve deterministic canned LLM replies over the Ollama and OpenAI APIs.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=11435, help="Port to listen on (default: 11435)")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    add_behaviour_arguments(parser)
+
+    args = parser.parse_args()
+
+    server = MockLLMServer(args.host, args.port, behaviour_from_args(args), verbose=args.verbose)
+    print(f"Mock LLM server listening on {server.url} (Ollama: {server.url}, OpenAI: {server.url}/v1)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
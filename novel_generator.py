@@ -5,8 +5,159 @@ import time
 import os
 import re
 import datetime
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 import anthropic
+from character_scanner import CharacterScanner
+from backend_pool import PRIORITY_DRAFTING, PRIORITY_ANALYSIS, PRIORITY_POLISH, get_backend_limiter, get_host_pool, split_ollama_urls
+from llm_cassette import Cassette
+from book_writer import BookWriter
+from epub_writer import EpubWriter
+from run_journal import RunJournal, compact_journal, journal_path, summarize_calls
+from contextlib import contextmanager, nullcontext
+
+
+# JSON schemas for the structured-output calls (Ollama "format", OpenAI "response_format")
+CHARACTER_LIST_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "characters": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "description": {"type": "string"},
+                    "first_appearance": {"type": "integer"},
+                    "status": {"type": "string"},
+                },
+                "required": ["name", "description"],
+            },
+        }
+    },
+    "required": ["characters"],
+}
+
+CHARACTER_UPDATES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "characters": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "status": {"type": "string"},
+                    "development": {"type": "string"},
+                    "relationships": {"type": "string"},
+                    "location": {"type": "string"},
+                    "emotional_state": {"type": "string"},
+                },
+                "required": ["name", "status", "development", "relationships", "location", "emotional_state"],
+            },
+        }
+    },
+    "required": ["characters"],
+}
+
+PARAGRAPH_PATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "patches": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "paragraph": {"type": "integer"},
+                    "text": {"type": "string"},
+                },
+                "required": ["paragraph", "text"],
+            },
+        }
+    },
+    "required": ["patches"],
+}
+
+
+CHAPTER_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "time_elapsed": {"type": "string"},
+        "end_time": {"type": "string"},
+        "time_markers": {"type": "string"},
+        "emotion": {"type": "string"},
+        "tension": {"type": "integer"},
+        "unresolved": {"type": "string"},
+        "characters": CHARACTER_UPDATES_SCHEMA["properties"]["characters"],
+    },
+    "required": ["summary", "time_elapsed", "end_time", "time_markers", "emotion", "tension", "unresolved", "characters"],
+}
+
+
+# Pipeline profiles trade output quality for throughput
+#   validation: "risk" runs the LLM consistency check only when the local pre-check reaches
+#     validation_threshold, "always" runs it for every chapter
+#   analysis: "separate" makes the summary, character, timeline and emotional arc calls,
+#     "merged" asks for all four in one structured call
+#   chapter_openers / chapter_transitions: the opening and closing paragraphs written for
+#     each chapter boundary (two calls each)
+#   transition_check: check_chapter_transition, which checks each chapter's beginning against
+#     the end of the previous one
+PIPELINE_PROFILES = {
+    "fast": {
+        "validation": "risk",
+        "analysis": "merged",
+        "chapter_openers": False,
+        "chapter_transitions": False,
+        "transition_check": False,
+    },
+    "balanced": {
+        "validation": "risk",
+        "analysis": "separate",
+        "chapter_openers": True,
+        "chapter_transitions": True,
+        "transition_check": True,
+    },
+    "thorough": {
+        "validation": "always",
+        "analysis": "separate",
+        "chapter_openers": True,
+        "chapter_transitions": True,
+        "transition_check": True,
+    },
+}
+
+
+# Generic world-name shapes, shared by world name extraction and the local consistency pre-check
+WORLD_NAME_PATTERNS = [
+    r"Neo-[A-Za-z]+",
+    r"[A-Z][a-z]+land",
+    r"[A-Z][a-z]+ Kingdom",
+    r"[A-Z][a-z]+ Empire",
+    r"[A-Z][a-z]+ Realm",
+    r"[A-Z][a-z]+ World",
+    r"[A-Z][a-z]+ City"
+]
+
+# Verbs that show a character acting or speaking in the scene (used to spot dead characters acting)
+ACTION_VERBS_PATTERN = (
+    r"\s+(?:said|says|asked|replied|answered|whispered|shouted|laughed|smiled|nodded|walked|ran|turned|"
+    r"looked|grabbed|stood|sat|reached|opened|stepped|spoke|called|cried|frowned|sighed)\b"
+)
+
+
+def pipeline_step(method):
+    """Mark a BookGenerator method as a pipeline step, so the LLM calls it makes are attributed to it"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        # Chapter steps take the chapter number as their first argument
+        chapter = args[0] if args and isinstance(args[0], int) else None
+        with self.step_context(method.__name__, chapter):
+            return method(self, *args, **kwargs)
+    return wrapper
 
 
 class BookGenerator:
@@ -24,8 +175,33 @@ class BookGenerator:
         setting="modern",
         themes="love",
         names="realistic",
+        validation_threshold=2,
+        fix_mode="patch",
+        speculative=False,
+        session=None,
+        rate_limiter=None,
+        progress_callback=None,
+        premise_from_file=True,
+        max_concurrency=None,
+        interactive=True,
+        hedge_percentile=None,
+        hedge_budget=0.1,
+        trace_path=None,
+        chapter_pause_seconds=3,
+        cassette=None,
+        profile="balanced",
     ):
-        self.base_url = base_url + "/api/generate"  # whe can implement a check
+        # Several comma-separated Ollama endpoints are balanced through a shared host pool
+        ollama_urls = split_ollama_urls(base_url)
+        self.host_pool = get_host_pool(ollama_urls) if len(ollama_urls) > 1 else None
+        self.ollama_url = ollama_urls[0] if ollama_urls else base_url
+        self.base_url = self.ollama_url + "/api/generate"  # whe can implement a check
+        # Duplicate Ollama calls on another host when no token arrived by this percentile of recent
+        # first-token times, for at most hedge_budget of the calls (needs several endpoints)
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        if hedge_percentile and self.host_pool is None:
+            print("Hedged requests need several comma-separated Ollama URLs, hedging is disabled.")
         self.model = model # whe can implement a check
         self.api_key = None # 
         self.language = language # to be done
@@ -54,6 +230,59 @@ class BookGenerator:
         self.emotional_arc = {}
         self.transitions = {}
         self.recurring_motifs = []
+        self.character_scanner = None
+        # Stages of the pipeline that run, see PIPELINE_PROFILES
+        if profile not in PIPELINE_PROFILES:
+            raise ValueError(f"Unknown pipeline profile: {profile}")
+        self.profile = profile
+        self.stages = PIPELINE_PROFILES[profile]
+        # Local pre-check risk score at which the LLM consistency check runs (0 = always run it)
+        self.validation_threshold = validation_threshold
+        self.min_chapter_words = 1500
+        self.max_chapter_words = 5000
+        # "patch" replaces only the paragraphs with issues, "rewrite" regenerates the whole chapter
+        self.fix_mode = fix_mode
+        # Above this share of patched paragraphs a full rewrite is cheaper and more coherent
+        self.max_patch_ratio = 0.5
+        # Run the chapter analyses on the draft concurrently with its consistency validation
+        self.speculative = speculative
+        # HTTP session (shared connection pool in batch runs) and optional global rate limiter
+        self.session = session if session is not None else requests.Session()
+        self.rate_limiter = rate_limiter
+        # Requests in flight to this endpoint, shared with every generator of the process using it
+        self.backend_limiter = get_backend_limiter(base_url, max_concurrency) if max_concurrency else None
+        # Interactive books go ahead of batch books within each priority class
+        self.interactive = interactive
+        # Optional callable(event, data) notified of pipeline progress (used by the HTTP service)
+        self.progress_callback = progress_callback
+        # Whether a premise naming an existing file is replaced by the file's content
+        self.premise_from_file = premise_from_file
+        # Output token caps for verdict-style calls; negative verdicts still need room for details
+        self.validation_max_tokens = 1024
+        self.transition_max_tokens = 1536
+        # Pause between chapters so a single local server is not overwhelmed
+        self.chapter_pause_seconds = chapter_pause_seconds
+        # One telemetry record per LLM call; the current step and call are tracked per thread
+        self.telemetry = []
+        self.telemetry_lock = threading.Lock()
+        self.local = threading.local()
+        # Optional Chrome Trace Event file written by generate_book (open it in Perfetto)
+        self.trace_path = trace_path
+        self.trace_events = [] if trace_path else None
+        self.trace_threads = set()
+        self.trace_started = time.monotonic()
+        # Book file that chapters are written to as they become final, set up by write_book
+        self.book_path = None
+        self.book_writer = None
+        # Optional EPUB file fed the same final chapters, set up by write_book
+        self.epub_writer = None
+        # Append-only log of every state change, opened next to the book file by write_book
+        self.journal = None
+        # Optional llm_cassette.Cassette recording the run's LLM replies or replaying them
+        self.cassette = cassette
+        if cassette is not None and cassette.replaying:
+            # Replays need no server to protect
+            self.chapter_pause_seconds = 0
         
 
     def get_user_input(self):
@@ -75,7 +304,7 @@ STORY INPUT: One paragraph up to {self.max_premisw_lengh} characters with your p
         else:
             print(f"Using provided story premise: {self.story_premise}\n")
             # check if the self.story_premise is a file path
-            if os.path.isfile(self.story_premise):
+            if self.premise_from_file and os.path.isfile(self.story_premise):
                 # load the story promise file
                 self.story_premise = open(self.story_premise, "r", encoding="utf-8").read() 
                 print(f"Loaded story premise from file:\n {self.story_premise}\n")
@@ -121,51 +350,92 @@ STORY INPUT: One paragraph up to {self.max_premisw_lengh} characters with your p
         self.language_settings = language_settings
 
     # API Call to LLMs
-    def generate_text(self, prompt, system_prompt="You are a creative fiction writer."):
-        """Make API call to different LLMs based on base_url"""
+    def generate_text(
+        self,
+        prompt,
+        system_prompt="You are a creative fiction writer.",
+        context=None,
+        json_schema=None,
+        priority=PRIORITY_DRAFTING,
+    ):
+        """Make an LLM call, recording it to or replaying it from the cassette when one is set"""
+        if self.cassette is None:
+            return self.call_text(prompt, system_prompt, context=context, json_schema=json_schema, priority=priority)
+        key = self.cassette.request_key(self.model, system_prompt, self.join_context(context or ""), prompt, json_schema)
+        return self.cassette_call(
+            key, lambda: self.call_text(prompt, system_prompt, context=context, json_schema=json_schema, priority=priority)
+        )
+
+    def call_text(self, prompt, system_prompt, context=None, json_schema=None, priority=PRIORITY_DRAFTING):
+        """Make an LLM call once the backend limiter grants a slot for its priority class"""
+        with self.track_call() as call:
+            with self.backend_slot(priority) as waited:
+                self.record_queue_wait(waited)
+                reply = self.request_text(prompt, system_prompt, context=context, json_schema=json_schema)
+            call["ok"] = reply is not None
+            return reply
+
+    def request_text(self, prompt, system_prompt, context=None, json_schema=None):
+        """Make API call to different LLMs based on base_url
+
+        When a book context is given it is sent first and byte-identical across calls,
+        so the backends can serve it from their prefix/prompt caches. When a JSON schema
+        is given, backends with a structured-output mode are constrained to it.
+        """
 
-        data = {
-            "model": self.model,
-            "prompt": prompt,
-            "system": system_prompt,
-            "stream": False,
-        }
         headers = {}
 
         try:
-            if self.is_local_ollama(self.base_url):
+            self.throttle()
+            if self.uses_ollama():
                 # Ollama API
+                data = {
+                    "model": self.model,
+                    "messages": self.build_messages(prompt, system_prompt, context),
+                    "stream": False,
+                }
+                if json_schema:
+                    data["format"] = json_schema
                 # Retry the request up to 3 times to handle potential Ollama loading delays.
                 for attempt in range(3):
                     try:
-                        response = requests.post(self.base_url, json=data, timeout=300)  # timeout set to 5 minutes
-                        response.raise_for_status()
-                        return response.json()["response"]
+                        # Chat endpoint keeps the book context as a cacheable prefix
+                        with self.trace_span(f"attempt {attempt + 1}", "http"):
+                            reply = self.ollama_reply("/api/chat", data)
+                        self.record_usage(retries=attempt, **self.ollama_usage(reply))
+                        return reply["message"]["content"]
                     except requests.exceptions.RequestException as e:
                         print(f"Attempt {attempt + 1} failed: {e}")
                         time.sleep(2)  # Wait before retrying
                 print("Max retries exceeded. Request failed.")
                 return None
             elif "openai" in self.base_url:
-                # OpenAI API
+                # OpenAI API (prefix caching is automatic for identical leading messages)
                 from openai import OpenAI
 
                 client = OpenAI(api_key=self.api_key)
-                messages = [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt},
-                ]
-                response = client.chat.completions.create(model=self.model, messages=messages, stream=False)
+                messages = self.build_messages(prompt, system_prompt, context)
+                extra = {}
+                if json_schema:
+                    extra["response_format"] = {
+                        "type": "json_schema",
+                        "json_schema": {"name": "structured_output", "schema": json_schema},
+                    }
+                response = client.chat.completions.create(model=self.model, messages=messages, stream=False, **extra)
+                self.record_usage(**self.openai_usage(response.usage))
                 return response.choices[0].message.content
             elif "anthropic" in self.base_url:
                 # Anthropic API
                 import anthropic
 
                 client = anthropic.Anthropic(api_key=self.api_key)
-                combined_prompt = system_prompt + "\n" + prompt
                 response = client.messages.create(
-                    model=self.model, max_tokens=8192, messages=[{"role": "user", "content": combined_prompt}]
+                    model=self.model,
+                    max_tokens=8192,
+                    system=self.build_system_blocks(system_prompt, context),
+                    messages=[{"role": "user", "content": prompt}],
                 )
+                self.report_cache_usage(response.usage)
                 return response.content[0].text
             elif "openrouter" in self.base_url:
                 # OpenRouter API uses OpenAI client
@@ -173,6 +443,8 @@ STORY INPUT: One paragraph up to {self.max_premisw_lengh} characters with your p
                     base_url="https://openrouter.ai/api/v1",
                     api_key=self.api_key,  # Use the stored API key
                 )
+                if context:
+                    prompt = self.join_context(context) + "\n\n" + prompt
                 try:
                     response = openai_client.chat.completions.create(
                         model=self.model,
@@ -183,20 +455,31 @@ STORY INPUT: One paragraph up to {self.max_premisw_lengh} characters with your p
                         messages=[{"role": "user", "content": prompt}],
                         timeout=60,  # Add a timeout
                     )
+                    self.record_usage(**self.openai_usage(response.usage))
                     return response.choices[0].message.content  # Extract content
                 except Exception as e:
                     print(f"OpenRouter API error: {e}")
                     return None
             elif "deepseek" in self.base_url: # https://api.deepseek.com/chat/completions
-                # DeepSeek API
+                # DeepSeek API (context caching on disk is automatic for identical prefixes)
                 from openai import OpenAI
 
                 client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+                messages = [{"role": "system", "content": "You are a helpful assistant"}]
+                if context:
+                    messages.append({"role": "user", "content": self.join_context(context)})
+                messages.append({"role": "user", "content": prompt})
+                extra = {}
+                if json_schema:
+                    # DeepSeek only offers plain JSON mode, the schema itself stays in the prompt
+                    extra["response_format"] = {"type": "json_object"}
                 response = client.chat.completions.create(
                     model="deepseek-chat",
-                    messages=[{"role": "system", "content": "You are a helpful assistant"}, {"role": "user", "content": prompt}],
+                    messages=messages,
                     stream=False,
+                    **extra,
                 )
+                self.record_usage(**self.openai_usage(response.usage))
                 return response.choices[0].message.content
             else:
                 raise ValueError(f"Unsupported API in base_url: {self.base_url}")
@@ -204,7 +487,477 @@ STORY INPUT: One paragraph up to {self.max_premisw_lengh} characters with your p
         except Exception as e:
             print(f"Error making request: {e}")
             return None
-    
+
+    def generate_verdict(self, prompt, system_prompt, verdict, context=None, max_tokens=1024, priority=PRIORITY_DRAFTING):
+        """Stream a verdict-style call and stop as soon as the reply starts with the positive verdict
+
+        Returns the verdict itself when the model opens with it, otherwise the full reply
+        (capped at max_tokens). Backends without streaming support use generate_text.
+        """
+        if self.cassette is None:
+            return self.call_verdict(prompt, system_prompt, verdict, context, max_tokens, priority)
+        key = self.cassette.request_key(self.model, system_prompt, self.join_context(context or ""), prompt, verdict, max_tokens)
+        return self.cassette_call(
+            key, lambda: self.call_verdict(prompt, system_prompt, verdict, context, max_tokens, priority)
+        )
+
+    def call_verdict(self, prompt, system_prompt, verdict, context, max_tokens, priority):
+        """Make the verdict call of generate_verdict"""
+        if self.supports_streaming():
+            with self.track_call(streamed=True) as call:
+                with self.backend_slot(priority) as waited:
+                    self.record_queue_wait(waited)
+                    reply = self.stream_verdict(prompt, system_prompt, verdict, context, max_tokens)
+                call["ok"] = reply is not None
+            if reply is not None:
+                return reply
+        # Fall back outside the slot, call_text takes its own
+        return self.call_text(prompt, system_prompt, context=context, priority=priority)
+
+    def cassette_call(self, key, call):
+        """Replay a call from the cassette, or make it and record its reply"""
+        step, chapter = self.current_step()
+        if self.cassette.replaying:
+            return self.cassette.replay(key, step, chapter)
+        reply = call()
+        # Failed calls are recorded too, so a replay takes the same fallback paths
+        self.cassette.record(key, step, chapter, reply)
+        return reply
+
+    def supports_streaming(self):
+        """Check if the backend has a streaming path in stream_verdict"""
+        return self.uses_ollama() or "openai" in self.base_url or "anthropic" in self.base_url
+
+    def stream_verdict(self, prompt, system_prompt, verdict, context, max_tokens):
+        """Streaming part of generate_verdict; returns None when the backend cannot stream or the stream failed"""
+        try:
+            if self.uses_ollama():
+                self.throttle()
+                data = {
+                    "model": self.model,
+                    "messages": self.build_messages(prompt, system_prompt, context),
+                    "stream": True,
+                    "options": {"num_predict": max_tokens},
+                }
+                reply = ""
+                with self.ollama_request("/api/chat", data, stream=True) as response:
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        self.record_stream_chunk()
+                        reply += chunk.get("message", {}).get("content", "")
+                        if self.verdict_decided(reply, verdict):
+                            self.record_usage(stopped_early=True)
+                            break
+                        if chunk.get("done"):
+                            usage = self.ollama_usage(chunk)
+                            # Keep the first-token time measured on the stream
+                            usage.pop("ttft")
+                            self.record_usage(**usage)
+                            break
+                # Leaving the with block closes the connection, which makes Ollama stop generating
+                return verdict if self.matches_verdict(reply, verdict) else reply
+            elif "openai" in self.base_url:
+                self.throttle()
+                client = OpenAI(api_key=self.api_key)
+                stream = client.chat.completions.create(
+                    model=self.model,
+                    messages=self.build_messages(prompt, system_prompt, context),
+                    max_tokens=max_tokens,
+                    stream=True,
+                )
+                reply = ""
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        self.record_stream_chunk()
+                        reply += chunk.choices[0].delta.content
+                        if self.verdict_decided(reply, verdict):
+                            self.record_usage(stopped_early=True)
+                            break
+                stream.close()
+                return verdict if self.matches_verdict(reply, verdict) else reply
+            elif "anthropic" in self.base_url:
+                self.throttle()
+                client = anthropic.Anthropic(api_key=self.api_key)
+                reply = ""
+                with client.messages.stream(
+                    model=self.model,
+                    max_tokens=max_tokens,
+                    system=self.build_system_blocks(system_prompt, context),
+                    messages=[{"role": "user", "content": prompt}],
+                ) as stream:
+                    for text in stream.text_stream:
+                        self.record_stream_chunk()
+                        reply += text
+                        if self.verdict_decided(reply, verdict):
+                            self.record_usage(stopped_early=True)
+                            break
+                return verdict if self.matches_verdict(reply, verdict) else reply
+        except Exception as e:
+            print(f"Streaming verdict request failed, retrying without streaming: {e}")
+        return None
+
+    def throttle(self):
+        """Wait for the shared rate limiter, if any, before starting a request"""
+        if self.rate_limiter is not None:
+            self.record_queue_wait(self.rate_limiter.acquire(), "rate limit wait")
+
+    def record_queue_wait(self, waited, name="concurrency slot wait"):
+        """Add time spent waiting to start the current call to its telemetry and the trace"""
+        if not waited:
+            return
+        call = getattr(self.local, "call", None)
+        if call is not None:
+            call["queue_wait"] += waited
+        # Uncontended acquisitions only add noise to the timeline
+        if waited >= 0.001:
+            self.add_trace_event(name, "queue", time.monotonic() - waited, waited)
+
+    @contextmanager
+    def step_context(self, step, chapter=None):
+        """Attribute the LLM calls made by this thread inside the with block to a pipeline step"""
+        steps = getattr(self.local, "steps", None)
+        if steps is None:
+            steps = self.local.steps = []
+        if chapter is None and steps:
+            # Helpers called by a chapter step inherit its chapter
+            chapter = steps[-1][1]
+        steps.append((step, chapter))
+        try:
+            with self.trace_span(step, "step", chapter=chapter):
+                yield
+        finally:
+            steps.pop()
+
+    @contextmanager
+    def trace_span(self, name, category, **args):
+        """Record the with block as a span of the trace, when tracing is on"""
+        if self.trace_events is None:
+            yield
+            return
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_trace_event(name, category, started, time.monotonic() - started, **args)
+
+    def add_trace_event(self, name, category, started, duration, **args):
+        """Add a complete ("X") Chrome trace event on the current thread's track"""
+        if self.trace_events is None:
+            return
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((started - self.trace_started) * 1e6),
+            "dur": round(duration * 1e6),
+            "pid": 1,
+            "tid": thread.ident,
+            "args": {key: value for key, value in args.items() if value is not None},
+        }
+        with self.telemetry_lock:
+            if thread.ident not in self.trace_threads:
+                self.trace_threads.add(thread.ident)
+                self.trace_events.append(
+                    {"name": "thread_name", "ph": "M", "pid": 1, "tid": thread.ident, "args": {"name": thread.name}}
+                )
+            self.trace_events.append(event)
+
+    def save_trace(self, path):
+        """Write the trace events as a Chrome Trace Event JSON file"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self.telemetry_lock:
+            events = list(self.trace_events)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        print(f"Trace saved as {path}")
+
+    def current_step(self):
+        """Return the (step, chapter) this thread is working on"""
+        steps = getattr(self.local, "steps", None)
+        return steps[-1] if steps else (None, None)
+
+    @contextmanager
+    def track_call(self, streamed=False):
+        """Collect the telemetry record of the LLM call made inside the with block"""
+        step, chapter = self.current_step()
+        record = {
+            "step": step,
+            "chapter": chapter,
+            "backend": self.backend_name(),
+            "model": self.model,
+            "started_at": time.time(),
+            "queue_wait": 0.0,
+            "ttft": None,
+            "prompt_tokens": None,
+            "output_tokens": None,
+            "cached_tokens": None,
+            "cache_hit": None,
+            "retries": 0,
+            "streamed": streamed,
+            "ok": False,
+        }
+        self.local.call = record
+        self.local.call_started = time.monotonic()
+        try:
+            yield record
+        finally:
+            self.local.call = None
+            total = time.monotonic() - self.local.call_started
+            # Generation time from the backend when known, otherwise the time after the first token
+            generation = record.pop("generation_seconds", None) or total - record["queue_wait"] - (record["ttft"] or 0)
+            if record["output_tokens"] and generation > 0:
+                record["tokens_per_second"] = round(record["output_tokens"] / generation, 2)
+            else:
+                record["tokens_per_second"] = None
+            record["total_seconds"] = round(total, 3)
+            record["queue_wait"] = round(record["queue_wait"], 3)
+            if record["cached_tokens"] is not None:
+                record["cache_hit"] = record["cached_tokens"] > 0
+            speculative_calls = getattr(self.local, "speculative_calls", None)
+            if speculative_calls is not None:
+                # Held back until the draft is accepted or discarded, see record_speculative_calls
+                speculative_calls.append(record)
+            else:
+                self.record_call(record)
+            self.add_trace_event(
+                f"LLM {record['backend']} {record['model']}",
+                "llm",
+                self.local.call_started,
+                total,
+                **{key: value for key, value in record.items() if key not in ("backend", "model", "started_at")},
+            )
+
+    def record_call(self, record):
+        """Add a finished call's record to the telemetry and the run journal"""
+        with self.telemetry_lock:
+            self.telemetry.append(record)
+        self.journal_event("llm_call", call=record)
+
+    def journal_event(self, event, **fields):
+        """Append a state change to the run journal, if the run keeps one"""
+        if self.journal is not None:
+            self.journal.record(event, **fields)
+
+    def record_usage(self, **fields):
+        """Add backend usage figures to the telemetry record of the current call"""
+        call = getattr(self.local, "call", None)
+        if call is not None:
+            call.update({key: value for key, value in fields.items() if value is not None})
+
+    def record_stream_chunk(self):
+        """Count a streamed chunk (about one token) and take the time to the first one"""
+        call = getattr(self.local, "call", None)
+        if call is None:
+            return
+        if call["ttft"] is None:
+            call["ttft"] = round(time.monotonic() - self.local.call_started - call["queue_wait"], 3)
+        call["output_tokens"] = (call["output_tokens"] or 0) + 1
+
+    def ollama_usage(self, body):
+        """Telemetry fields of an Ollama response body (durations are in nanoseconds)"""
+        load = body.get("load_duration") or 0
+        prompt_eval = body.get("prompt_eval_duration") or 0
+        return {
+            "prompt_tokens": body.get("prompt_eval_count"),
+            "output_tokens": body.get("eval_count"),
+            "load_seconds": round(load / 1e9, 3) if load else None,
+            # Server-side time to first token: model load plus prompt evaluation
+            "ttft": round((load + prompt_eval) / 1e9, 3) if load or prompt_eval else None,
+            "generation_seconds": body["eval_duration"] / 1e9 if body.get("eval_duration") else None,
+        }
+
+    def openai_usage(self, usage):
+        """Telemetry fields of an OpenAI-style usage object (OpenAI, OpenRouter, DeepSeek)"""
+        if usage is None:
+            return {}
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) if details is not None else None
+        if cached is None:
+            # DeepSeek reports its disk cache separately
+            cached = getattr(usage, "prompt_cache_hit_tokens", None)
+        return {
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "output_tokens": getattr(usage, "completion_tokens", None),
+            "cached_tokens": cached,
+        }
+
+    def backend_name(self):
+        """Short name of the backend the calls go to"""
+        if self.uses_ollama():
+            return "ollama"
+        for name in ("openai", "anthropic", "openrouter", "deepseek"):
+            if name in self.base_url:
+                return name
+        return "unknown"
+
+    def telemetry_summary(self):
+        """Aggregate the call telemetry per pipeline step"""
+        with self.telemetry_lock:
+            records = list(self.telemetry)
+        return summarize_calls(records)
+
+    def backend_slot(self, priority):
+        """Context holding one of the endpoint's concurrency slots, or nothing when no limit is set"""
+        if self.backend_limiter is None:
+            return nullcontext()
+        # Rank by step class first, then interactive books ahead of batch books
+        return self.backend_limiter.slot(priority * 2 + (0 if self.interactive else 1))
+
+    def normalize_verdict_text(self, text):
+        """Strip markdown and quoting a model may put in front of a verdict"""
+        return re.sub(r"^[\s*#>_`\"']+", "", text or "").upper()
+
+    def verdict_decided(self, reply, verdict):
+        """Return True once the streamed reply is known to start with the verdict"""
+        return self.normalize_verdict_text(reply).startswith(verdict)
+
+    def matches_verdict(self, reply, verdict):
+        """Check whether a reply carries the positive verdict"""
+        if not reply:
+            return False
+        if self.verdict_decided(reply, verdict):
+            return True
+        # Lenient fallback for models that bury the verdict in a short sentence; long replies are issue lists
+        return len(reply) < 200 and verdict in reply and ("IN" + verdict) not in reply.upper()
+
+    def build_messages(self, prompt, system_prompt, context=None):
+        """Build chat messages with the stable book context ahead of the per-call parts"""
+        messages = []
+        if context:
+            messages.append({"role": "system", "content": self.join_context(context)})
+        messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    def build_system_blocks(self, system_prompt, context=None):
+        """Build Anthropic system blocks with a cache breakpoint after each book context block"""
+        blocks = []
+        if context:
+            for block in ([context] if isinstance(context, str) else context):
+                if block:
+                    blocks.append({"type": "text", "text": block, "cache_control": {"type": "ephemeral"}})
+        blocks.append({"type": "text", "text": system_prompt})
+        return blocks
+
+    def report_cache_usage(self, usage):
+        """Print the prompt cache read/write token counts of an Anthropic response and record its usage"""
+        if usage is None:
+            return
+        cache_read = getattr(usage, "cache_read_input_tokens", 0) or 0
+        cache_write = getattr(usage, "cache_creation_input_tokens", 0) or 0
+        self.record_usage(
+            prompt_tokens=usage.input_tokens + cache_read + cache_write,
+            output_tokens=usage.output_tokens,
+            cached_tokens=cache_read,
+        )
+        print(
+            f"Anthropic usage: input {usage.input_tokens}, cache read {cache_read}, "
+            f"cache write {cache_write}, output {usage.output_tokens} tokens"
+        )
+
+    def join_context(self, context):
+        """Flatten book context blocks into a single prefix string"""
+        return context if isinstance(context, str) else "".join(context)
+
+    def build_book_context(self, chapter_num):
+        """Build the canonical book-level prefix shared by every call made for a chapter
+
+        Only append-only book state goes here (premise, world, outline, plan, finished
+        summaries), always in the same order, so the prefix for chapter N+1 extends the
+        one for chapter N and server-side prefix caches keep hitting. The result is a list
+        of two blocks: the fixed story setup and the growing summaries, which lets the
+        Anthropic backend put a cache breakpoint on each of them.
+        """
+        setup = f"""BOOK CONTEXT
+
+STORY PREMISE: {self.story_premise}
+
+WORLD NAME: {self.world_name} (use this name consistently for the city/world)
+
+OVERALL STORY OUTLINE: {self.story_outline}
+
+DETAILED CHAPTER PLAN:
+{self.chapter_plan}
+
+"""
+        summaries = "PREVIOUS CHAPTERS SUMMARY:\n"
+        for i in range(1, chapter_num):
+            if i in self.chapter_summaries:
+                summaries += f"Chapter {i} Summary: {self.chapter_summaries[i]}\n\n"
+        return [setup, summaries]
+
+    def parse_json_output(self, text):
+        """Tolerantly extract JSON from LLM output
+
+        Skips markdown fences and any prose around the JSON. If the document is truncated or
+        broken part-way through an array, the complete elements parsed so far are returned
+        instead of nothing. Returns None when no JSON value can be recovered.
+        """
+        if not text:
+            return None
+        decoder = json.JSONDecoder()
+        start = min((i for i in (text.find("{"), text.find("[")) if i >= 0), default=-1)
+        if start < 0:
+            return None
+        try:
+            value, _ = decoder.raw_decode(text, start)
+            return value
+        except json.JSONDecodeError:
+            pass
+
+        # Incremental recovery: walk into the first array and keep every element that decodes
+        array_start = text.find("[", start)
+        if array_start < 0:
+            return None
+        items = []
+        pos = array_start + 1
+        while pos < len(text):
+            while pos < len(text) and text[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(text) or text[pos] == "]":
+                break
+            try:
+                item, pos = decoder.raw_decode(text, pos)
+            except json.JSONDecodeError:
+                break
+            items.append(item)
+        if not items:
+            return None
+        print(f"Recovered {len(items)} item(s) from malformed JSON output.")
+        # Keep the wrapper shape when the array was the value of a top-level key
+        key_match = re.search(r'"(\w+)"\s*:\s*$', text[start:array_start])
+        if text[start] == "{" and key_match:
+            return {key_match.group(1): items}
+        return items
+
+    @contextmanager
+    def ollama_request(self, path, data, stream=False):
+        """POST to Ollama, through the host pool when several endpoints are configured"""
+        if self.host_pool is not None:
+            with self.host_pool.request(path, self.model, data, stream=stream) as response:
+                yield response
+            return
+        # timeout set to 5 minutes
+        with self.session.post(self.ollama_url + path, json=data, stream=stream, timeout=300) as response:
+            response.raise_for_status()
+            yield response
+
+    def ollama_reply(self, path, data):
+        """Non-streaming Ollama call returning the response body, hedged across hosts when enabled"""
+        if self.host_pool is not None and self.hedge_percentile:
+            return self.host_pool.hedged_request(path, self.model, data, self.hedge_percentile, self.hedge_budget)
+        with self.ollama_request(path, data) as response:
+            return response.json()
+
+    def uses_ollama(self):
+        """Check if calls go to Ollama, either a local instance or a pool of hosts"""
+        return self.host_pool is not None or self.is_local_ollama(self.base_url)
+
     def is_local_ollama(self, base_url):
         """Check if the base_url is a local Ollama instance."""
         return (
@@ -213,6 +966,7 @@ STORY INPUT: One paragraph up to {self.max_premisw_lengh} characters with your p
             or re.match(r"^(?:[0-9]{1,3}\.){3}[0-9]{1,3}$", base_url.split(":")[1].strip("/"), re.IGNORECASE) # check if is a local ip adress
         )
 
+    @pipeline_step
     def extract_characters(self, text, method_llm=True):
         """Extract character information from text and create structured data"""
         if method_llm:
@@ -220,7 +974,7 @@ STORY INPUT: One paragraph up to {self.max_premisw_lengh} characters with your p
     Your task is to identify all characters mentioned in the text and provide a brief description for each.
     The output MUST be in JSON format. Ensure the JSON is valid and parsable."""
             prompt = f"""Extract all characters information from the following text.
-    The output MUST be a JSON array of character objects. Each object should have the following keys:
+    The output MUST be a JSON object with a "characters" array of character objects. Each object should have the following keys:
     - name: The character's name (string)
     - description: A brief description of the character (string)
     - first_appearance: 0,
@@ -231,9 +985,9 @@ STORY INPUT: One paragraph up to {self.max_premisw_lengh} characters with your p
     TEXT:
     {text}
     
-    Ensure the output is valid JSON. Start with '[' and end with ']'. Do not include any text outside of the JSON structure.
+    Ensure the output is valid JSON. Start with '{{' and end with '}}'. Do not include any text outside of the JSON structure.
     Here is an example of the desired output format:
-    [
+    {{"characters": [
       {{
         "name": "Character A",
         "description": "A brave warrior",
@@ -250,29 +1004,35 @@ STORY INPUT: One paragraph up to {self.max_premisw_lengh} characters with your p
         "development": [],
         "relationships": {{}}
       }}
-    ]
+    ]}}
     """
             try:
-                json_output = self.generate_text(prompt, system_prompt)
+                json_output = self.generate_text(prompt, system_prompt, json_schema=CHARACTER_LIST_SCHEMA)
                 print(f"LLM JSON Output: {json_output}")
                 if json_output:
-                    try:
-                        # Remove any markdown code blocks if they exist
-                        json_output = json_output.replace('```json', '').replace('```', '').strip()
-                        characters_list = json.loads(json_output)
-                        print(f"Extracted characters list: {characters_list}")
-    
-                        # Convert the list to a dictionary with character names as keys
-                        characters = {}
-                        for character in characters_list:
-                            name = character["name"]
-                            characters[name] = character  # Assign the entire character dictionary
-                        print(f"Extracted characters dict: {characters}")
-                        return characters
-    
-                    except (json.JSONDecodeError, TypeError) as e:
-                        print(f"Error decoding JSON from LLM: {e}. JSON Output: {json_output}")
+                    characters_list = self.parse_json_output(json_output)
+                    if isinstance(characters_list, dict):
+                        characters_list = characters_list.get("characters", [])
+                    if not isinstance(characters_list, list):
+                        print(f"Error decoding JSON from LLM. JSON Output: {json_output}")
                         return {}
+                    print(f"Extracted characters list: {characters_list}")
+
+                    # Convert the list to a dictionary with character names as keys, filling in tracking fields
+                    characters = {}
+                    for character in characters_list:
+                        if not isinstance(character, dict) or not character.get("name"):
+                            continue
+                        name = character["name"].strip()
+                        character["name"] = name
+                        character.setdefault("description", "")
+                        character.setdefault("first_appearance", 0)
+                        character.setdefault("status", "alive")
+                        character.setdefault("development", [])
+                        character.setdefault("relationships", {})
+                        characters[name] = character  # Assign the entire character dictionary
+                    print(f"Extracted characters dict: {characters}")
+                    return characters
                 else:
                     print("LLM returned empty output for character extraction.")
                     return {}
@@ -297,6 +1057,7 @@ STORY INPUT: One paragraph up to {self.max_premisw_lengh} characters with your p
                 }
             return characters
 
+    @pipeline_step
     def extract_world_name(self, outline, method_llm=True):
         """Extract consistent world name from the story outline"""
         if method_llm:
@@ -341,17 +1102,7 @@ STORY INPUT: One paragraph up to {self.max_premisw_lengh} characters with your p
                 return ""
     
             # Generic pattern to find world names without hardcoding specific ones
-            patterns = [
-                r"Neo-[A-Za-z]+",
-                r"[A-Z][a-z]+land",
-                r"[A-Z][a-z]+ Kingdom",
-                r"[A-Z][a-z]+ Empire",
-                r"[A-Z][a-z]+ Realm",
-                r"[A-Z][a-z]+ World",
-                r"[A-Z][a-z]+ City"
-            ]
-    
-            for pattern in patterns:
+            for pattern in WORLD_NAME_PATTERNS:
                 matches = re.findall(pattern, outline)
                 if matches:
                     # Use the most common name found
@@ -368,6 +1119,7 @@ STORY INPUT: One paragraph up to {self.max_premisw_lengh} characters with your p
             print("No world name found using patterns. Will attempt LLM generation later.")
             return ""
 
+    @pipeline_step
     def create_story_outline(self):
         """Generate a high-level outline for the entire story with improved structure"""
 
@@ -408,7 +1160,9 @@ STORY INPUT: One paragraph up to {self.max_premisw_lengh} characters with your p
             )
 
         print("----------------- Generating detailed story outline... ----------------- \n")
-        self.story_outline = self.generate_text(prompt, system_prompt)
+        with self.step_context("story_outline"):
+            self.story_outline = self.generate_text(prompt, system_prompt)
+        self.journal_event("story_outline", text=self.story_outline)
         print(f"-----------------  Generated story outline:\n {self.story_outline} ----------------- \n")
 
         if self.story_outline is None:
@@ -433,7 +1187,8 @@ STORY INPUT: One paragraph up to {self.max_premisw_lengh} characters with your p
 
         print(f"----------------- Creating detailed character profiles... ----------------- \n")
             
-        character_text = self.generate_text(char_prompt, system_prompt)
+        with self.step_context("character_profiles"):
+            character_text = self.generate_text(char_prompt, system_prompt)
         
         if character_text:
             # Extract characters from the generated text
@@ -448,6 +1203,7 @@ STORY INPUT: One paragraph up to {self.max_premisw_lengh} characters with your p
             # or return None for GUI version
             # or raise an exception
         
+        self.journal_event("characters", characters=self.characters)
         if self.characters and isinstance(self.characters, dict) and len(self.characters) > 0:
             print("----------------- Extracted characters: -----------------")
             for character_name, character_data in self.characters.items():
@@ -464,9 +1220,11 @@ STORY INPUT: One paragraph up to {self.max_premisw_lengh} characters with your p
                 story_outline=self.story_outline
             )
             print("Generating world name...")
-            self.world_name = self.generate_text(world_prompt).strip()
+            with self.step_context("world_name"):
+                self.world_name = self.generate_text(world_prompt).strip()
             print(f"----------------- Generated world name: {self.world_name} ----------------- \n")
 
+        self.journal_event("world_name", name=self.world_name)
         print(f"----------------- World name: {self.world_name} -----------------\n")
         
         # Extract recurring motifs 
@@ -474,8 +1232,10 @@ STORY INPUT: One paragraph up to {self.max_premisw_lengh} characters with your p
             story_outline=self.story_outline
         )
         print("----------------- Identifying recurring motifs... -----------------")
-        motifs_text = self.generate_text(motif_prompt)
+        with self.step_context("recurring_motifs"):
+            motifs_text = self.generate_text(motif_prompt)
         self.recurring_motifs = [motif.strip() for motif in motifs_text.strip().split('\n') if motif.strip()]
+        self.journal_event("recurring_motifs", motifs=self.recurring_motifs)
         print("----------------- Identified motifs: -----------------")
         for motif in self.recurring_motifs:
             print(f"- {motif}")
@@ -488,10 +1248,13 @@ STORY INPUT: One paragraph up to {self.max_premisw_lengh} characters with your p
         )
         
         print("----------------- Creating detailed chapter plan... ----------------- \n")
-        self.chapter_plan = self.generate_text(chapter_plan_prompt, system_prompt)
+        with self.step_context("chapter_plan"):
+            self.chapter_plan = self.generate_text(chapter_plan_prompt, system_prompt)
+        self.journal_event("chapter_plan", text=self.chapter_plan)
 
-    def create_chapter_summary(self, chapter_num, chapter_content):
-        """Create a detailed summary of a chapter after it's written"""
+    @pipeline_step
+    def create_chapter_summary(self, chapter_num, chapter_content, store=True):
+        """Create a detailed summary of a chapter after it's written; store=False only returns it"""
         system_prompt = """You are a literary analyst specializing in narrative structure and continuity.
 Create comprehensive, detailed summaries that capture all key elements."""
         prompt = f"""Create a detailed summary of the following chapter content.
@@ -510,16 +1273,32 @@ CHAPTER CONTENT:
 
 Your summary should be comprehensive enough that another writer could use it to maintain perfect continuity.
 """
-        summary = self.generate_text(prompt, system_prompt)
-        self.chapter_summaries[chapter_num] = summary
+        summary = self.generate_text(prompt, system_prompt, priority=PRIORITY_ANALYSIS)
+        if store:
+            self.chapter_summaries[chapter_num] = summary
+            self.journal_event("summary", chapter=chapter_num, text=summary)
         return summary
 
     def update_character_tracking(self, chapter_num, chapter_content):
         """Update character tracking data based on a chapter's content"""
+        mentions, updates = self.request_character_updates(chapter_num, chapter_content)
+        self.apply_character_updates(chapter_num, mentions, updates)
+
+    @pipeline_step
+    def request_character_updates(self, chapter_num, chapter_content):
+        """Ask the LLM how the characters named in a chapter developed, without changing book state
+
+        Returns the mention scan of the chapter and the list of parsed per-character updates.
+        """
         system_prompt = """You are a narrative continuity expert who specializes in tracking character development.
 Extract precise information about characters from text."""
-        character_names = list(self.characters.keys())
-        characters_str = ", ".join(character_names)
+        # Find who is actually named in the chapter so the prompt only asks about them
+        mentions = self.scan_character_mentions(chapter_content)
+        if not mentions:
+            print(f"No tracked characters are mentioned in Chapter {chapter_num}, skipping character tracking.")
+            return mentions, []
+
+        characters_str = ", ".join(mentions)
         prompt = f"""Based on the following chapter content, track the development of all characters mentioned.
 
 CHAPTER CONTENT:
@@ -528,48 +1307,84 @@ CHAPTER CONTENT:
 CHARACTERS TO TRACK: {characters_str}
 
 For each character that appears in this chapter, provide:
-1. Current status (alive, dead, injured, etc.)
-2. Development in this chapter
-3. New relationships formed
-4. Current location
-5. Emotional state at the end of the chapter
+1. status: current status (alive, dead, injured, etc.)
+2. development: development in this chapter
+3. relationships: new relationships formed, naming the other characters
+4. location: current location
+5. emotional_state: emotional state at the end of the chapter
 
-Format as:
-CHARACTER NAME: status|development|relationships|location|emotional_state
+Reply with a JSON object of the form:
+{{"characters": [{{"name": "...", "status": "...", "development": "...", "relationships": "...", "location": "...", "emotional_state": "..."}}]}}
 
-Only include characters who actually appear or are mentioned in this chapter.
+Use the names exactly as listed above. Only include characters who actually appear or are mentioned in this chapter.
 """
-        character_updates = self.generate_text(prompt, system_prompt)
-
-        # Parse and update character data
-        update_pattern = r"([A-Z][A-Za-z\s]+):\s+([^|]+)\|([^|]+)\|([^|]+)\|([^|]+)\|([^\n]+)"
-        matches = re.findall(update_pattern, character_updates)
+        character_updates = self.generate_text(
+            prompt, system_prompt, json_schema=CHARACTER_UPDATES_SCHEMA, priority=PRIORITY_ANALYSIS
+        )
 
-        for match in matches:
-            name = match[0].strip()
+        # Parse character data
+        updates = self.parse_json_output(character_updates)
+        if isinstance(updates, dict):
+            updates = updates.get("characters", [])
+        if not isinstance(updates, list):
+            print(f"Could not parse character updates for Chapter {chapter_num}.")
+            return mentions, []
+        return mentions, updates
+
+    def apply_character_updates(self, chapter_num, mentions, updates):
+        """Record chapter appearances and apply parsed character updates to the tracked cast"""
+        changed = dict.fromkeys(mentions)
+        for name, mention in mentions.items():
+            self.characters[name].setdefault("appearances", {})[chapter_num] = mention["count"]
+            # Record first appearance if not already set
+            if self.characters[name]["first_appearance"] == 0:
+                self.characters[name]["first_appearance"] = chapter_num
+
+        for update in updates:
+            if not isinstance(update, dict):
+                continue
+            name = str(update.get("name", "")).strip()
+            if name not in self.characters:
+                # The model may answer with a first name or alias, resolve it against the cast
+                resolved = list(self.scan_character_mentions(name))
+                if len(resolved) == 1:
+                    name = resolved[0]
             if name in self.characters:
-                self.characters[name]["status"] = match[1].strip()
+                self.characters[name]["status"] = str(update.get("status", self.characters[name]["status"])).strip()
                 self.characters[name]["development"].append({
                     "chapter": chapter_num,
-                    "development": match[2].strip()
+                    "development": str(update.get("development", "")).strip()
                 })
                 # Update relationship data
-                new_relationships = match[3].strip()
+                new_relationships = str(update.get("relationships", "")).strip()
                 if new_relationships:
-                    for other_char in character_names:
-                        if other_char != name and other_char in new_relationships:
+                    for other_char in self.scan_character_mentions(new_relationships):
+                        if other_char != name:
                             self.characters[name]["relationships"][other_char] = chapter_num
 
                 # Update location and emotional state
-                self.characters[name]["location"] = match[4].strip()
-                self.characters[name]["emotional_state"] = match[5].strip()
+                self.characters[name]["location"] = str(update.get("location", "")).strip()
+                self.characters[name]["emotional_state"] = str(update.get("emotional_state", "")).strip()
 
                 # Record first appearance if not already set
                 if self.characters[name]["first_appearance"] == 0:
                     self.characters[name]["first_appearance"] = chapter_num
-
-    def update_timeline(self, chapter_num, chapter_content):
-        """Extract and update timeline information for chapter"""
+                changed[name] = None
+
+        for name in changed:
+            self.journal_event("character", name=name, data=self.characters[name])
+
+    def scan_character_mentions(self, text):
+        """Find all cast members named in text in one pass, rebuilding the matcher when the cast changes"""
+        if not self.characters:
+            return {}
+        if self.character_scanner is None or self.character_scanner.names != list(self.characters.keys()):
+            self.character_scanner = CharacterScanner(self.characters)
+        return self.character_scanner.scan(text)
+
+    @pipeline_step
+    def update_timeline(self, chapter_num, chapter_content, store=True):
+        """Extract and update timeline information for chapter; store=False only returns it"""
         system_prompt = """You are a literary analyst specializing in temporal structure in narratives."""
         
         prompt = f"""Based on the following chapter content, determine:
@@ -586,12 +1401,15 @@ Only include characters who actually appear or are mentioned in this chapter.
         TIME_MARKERS: [any specific times mentioned]
         """
         
-        time_info = self.generate_text(prompt, system_prompt)
-        self.timeline[chapter_num] = time_info
+        time_info = self.generate_text(prompt, system_prompt, priority=PRIORITY_ANALYSIS)
+        if store:
+            self.timeline[chapter_num] = time_info
+            self.journal_event("timeline", chapter=chapter_num, text=time_info)
         return time_info
 
-    def track_emotional_arc(self, chapter_num, chapter_content):
-        """Track emotional tone and tension at the end of the chapter"""
+    @pipeline_step
+    def track_emotional_arc(self, chapter_num, chapter_content, store=True):
+        """Track emotional tone and tension at the end of the chapter; store=False only returns it"""
         system_prompt = """You are a literary analyst specializing in emotional arcs in storytelling."""
         
         prompt = f"""Analyze the emotional tone at the end of this chapter:
@@ -610,10 +1428,13 @@ Only include characters who actually appear or are mentioned in this chapter.
         UNRESOLVED: [main unresolved question]
         """
         
-        emotional_status = self.generate_text(prompt, system_prompt)
-        self.emotional_arc[chapter_num] = emotional_status
+        emotional_status = self.generate_text(prompt, system_prompt, priority=PRIORITY_ANALYSIS)
+        if store:
+            self.emotional_arc[chapter_num] = emotional_status
+            self.journal_event("emotional_arc", chapter=chapter_num, text=emotional_status)
         return emotional_status
 
+    @pipeline_step
     def create_chapter_transition(self, chapter_num, chapter_content):
         """Create a transition from current chapter to the next"""
         if chapter_num >= self.num_chapters:
@@ -623,14 +1444,12 @@ Only include characters who actually appear or are mentioned in this chapter.
         chapter endings and smooth transitions between chapters."""
         
         # Extract relevant part of chapter plan for the next chapter
-        chapter_plan_prompt = f"""From this detailed chapter plan, extract ONLY the plan 
-        for Chapter {chapter_num + 1}:
-
-        {self.chapter_plan}
+        chapter_plan_prompt = f"""From the detailed chapter plan in the book context, extract ONLY the plan 
+        for Chapter {chapter_num + 1}.
 
         Include ONLY Chapter {chapter_num + 1}'s detailed plan.
         """
-        next_chapter_plan = self.generate_text(chapter_plan_prompt)
+        next_chapter_plan = self.generate_text(chapter_plan_prompt, context=self.build_book_context(chapter_num))
         
         # Get emotional status
         emotional_status = self.emotional_arc.get(chapter_num, "")
@@ -673,10 +1492,12 @@ Only include characters who actually appear or are mentioned in this chapter.
         Create only 1-2 paragraphs for this transition. These will be the FINAL paragraphs of the current chapter.
         """
         
-        transition = self.generate_text(prompt, system_prompt)
+        transition = self.generate_text(prompt, system_prompt, context=self.build_book_context(chapter_num))
         self.transitions[chapter_num] = transition
+        self.journal_event("transition", chapter=chapter_num, text=transition)
         return transition
 
+    @pipeline_step
     def create_next_chapter_opener(self, chapter_num):
         """Create a strong opening for the next chapter that connects to the previous one"""
         if chapter_num <= 1:
@@ -700,14 +1521,12 @@ Only include characters who actually appear or are mentioned in this chapter.
                 prev_end_time = time_match.group(1).strip()
         
         # Extract relevant part of chapter plan for this chapter
-        chapter_plan_prompt = f"""From this detailed chapter plan, extract ONLY the plan 
-        for Chapter {chapter_num}:
-
-        {self.chapter_plan}
+        chapter_plan_prompt = f"""From the detailed chapter plan in the book context, extract ONLY the plan 
+        for Chapter {chapter_num}.
 
         Include ONLY Chapter {chapter_num}'s detailed plan.
         """
-        this_chapter_plan = self.generate_text(chapter_plan_prompt)
+        this_chapter_plan = self.generate_text(chapter_plan_prompt, context=self.build_book_context(chapter_num))
         
         prompt = f"""Create a compelling opening paragraph for Chapter {chapter_num} that connects 
         seamlessly with the end of Chapter {chapter_num - 1}.
@@ -738,19 +1557,81 @@ Only include characters who actually appear or are mentioned in this chapter.
         Create a single strong opening paragraph (3-5 sentences).
         """
         
-        opener = self.generate_text(prompt, system_prompt)
+        opener = self.generate_text(prompt, system_prompt, context=self.build_book_context(chapter_num))
         return opener
 
-    def validate_chapter_consistency(self, chapter_num, chapter_content):
+    @pipeline_step
+    def prevalidate_chapter(self, chapter_num, chapter_content):
+        """Run cheap deterministic consistency checks and score the chapter's risk
+
+        Returns a dict with the risk "score" and the list of "issues" found, which is used to
+        decide whether the LLM validator is needed and to focus it on concrete problems.
+        """
+        issues = []
+        score = 0
+        content = chapter_content or ""
+
+        # World name: other world-like names appearing instead of the established one
+        if self.world_name:
+            foreign_names = set()
+            for pattern in WORLD_NAME_PATTERNS:
+                for match in re.findall(pattern, content):
+                    if match not in self.world_name and self.world_name not in match:
+                        foreign_names.add(match)
+            if foreign_names:
+                score += 2
+                issues.append(
+                    f"World/city names other than {self.world_name} are used: {', '.join(sorted(foreign_names))}"
+                )
+                if self.world_name not in content:
+                    score += 1
+                    issues.append(f"The established world name {self.world_name} is never used")
+
+        # Dead characters who still act or speak in this chapter
+        mentions = self.scan_character_mentions(content)
+        for name, mention in mentions.items():
+            status = str(self.characters[name].get("status", "")).lower()
+            if not re.search(r"\b(dead|deceased|died|killed)\b", status):
+                continue
+            for position in mention["positions"]:
+                following = content[position:position + len(name) + 40]
+                if re.match(re.escape(following.split()[0]) + r"(?:\s+\w+)?" + ACTION_VERBS_PATTERN, following):
+                    score += 3
+                    issues.append(f"{name} is marked as '{status}' but acts or speaks in this chapter")
+                    break
+
+        # Capitalized names that are neither in the cast nor anywhere in the planning material
+        known_words = set(re.findall(r"\b[A-Z][a-z]+\b", " ".join([
+            self.story_premise or "", self.story_outline or "", self.chapter_plan or "",
+            self.world_name or "", " ".join(self.characters.keys()), " ".join(self.recurring_motifs),
+        ])))
+        unknown_counts = {}
+        # Skip words at the start of a sentence, paragraph or quotation, where capitals are not names
+        for match in re.finditer(r"(?<![.!?\"\u201c\n]\s)(?<![.!?\"\u201c\n])\b([A-Z][a-z]{2,})\b", content):
+            word = match.group(1)
+            if match.start() == 0 or word in known_words:
+                continue
+            unknown_counts[word] = unknown_counts.get(word, 0) + 1
+        unknown_names = sorted(word for word, count in unknown_counts.items() if count >= 2)
+        if unknown_names:
+            score += min(len(unknown_names), 3)
+            issues.append(f"Names not in the cast or outline appear repeatedly: {', '.join(unknown_names[:10])}")
+
+        # Chapter length outside the expected bounds
+        word_count = len(content.split())
+        if word_count < self.min_chapter_words or word_count > self.max_chapter_words:
+            score += 1
+            issues.append(
+                f"Chapter length is {word_count} words, expected {self.min_chapter_words}-{self.max_chapter_words}"
+            )
+
+        return {"score": score, "issues": issues}
+
+    @pipeline_step
+    def validate_chapter_consistency(self, chapter_num, chapter_content, local_issues=None):
         """Check chapter for consistency issues"""
         system_prompt = """You are a literary editor specializing in narrative consistency.
 Your job is to identify and flag any inconsistencies in a narrative."""
-        # Create context for consistency check
-        previous_summaries = ""
-        for i in range(1, chapter_num):
-            if i in self.chapter_summaries:
-                previous_summaries += f"Chapter {i} Summary: {self.chapter_summaries[i]}\n\n"
-
         character_status = ""
         for name, data in self.characters.items():
             if data["first_appearance"] > 0:  # Only include characters who have appeared
@@ -764,14 +1645,14 @@ Your job is to identify and flag any inconsistencies in a narrative."""
             if i in self.timeline:
                 timeline_info += f"Chapter {i} Timeline: {self.timeline[i]}\n"
 
-        prompt = f"""Analyze this chapter for consistency issues compared to previous chapters.
-
-STORY PREMISE: {self.story_premise}
-
-WORLD NAME: {self.world_name}
+        # Issues found by the local pre-check give the validator concrete things to verify first
+        focus_issues = ""
+        if local_issues:
+            focus_issues = "AUTOMATED CHECKS FLAGGED (verify these first):\n" + "\n".join(
+                f"- {issue}" for issue in local_issues
+            )
 
-PREVIOUS CHAPTERS:
-{previous_summaries}
+        prompt = f"""Analyze this chapter for consistency issues compared to previous chapters.
 
 CHARACTER STATUS:
 {character_status}
@@ -782,6 +1663,8 @@ TIMELINE INFORMATION:
 CURRENT CHAPTER {chapter_num} CONTENT:
 {chapter_content}
 
+{focus_issues}
+
 Identify ANY inconsistencies related to:
 1. Character names or backgrounds
 2. Setting/location names
@@ -790,28 +1673,34 @@ Identify ANY inconsistencies related to:
 5. Sudden introduction of new characters without proper context
 6. Time of day or elapsed time inconsistencies
 
-If any inconsistencies are found, list them in order of severity.
-If no inconsistencies are found, respond with "CONSISTENT".
+If no inconsistencies are found, respond with "CONSISTENT" as the very first word and nothing else.
+If any inconsistencies are found, start with "ISSUES:" and list them in order of severity.
 """
-        consistency_check = self.generate_text(prompt, system_prompt)
+        consistency_check = self.generate_verdict(
+            prompt,
+            system_prompt,
+            "CONSISTENT",
+            context=self.build_book_context(chapter_num),
+            max_tokens=self.validation_max_tokens,
+        )
         return consistency_check
 
+    @pipeline_step
     def fix_chapter_inconsistencies(self, chapter_num, chapter_content, issues):
         """Fix identified consistency issues in a chapter"""
         system_prompt = """You are a professional novelist and editor who excels at maintaining narrative consistency.
 Fix all inconsistencies while preserving the core narrative."""
-        # Create context for the fix
-        previous_summaries = ""
-        for i in range(1, chapter_num):
-            if i in self.chapter_summaries:
-                previous_summaries += f"Chapter {i} Summary: {self.chapter_summaries[i]}\n\n"
-
         character_status = ""
         for name, data in self.characters.items():
             if data["first_appearance"] > 0:  # Only include characters who have appeared
                 status = data["status"]
                 first_app = data["first_appearance"]
-                dev = "; ".join(data["development"]) if isinstance(data["development"], list) else data["development"]
+                if isinstance(data["development"], list):
+                    dev = "; ".join(
+                        entry["development"] if isinstance(entry, dict) else str(entry) for entry in data["development"]
+                    )
+                else:
+                    dev = data["development"]
                 character_status += f"{name}: First appeared in Chapter {first_app}, Status: {status}, Development: {dev}\n"
 
         # Add timeline information
@@ -820,14 +1709,15 @@ Fix all inconsistencies while preserving the core narrative."""
             if i in self.timeline:
                 timeline_info += f"Chapter {i} Timeline: {self.timeline[i]}\n"
 
-        prompt = f"""Rewrite this chapter to fix all the identified consistency issues while maintaining the same overall plot and character development.
-
-STORY PREMISE: {self.story_premise}
-
-WORLD NAME: {self.world_name} (use this name consistently for the city/world)
+        if self.fix_mode == "patch":
+            patched_chapter = self.patch_chapter_paragraphs(
+                chapter_num, chapter_content, issues, character_status, timeline_info
+            )
+            if patched_chapter is not None:
+                return patched_chapter
+            print(f"Paragraph patching failed for Chapter {chapter_num}, rewriting the complete chapter...")
 
-PREVIOUS CHAPTERS:
-{previous_summaries}
+        prompt = f"""Rewrite this chapter to fix all the identified consistency issues while maintaining the same overall plot and character development.
 
 CHARACTER STATUS:
 {character_status}
@@ -851,20 +1741,84 @@ Guidelines for fixing:
 
 Rewrite the complete chapter while fixing all issues.
 """
-        fixed_chapter = self.generate_text(prompt, system_prompt)
+        fixed_chapter = self.generate_text(prompt, system_prompt, context=self.build_book_context(chapter_num))
         return fixed_chapter
 
+    @pipeline_step
+    def patch_chapter_paragraphs(self, chapter_num, chapter_content, issues, character_status, timeline_info):
+        """Fix consistency issues by replacing only the affected paragraphs
+
+        The chapter is sent with numbered paragraphs and the model returns replacements for the
+        paragraphs that need changes, which are applied in place. Returns None when no usable
+        patch comes back or so much of the chapter changes that a full rewrite is preferable.
+        """
+        system_prompt = """You are a professional novelist and editor who excels at maintaining narrative consistency.
+Fix inconsistencies with minimal, targeted edits that preserve the surrounding prose."""
+        paragraphs = chapter_content.split("\n\n")
+        numbered_paragraphs = "\n\n".join(f"[{index}] {paragraph}" for index, paragraph in enumerate(paragraphs))
+
+        prompt = f"""Fix the identified consistency issues in this chapter by editing only the paragraphs that contain them.
+
+CHARACTER STATUS:
+{character_status}
+
+TIMELINE INFORMATION:
+{timeline_info}
+
+CURRENT CHAPTER CONTENT (paragraphs numbered in brackets):
+{numbered_paragraphs}
+
+CONSISTENCY ISSUES TO FIX:
+{issues}
+
+Guidelines for fixing:
+1. Change only the paragraphs that contain an issue; leave every other paragraph untouched
+2. Ensure all character names, backgrounds, and statuses match previous chapters
+3. Use the established world name ({self.world_name}) consistently
+4. Keep each replacement in the same voice, tense and length as the original paragraph
+5. Do not include the bracketed paragraph number in the replacement text
+
+Reply with a JSON object of the form:
+{{"patches": [{{"paragraph": <paragraph number>, "text": "<complete replacement paragraph>"}}]}}
+"""
+        patch_output = self.generate_text(
+            prompt, system_prompt, context=self.build_book_context(chapter_num), json_schema=PARAGRAPH_PATCH_SCHEMA
+        )
+        patches = self.parse_json_output(patch_output)
+        if isinstance(patches, dict):
+            patches = patches.get("patches")
+        if not isinstance(patches, list):
+            return None
+
+        replacements = {}
+        for patch in patches:
+            if not isinstance(patch, dict):
+                continue
+            try:
+                index = int(patch.get("paragraph"))
+            except (TypeError, ValueError):
+                continue
+            if 0 <= index < len(paragraphs) and isinstance(patch.get("text"), str):
+                # Models sometimes echo the paragraph marker, strip it
+                replacements[index] = re.sub(r"^\[\d+\]\s*", "", patch["text"].strip())
+        if not replacements:
+            return None
+        if len(replacements) > max(1, len(paragraphs) * self.max_patch_ratio):
+            return None
+
+        for index, text in replacements.items():
+            paragraphs[index] = text
+        print(f"Patched {len(replacements)} of {len(paragraphs)} paragraphs in Chapter {chapter_num}.")
+        return "\n\n".join(paragraph for paragraph in paragraphs if paragraph)
+
+    @pipeline_step
     def generate_chapter(self, chapter_num):
         """Generate a single chapter with enhanced context awareness and consistency checks"""
         system_prompt = """You are a celebrated novelist known for writing engaging, coherent chapters 
 with natural flow and character development. Your chapters have clear narrative structure and 
 maintain perfect consistency with previously established elements."""
-        # Build context from previous chapters
-        context_summaries = []
-        for i in range(1, chapter_num):
-            if i in self.chapter_summaries:
-                context_summaries.append(f"Chapter {i} Summary: {self.chapter_summaries[i]}")
-        context = "\n\n".join(context_summaries)
+        # Premise, world, outline, plan and previous summaries form the shared cacheable prefix
+        context = self.build_book_context(chapter_num)
 
         # Create character context
         character_context = []
@@ -889,17 +1843,16 @@ maintain perfect consistency with previously established elements."""
 
         # Create chapter opener for chapters after the first
         chapter_opener = ""
-        if chapter_num > 1:
+        if chapter_num > 1 and self.stages["chapter_openers"]:
             chapter_opener = self.create_next_chapter_opener(chapter_num)
 
         # Extract relevant part of chapter plan for this chapter
-        chapter_plan_prompt = f"""From this detailed chapter plan, extract ONLY the plan for Chapter {chapter_num}:
-
-{self.chapter_plan}
+        chapter_plan_prompt = f"""From the detailed chapter plan in the book context, extract ONLY the plan for Chapter {chapter_num}.
 
 Include ONLY Chapter {chapter_num}'s detailed plan.
 """
-        this_chapter_plan = self.generate_text(chapter_plan_prompt)
+        with self.step_context("extract_chapter_plan"):
+            this_chapter_plan = self.generate_text(chapter_plan_prompt, context=context)
 
         # Choose a recurring motif to include
         if self.recurring_motifs:
@@ -908,13 +1861,7 @@ Include ONLY Chapter {chapter_num}'s detailed plan.
         else:
             motif_instruction = ""
 
-        prompt = f"""Write Chapter {chapter_num} of a novel based on the following guidelines:
-
-STORY PREMISE: {self.story_premise}
-
-WORLD NAME: {self.world_name} (use this name consistently throughout)
-
-OVERALL STORY OUTLINE: {self.story_outline}
+        prompt = f"""Write Chapter {chapter_num} of a novel based on the book context and the following guidelines:
 
 THIS CHAPTER'S DETAILED PLAN:
 {this_chapter_plan}
@@ -922,9 +1869,6 @@ THIS CHAPTER'S DETAILED PLAN:
 CHARACTERS IN THIS STORY SO FAR:
 {characters_in_chapter}
 
-PREVIOUS CHAPTERS SUMMARY:
-{context}
-
 TIMELINE INFORMATION:
 {timeline_context}
 
@@ -960,35 +1904,69 @@ CHAPTER STRUCTURE GUIDELINES:
 Format the chapter with proper paragraph structure and dialogue formatting. Start with the chapter title.
 """
         print(f"Generating Chapter {chapter_num}...")
-        chapter_content = self.generate_text(prompt, system_prompt)
+        with self.step_context("draft_chapter"):
+            chapter_content = self.generate_text(prompt, system_prompt, context=context)
 
-        # Check for consistency issues
-        print(f"Validating Chapter {chapter_num} for consistency...")
-        consistency_check = self.validate_chapter_consistency(chapter_num, chapter_content)
+        # Cheap local checks decide whether the LLM consistency check is worth running
+        precheck = self.prevalidate_chapter(chapter_num, chapter_content)
+        needs_validation = self.stages["validation"] == "always" or not (
+            self.validation_threshold and precheck["score"] < self.validation_threshold
+        )
+        if not needs_validation:
+            print(f"Chapter {chapter_num} passed local checks (risk {precheck['score']}), skipping LLM validation.")
+
+        speculation = None
+        if needs_validation and self.speculative:
+            # Most chapters come back consistent, so analyse the draft while it is being validated
+            speculation = self.start_speculative_analysis(chapter_num, chapter_content)
+
+        consistency_check = "CONSISTENT"
+        if needs_validation:
+            # Check for consistency issues
+            print(f"Validating Chapter {chapter_num} for consistency (local risk {precheck['score']})...")
+            consistency_check = self.validate_chapter_consistency(chapter_num, chapter_content, precheck["issues"])
 
         # If issues found, fix them
-        if "CONSISTENT" not in consistency_check:
+        draft_content = chapter_content
+        if consistency_check is None:
+            print(f"Consistency check failed for Chapter {chapter_num}, keeping the draft as is.")
+        elif not self.matches_verdict(consistency_check, "CONSISTENT"):
             print(f"Consistency issues found in Chapter {chapter_num}. Fixing...")
-            chapter_content = self.fix_chapter_inconsistencies(chapter_num, chapter_content, consistency_check)
-            print(f"Chapter {chapter_num} fixed for consistency.")
+            fixed_content = self.fix_chapter_inconsistencies(chapter_num, chapter_content, consistency_check)
+            if fixed_content:
+                chapter_content = fixed_content
+                print(f"Chapter {chapter_num} fixed for consistency.")
+            else:
+                print(f"Fixing Chapter {chapter_num} failed, keeping the draft as is.")
         else:
             print(f"Chapter {chapter_num} is consistent with previous narrative.")
 
-        # Create summary and update character tracking
-        print(f"Creating detailed summary for Chapter {chapter_num}...")
-        self.create_chapter_summary(chapter_num, chapter_content)
-        
-        print(f"Updating character tracking for Chapter {chapter_num}...")
-        self.update_character_tracking(chapter_num, chapter_content)
-        
-        print(f"Updating timeline information for Chapter {chapter_num}...")
-        self.update_timeline(chapter_num, chapter_content)
-        
-        print(f"Analyzing emotional arc for Chapter {chapter_num}...")
-        self.track_emotional_arc(chapter_num, chapter_content)
+        if speculation is not None:
+            executor, futures, calls = speculation
+            # Let the speculative calls finish before anything reruns, so stale results cannot land late
+            with self.step_context("wait_speculative_analysis"):
+                executor.shutdown(wait=True)
+            if chapter_content == draft_content:
+                print(f"Using speculative analysis of Chapter {chapter_num}.")
+                self.record_speculative_calls(calls, discarded=False)
+                if "merged" in futures:
+                    self.apply_chapter_analysis(chapter_num, chapter_content, *futures["merged"].result())
+                else:
+                    self.store_chapter_analysis(
+                        chapter_num, futures["summary"].result(), futures["timeline"].result(), futures["emotional_arc"].result()
+                    )
+                    mentions, updates = futures["characters"].result()
+                    self.apply_character_updates(chapter_num, mentions, updates)
+            else:
+                print(f"Chapter {chapter_num} changed after validation, discarding speculative analysis.")
+                # The calls were made and paid for, but their results describe text that is not in the book
+                self.record_speculative_calls(calls, discarded=True)
+                self.analyze_chapter(chapter_num, chapter_content)
+        else:
+            self.analyze_chapter(chapter_num, chapter_content)
 
         # Add transition if not the last chapter
-        if chapter_num < self.num_chapters:
+        if chapter_num < self.num_chapters and self.stages["chapter_transitions"]:
             print(f"Creating transitional ending for Chapter {chapter_num}...")
             transition = self.create_chapter_transition(chapter_num, chapter_content)
             
@@ -1002,23 +1980,143 @@ Format the chapter with proper paragraph structure and dialogue formatting. Star
 
         return chapter_content
 
-    def check_chapter_transitions(self):
-        """Check and improve transitions between all chapters after generation"""
-        print("Performing final check on chapter transitions...")
-        improved_chapters = []
+    @pipeline_step
+    def analyze_chapter(self, chapter_num, chapter_content):
+        """Run the post-chapter analyses: summary, character tracking, timeline and emotional arc"""
+        if self.stages["analysis"] == "merged":
+            print(f"Analyzing Chapter {chapter_num} (summary, characters, timeline, emotional arc)...")
+            self.apply_chapter_analysis(chapter_num, chapter_content, *self.request_chapter_analysis(chapter_num, chapter_content))
+            return
+
+        # Create summary and update character tracking
+        print(f"Creating detailed summary for Chapter {chapter_num}...")
+        self.create_chapter_summary(chapter_num, chapter_content)
         
-        for i in range(len(self.chapters)):
-            if i == 0:
-                improved_chapters.append(self.chapters[i])
-                continue
-                
-            # Get current and previous chapters
-            prev_chapter = self.chapters[i-1]
-            current_chapter = self.chapters[i]
-            
-            system_prompt = """You are a professional editor specializing in narrative flow and chapter transitions."""
-            
-            prompt = f"""Analyze the transition between these consecutive chapters and improve it if needed:
+        print(f"Updating character tracking for Chapter {chapter_num}...")
+        self.update_character_tracking(chapter_num, chapter_content)
+        
+        print(f"Updating timeline information for Chapter {chapter_num}...")
+        self.update_timeline(chapter_num, chapter_content)
+        
+        print(f"Analyzing emotional arc for Chapter {chapter_num}...")
+        self.track_emotional_arc(chapter_num, chapter_content)
+
+    @pipeline_step
+    def request_chapter_analysis(self, chapter_num, chapter_content):
+        """Ask for the summary, character updates, timeline and emotional arc of a chapter in one call
+
+        Returns the mention scan of the chapter and the parsed analysis (None when the reply
+        could not be parsed), without changing book state.
+        """
+        system_prompt = """You are a literary analyst and narrative continuity expert.
+Extract precise, comprehensive information from chapters to keep a novel consistent."""
+        mentions = self.scan_character_mentions(chapter_content)
+        characters_str = ", ".join(mentions) if mentions else "none"
+        prompt = f"""Analyze the following chapter. This is Chapter {chapter_num} of a {self.num_chapters}-chapter book.
+
+CHAPTER CONTENT:
+{chapter_content}
+
+CHARACTERS TO TRACK: {characters_str}
+
+Reply with a JSON object with these fields:
+- summary: a detailed summary with all key plot developments, character appearances and development, setting details, important dialogue or revelations, and the emotional tone at the beginning and end; detailed enough that another writer could use it to maintain perfect continuity
+- time_elapsed: how much time passes during the chapter
+- end_time: the time of day/date the chapter ends on
+- time_markers: any specific time markers mentioned
+- emotion: the primary emotion at the chapter's end
+- tension: the level of tension at the chapter's end, 1-10
+- unresolved: the main unresolved question or conflict
+- characters: for each tracked character who appears or is mentioned, an object with name (exactly as listed above), status, development, relationships (naming the other characters), location and emotional_state
+"""
+        reply = self.generate_text(prompt, system_prompt, json_schema=CHAPTER_ANALYSIS_SCHEMA, priority=PRIORITY_ANALYSIS)
+        analysis = self.parse_json_output(reply)
+        if not isinstance(analysis, dict) or not analysis.get("summary"):
+            print(f"Could not parse the analysis of Chapter {chapter_num}.")
+            return mentions, None
+        return mentions, analysis
+
+    def apply_chapter_analysis(self, chapter_num, chapter_content, mentions, analysis):
+        """Store a merged chapter analysis in the formats the separate analyses use"""
+        if analysis is None:
+            # Fall back to the separate calls rather than leave gaps in the book state
+            print(f"Running the separate analyses of Chapter {chapter_num} instead...")
+            self.create_chapter_summary(chapter_num, chapter_content)
+            self.update_character_tracking(chapter_num, chapter_content)
+            self.update_timeline(chapter_num, chapter_content)
+            self.track_emotional_arc(chapter_num, chapter_content)
+            return
+        self.store_chapter_analysis(
+            chapter_num,
+            str(analysis.get("summary", "")).strip(),
+            f"TIME_ELAPSED: {analysis.get('time_elapsed', '')}\n"
+            f"END_TIME: {analysis.get('end_time', '')}\n"
+            f"TIME_MARKERS: {analysis.get('time_markers', '')}",
+            f"EMOTION: {analysis.get('emotion', '')}\n"
+            f"TENSION: {analysis.get('tension', '')}\n"
+            f"UNRESOLVED: {analysis.get('unresolved', '')}",
+        )
+        updates = analysis.get("characters", []) if mentions else []
+        self.apply_character_updates(chapter_num, mentions, updates if isinstance(updates, list) else [])
+
+    def store_chapter_analysis(self, chapter_num, summary, timeline, emotional_arc):
+        """Keep a chapter's summary, timeline and emotional arc in the book state and the journal"""
+        self.chapter_summaries[chapter_num] = summary
+        self.timeline[chapter_num] = timeline
+        self.emotional_arc[chapter_num] = emotional_arc
+        self.journal_event("summary", chapter=chapter_num, text=summary)
+        self.journal_event("timeline", chapter=chapter_num, text=timeline)
+        self.journal_event("emotional_arc", chapter=chapter_num, text=emotional_arc)
+
+    def start_speculative_analysis(self, chapter_num, chapter_content):
+        """Start the post-chapter analyses of a draft in background threads
+
+        Nothing is stored, journaled or added to the telemetry until the draft is known to
+        be final: the analyses only return their results, and the records of their calls
+        are held in a list until record_speculative_calls. Returns the executor, the futures
+        by name and that list.
+        """
+        print(f"Starting speculative analysis of Chapter {chapter_num} alongside validation...")
+        calls = []
+        if self.stages["analysis"] == "merged":
+            executor = ThreadPoolExecutor(max_workers=1)
+            futures = {"merged": executor.submit(self.run_speculative, calls, self.request_chapter_analysis, chapter_num, chapter_content)}
+            return executor, futures, calls
+        executor = ThreadPoolExecutor(max_workers=4)
+        futures = {
+            "summary": executor.submit(self.run_speculative, calls, self.create_chapter_summary, chapter_num, chapter_content, False),
+            "characters": executor.submit(self.run_speculative, calls, self.request_character_updates, chapter_num, chapter_content),
+            "timeline": executor.submit(self.run_speculative, calls, self.update_timeline, chapter_num, chapter_content, False),
+            "emotional_arc": executor.submit(self.run_speculative, calls, self.track_emotional_arc, chapter_num, chapter_content, False),
+        }
+        return executor, futures, calls
+
+    def run_speculative(self, calls, method, *args):
+        """Run an analysis in a speculation thread, collecting the records of its calls in calls"""
+        self.local.speculative_calls = calls
+        try:
+            return method(*args)
+        finally:
+            self.local.speculative_calls = None
+
+    def record_speculative_calls(self, calls, discarded):
+        """Add the held-back speculative calls to the telemetry, tagged when their draft was discarded"""
+        for record in sorted(calls, key=lambda record: record["started_at"]):
+            if discarded:
+                record["discarded"] = True
+            self.record_call(record)
+
+    @pipeline_step
+    def check_chapter_transition(self, chapter_num):
+        """Check the transition from the previous chapter and improve this chapter's beginning if needed"""
+        print(f"Checking the transition into Chapter {chapter_num}...")
+        # Get current and previous chapters
+        prev_chapter = self.chapters[chapter_num - 2]
+        current_chapter = self.chapters[chapter_num - 1]
+
+        system_prompt = """You are a professional editor specializing in narrative flow and chapter transitions."""
+
+        prompt = f"""Analyze the transition between these consecutive chapters and improve it if needed:
 
             END OF PREVIOUS CHAPTER:
             {prev_chapter[-1000:]}
@@ -1026,7 +2124,7 @@ Format the chapter with proper paragraph structure and dialogue formatting. Star
             BEGINNING OF CURRENT CHAPTER:
             {current_chapter[:1000]}
             
-            If the transition is already smooth, respond with "TRANSITION: SMOOTH".
+            If the transition is already smooth, respond with "TRANSITION: SMOOTH" as the very first words and nothing else.
             
             Otherwise, provide an improved beginning for the current chapter (first 2-3 paragraphs) that:
             1. Creates a smoother connection with the previous chapter
@@ -1036,77 +2134,182 @@ Format the chapter with proper paragraph structure and dialogue formatting. Star
             
             Start with "TRANSITION: REVISED" followed by the revised beginning.
             """
-            
-            transition_check = self.generate_text(prompt, system_prompt)
-            
-            if "TRANSITION: REVISED" in transition_check:
-                # Extract and apply the revised beginning
-                revised_beginning = transition_check.split("TRANSITION: REVISED")[1].strip()
-                # Replace the beginning of the chapter with the revised version
-                current_chapter_parts = current_chapter.split('\n\n', 3)
-                if len(current_chapter_parts) >= 3:
-                    # Keep the chapter title and then replace the beginning
-                    improved_chapter = current_chapter_parts[0] + '\n\n' + revised_beginning + '\n\n' + current_chapter_parts[3]
-                    improved_chapters.append(improved_chapter)
-                else:
-                    improved_chapters.append(current_chapter)
-            else:
-                improved_chapters.append(current_chapter)
-        
-        self.chapters = improved_chapters
-        print("Chapter transitions have been optimized.")
+
+        transition_check = self.generate_verdict(
+            prompt,
+            system_prompt,
+            "TRANSITION: SMOOTH",
+            max_tokens=self.transition_max_tokens,
+            # The chapter is only written once its transition is checked
+            priority=PRIORITY_DRAFTING,
+        )
+
+        if transition_check and "TRANSITION: REVISED" in transition_check:
+            # Extract and apply the revised beginning
+            revised_beginning = transition_check.split("TRANSITION: REVISED")[1].strip()
+            # Replace the beginning of the chapter with the revised version
+            current_chapter_parts = current_chapter.split('\n\n', 3)
+            # The title, the two replaced paragraphs and the rest; a shorter chapter is left as it is
+            if len(current_chapter_parts) == 4:
+                # Keep the chapter title and then replace the beginning
+                self.chapters[chapter_num - 1] = current_chapter_parts[0] + '\n\n' + revised_beginning + '\n\n' + current_chapter_parts[3]
+                print(f"Improved the transition into Chapter {chapter_num}.")
+
+    def finalize_chapter(self, chapter_num):
+        """Give a generated chapter its last pass and write it to the book file if one is open
+
+        The transition check only ever revises the later chapter's beginning, so a chapter
+        is final once its own transition is checked.
+        """
+        if chapter_num > 1 and self.stages["transition_check"]:
+            self.check_chapter_transition(chapter_num)
+        if self.book_writer is not None:
+            self.book_writer.write_chapter(chapter_num, self.chapters[chapter_num - 1])
+        if self.epub_writer is not None:
+            self.epub_writer.add_chapter(chapter_num, self.chapters[chapter_num - 1])
+        self.journal_event("chapter", chapter=chapter_num, words=len(self.chapters[chapter_num - 1].split()))
+        return self.chapters[chapter_num - 1]
+
+    def report_progress(self, event, **data):
+        """Notify the progress callback, if any, of a pipeline event"""
+        if self.progress_callback is not None:
+            try:
+                self.progress_callback(event, data)
+            except Exception as e:
+                print(f"Progress callback failed: {e}")
 
     def generate_book(self):
         """Generate the complete book with enhanced consistency checks"""
+        try:
+            with self.step_context("generate_book"):
+                book = self.run_pipeline()
+        finally:
+            # A trace of a failed run is the most useful one
+            if self.trace_path:
+                self.save_trace(self.trace_path)
+
+        print("----------------- LLM time per step -----------------")
+        for step, totals in self.telemetry_summary().items():
+            print(f"{step}: {totals['calls']} calls, {totals['seconds']:.1f}s, {totals['output_tokens']} output tokens")
+        return book
+
+    def run_pipeline(self):
+        """Run the generation stages: outline, chapters, transition check and compilation"""
         self.get_user_input()
         self.create_story_outline()
+        self.report_progress(
+            "outline",
+            world_name=self.world_name,
+            characters=list(self.characters.keys()),
+            num_chapters=self.num_chapters,
+        )
+
+        self.journal_event("premise", text=self.story_premise)
+        if self.book_writer is not None:
+            self.book_writer.start(self.story_premise)
+        if self.epub_writer is not None:
+            self.epub_writer.add_section("Story Premise", f"## Story Premise\n\n{self.story_premise}")
 
         for i in range(1, self.num_chapters + 1):
-            chapter = self.generate_chapter(i)
-            self.chapters.append(chapter)
+            self.report_progress("chapter_started", chapter=i)
+            self.chapters.append(self.generate_chapter(i))
+            chapter = self.finalize_chapter(i)
+            self.report_progress("chapter", chapter=i, content=chapter)
 
             # Add a delay to prevent overwhelming the API
-            if i < self.num_chapters:
+            if i < self.num_chapters and self.chapter_pause_seconds:
                 print("Pausing briefly before generating next chapter...")
-                time.sleep(3)
-
-        # Perform final check on transitions between chapters
-        self.check_chapter_transitions()
+                time.sleep(self.chapter_pause_seconds)
 
-        return self.compile_book()
+        book = self.compile_book()
+        words = self.book_writer.words if self.book_writer is not None else len(book.split())
+        self.report_progress("compiled", words=words)
+        return book
 
+    @pipeline_step
     def compile_book(self):
-        """Compile all chapters into a complete book""" 
-        #
+        """Compile all chapters into a complete book, or put the title into the book file being written
+
+        Returns the book text, or None when the chapters went to a book file.
+        """
         title_prompt = self.language_settings["title_prompt"].format(
             story_premise=self.story_premise,
             story_outline=self.story_outline
         )
     
-        book_title = self.generate_text(title_prompt)
-        book = f"# {book_title}\n\n"
-        book += f"## Story Premise\n\n{self.story_premise}\n\n"
-    
-        for i, chapter in enumerate(self.chapters, 1):
-            book += f"{chapter}\n\n"
-    
-        return book
+        book_title = self.generate_text(title_prompt, priority=PRIORITY_POLISH)
+        self.journal_event("title", text=book_title)
+        if self.book_writer is not None:
+            self.book_writer.set_title(book_title)
+            if self.epub_writer is not None:
+                self.epub_writer.set_title(book_title)
+            return None
+        parts = [f"# {book_title}\n\n", f"## Story Premise\n\n{self.story_premise}\n\n"]
+        parts.extend(f"{chapter}\n\n" for chapter in self.chapters)
+        return "".join(parts)
+
+    def write_book(self, filename="./output/generated_book.md", epub=False, cover=None):
+        """Generate the book straight into a file, writing each chapter as soon as it is final
+
+        Returns the timestamped file name. The chapter offsets are kept in the _index.json
+        file next to it, and the metadata is saved as with save_book. With epub, the same
+        chapters also go into an EPUB file of the same name, with an optional cover image.
+        """
+        filename = self.timestamped_filename(filename)
+        self.book_path = filename
+        self.book_writer = BookWriter(filename)
+        if epub:
+            self.epub_writer = EpubWriter(os.path.splitext(filename)[0] + ".epub", language=self.language, cover=cover)
+        self.journal = RunJournal(journal_path(filename))
+        try:
+            self.generate_book()
+        finally:
+            self.book_writer.close()
+            if self.epub_writer is not None:
+                self.epub_writer.close()
+            self.journal.close()
+        print(f"Book saved as {filename}")
+        if self.epub_writer is not None:
+            print(f"EPUB saved as {self.epub_writer.path}")
+        self.save_metadata(filename)
+        return filename
 
     def save_book(self, book_content, filename="./output/generated_book.md"):
         """Save the generated book to a file"""
+        filename = self.timestamped_filename(filename)
+        # Save the book content to a markdown file
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(book_content)
+        print(f"Book saved as {filename}")
+        self.save_metadata(filename)
+        return filename
+
+    def timestamped_filename(self, filename):
+        """Add the date and time to a book file name and make sure its directory exists"""
         # append data time to the file name before the extension
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = filename.replace(".md", f"_{timestamp}.md")
         # check if the directory exist if not make one
-        if not os.path.exists(os.path.dirname(filename)):
+        if os.path.dirname(filename) and not os.path.exists(os.path.dirname(filename)):
             os.makedirs(os.path.dirname(filename))
-        # Save the book content to a markdown file
-        with open(filename, "w", encoding="utf-8") as f:
-            f.write(book_content)
-        print(f"Book saved as {filename}")
+        return filename
+
+    def save_metadata(self, filename):
+        """Save the book metadata next to a book file for future reference
+
+        Runs with a journal compact it into the metadata; others dump the book state.
+        """
+        metadata = compact_journal(self.journal.path) if self.journal is not None else self.build_metadata()
+        # Save metadata to a JSON file
+        metadata_filename = filename.replace(".md", "_metadata.json")
+        with open(metadata_filename, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, indent=2)
+        print(f"Book metadata saved as {metadata_filename}")
+        return metadata_filename
 
-        # Also save metadata for future reference
-        metadata = {
+    def build_metadata(self):
+        """Collect the book metadata saved next to the generated book"""
+        return {
             "premise": self.story_premise,
             "world_name": self.world_name,
             "characters": self.characters,
@@ -1114,12 +2317,37 @@ Format the chapter with proper paragraph structure and dialogue formatting. Star
             "recurring_motifs": self.recurring_motifs,
             "timeline": self.timeline,
             "emotional_arc": self.emotional_arc,
+            "telemetry": {"steps": self.telemetry_summary(), "calls": self.telemetry},
         }
-        # Save metadata to a JSON file
-        metadata_filename = filename.replace(".md", "_metadata.json")
-        with open(metadata_filename, "w", encoding="utf-8") as f:
-            json.dump(metadata, f, indent=2)
-        print(f"Book metadata saved as {metadata_filename}")
+
+    # Book state that is checkpointed between pipeline steps
+    STATE_FIELDS = [
+        "story_premise", "num_chapters", "language_settings", "story_outline", "chapters", "characters",
+        "chapter_summaries", "world_name", "chapter_plan", "timeline", "emotional_arc", "transitions",
+        "recurring_motifs", "telemetry", "book_path",
+    ]
+
+    def save_state(self, path):
+        """Checkpoint the book state to a JSON file, atomically replacing any previous checkpoint"""
+        state = {field: getattr(self, field) for field in self.STATE_FIELDS}
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(temp_path, path)
+
+    def load_state(self, path):
+        """Restore the book state saved by save_state"""
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        for field in self.STATE_FIELDS:
+            if field in state:
+                setattr(self, field, state[field])
+        # JSON turns the chapter-number keys into strings, turn them back into ints
+        for field in ("chapter_summaries", "timeline", "emotional_arc", "transitions"):
+            setattr(self, field, {int(key): value for key, value in getattr(self, field).items()})
+        for data in self.characters.values():
+            if "appearances" in data:
+                data["appearances"] = {int(key): value for key, value in data["appearances"].items()}
 
 
 if __name__ == "__main__":
@@ -1127,7 +2355,7 @@ if __name__ == "__main__":
     # model (gemma3:12b, gemma3:27b, llama3:7b, llama3:13b, mistral:7b, etc.)
     parser.add_argument("--model", type=str, default="gemma3:12b", help="The language model to use.")
     parser.add_argument("--synopsis", type=str, default="./premise.txt", help="The story synopsis. If omitted, it will be requested in the console.")
-    parser.add_argument("--ollama_url", type=str, default="http://localhost:11434", help="The URL of the Ollama API.")
+    parser.add_argument("--ollama_url", type=str, default="http://localhost:11434", help="The URL of the Ollama API, or several comma-separated URLs to balance requests across.")
     parser.add_argument("--chapters", type=int, default="3", help="How many chapters would you like (Default3)")
     # language (it, en,fr,es)
     parser.add_argument("--language", type=str, default="en", help="Language of the book (default: en)")
@@ -1145,12 +2373,50 @@ if __name__ == "__main__":
     parser.add_argument("--themes", type=str, default="love", help="Themes of the book (default: love)")
     # character names (crealistic, fictionary, anagrams, etc.)
     parser.add_argument("--names", type=str, default="realistic", help="Character names style (default: realistic)")
+    # local pre-check risk score needed before the LLM consistency check runs
+    parser.add_argument("--validation_threshold", type=int, default=2, help="Local risk score at which the LLM consistency check runs, 0 always runs it (default: 2)")
+    # how consistency issues are fixed (patch: affected paragraphs only, rewrite: complete chapter)
+    parser.add_argument("--fix_mode", type=str, default="patch", choices=["patch", "rewrite"], help="How consistency issues are fixed: patch affected paragraphs or rewrite the chapter (default: patch)")
+    # analyse each chapter draft while it is being validated
+    parser.add_argument("--speculative", action="store_true", help="Run chapter analysis concurrently with consistency validation, redoing it only if a fix changes the chapter")
+    # concurrent requests to the backend, shared by all calls of the process
+    parser.add_argument("--max_concurrency", type=int, default=None, help="Requests in flight to the backend at once, served by priority: drafting, then analysis, then polish (default: no limit)")
+    # duplicate straggling calls on another Ollama host
+    parser.add_argument("--hedge_percentile", type=float, default=None, help="Hedge an Ollama call on another host when it has no first token after this percentile of recent first-token times, e.g. 95 (default: off)")
+    parser.add_argument("--hedge_budget", type=float, default=0.1, help="Largest share of calls that may be hedged (default: 0.1)")
+    # timeline of the run for Perfetto / chrome://tracing
+    parser.add_argument("--trace", type=str, default=None, help="Write a Chrome Trace Event JSON file of the run's stages and LLM requests, e.g. ./output/trace.json (default: off)")
+    # which stages run: fast (merged analysis, no chapter openers or transitions), balanced, thorough (always validate)
+    parser.add_argument("--profile", type=str, default="balanced", choices=sorted(PIPELINE_PROFILES), help="Pipeline profile: fast, balanced or thorough (default: balanced)")
+    # record the LLM replies of a run, or replay them without a model server
+    parser.add_argument("--record", type=str, default=None, help="Record every LLM reply of the run to this cassette file, e.g. ./output/run.cassette.jsonl.gz (default: off)")
+    parser.add_argument("--replay", type=str, default=None, help="Replay the LLM replies from this cassette file instead of calling the model (default: off)")
+    parser.add_argument("--replay_match", type=str, default="exact", choices=["exact", "step"], help="Match replayed calls by their exact request or by pipeline step and call order (default: exact)")
+    # project calls, tokens, time and cost without generating the book
+    parser.add_argument("--estimate", action="store_true", help="Only estimate the calls, tokens, time and cost of the book, by running the pipeline against an instant mock backend")
+    parser.add_argument("--fix_rate", type=float, default=0.2, help="Share of consistency checks assumed to find issues in the estimate (default: 0.2)")
+    parser.add_argument("--throughput_from", type=str, default=None, help="Project the estimate's time from the telemetry of an earlier run's _metadata.json instead of probing the backend")
+    parser.add_argument("--price_input", type=float, default=0.0, help="Prompt token price in USD per million tokens for the estimate (default: 0)")
+    parser.add_argument("--price_output", type=float, default=0.0, help="Output token price in USD per million tokens for the estimate (default: 0)")
+    # EPUB file written next to the markdown book
+    parser.add_argument("--epub", action="store_true", help="Also write the book as EPUB next to the markdown file, chapter by chapter (default: off)")
+    parser.add_argument("--cover", type=str, default=None, help="Cover image of the EPUB (JPEG, PNG, GIF or SVG)")
     # output file name
     parser.add_argument("--output", type=str, default="./output/generated_book.md", help="Output file name (default: ./output/generated_book.md)")
 
     args = parser.parse_args()
 
-    generator = BookGenerator(
+    if args.record and args.replay:
+        parser.error("--record and --replay cannot be used together")
+    if args.estimate and (args.record or args.replay):
+        parser.error("--estimate cannot be combined with --record or --replay")
+    cassette = None
+    if args.record:
+        cassette = Cassette(args.record, mode="record")
+    elif args.replay:
+        cassette = Cassette(args.replay, mode="replay", match=args.replay_match)
+
+    generator_options = dict(
         model=args.model,
         base_url=args.ollama_url,
         story_premise=args.synopsis,
@@ -1163,8 +2429,39 @@ if __name__ == "__main__":
         setting=args.setting,
         themes=args.themes,
         names=args.names,
+        validation_threshold=args.validation_threshold,
+        fix_mode=args.fix_mode,
+        speculative=args.speculative,
+        max_concurrency=args.max_concurrency,
+        hedge_percentile=args.hedge_percentile,
+        hedge_budget=args.hedge_budget,
+        trace_path=args.trace,
+        cassette=cassette,
+        profile=args.profile,
     )
 
-    book = generator.generate_book()
+    if args.estimate:
+        from cost_estimator import RunEstimator, print_estimate, throughput_from_metadata
 
-    generator.save_book(book, filename=args.output)
+        estimator = RunEstimator(
+            generator_options,
+            fix_rate=args.fix_rate,
+            price_input=args.price_input,
+            price_output=args.price_output,
+        )
+        if args.throughput_from:
+            throughput = throughput_from_metadata(args.throughput_from)
+        else:
+            print("Measuring the backend with a short probe call...")
+            throughput = estimator.probe_throughput()
+        report = estimator.estimate(throughput)
+        print_estimate(report, max(3, args.chapters))
+    else:
+        try:
+            generator = BookGenerator(**generator_options)
+            generator.write_book(filename=args.output, epub=args.epub, cover=args.cover)
+        finally:
+            # A crashed or interrupted run's recording is the one most worth replaying
+            if cassette is not None:
+                cassette.close()
+                print(f"{cassette.calls} LLM calls {'replayed from' if cassette.replaying else 'recorded to'} {cassette.path}")
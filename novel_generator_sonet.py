@@ -51,24 +51,66 @@ STORY INPUT: One paragraph (up to 830 characters) with the story idea
             except ValueError:
                 print("Please enter a valid number.")
 
-    def generate_text(self, prompt, system_prompt="You are a creative fiction writer."):
+    def generate_text(self, prompt, system_prompt="You are a creative fiction writer.", context=None):
         """Sends a request to the Claude Sonnet API with the given prompt"""
-        # Combine the system message and the prompt
-        combined_prompt = system_prompt + "\n" + prompt
         try:
             response = client.messages.create(
                 model=self.model,
                 max_tokens=8192,
+                # The book context is cached server-side, the system prompt follows it
+                system=self.build_system_blocks(system_prompt, context),
                 messages=[
-                    {"role": "user", "content": combined_prompt}
+                    {"role": "user", "content": prompt}
                 ]
             )
+            self.report_cache_usage(response.usage)
             # Extract the response text (according to the provided template)
             return response.content[0].text
         except Exception as e:
             print(f"Error while requesting the Claude Sonnet API: {e}")
             return None
 
+    def build_system_blocks(self, system_prompt, context=None):
+        """Builds the system blocks with a cache breakpoint after each book context block"""
+        blocks = []
+        if context:
+            for block in context:
+                if block:
+                    blocks.append({"type": "text", "text": block, "cache_control": {"type": "ephemeral"}})
+        blocks.append({"type": "text", "text": system_prompt})
+        return blocks
+
+    def report_cache_usage(self, usage):
+        """Prints the prompt cache read/write token counts of a response"""
+        if usage is None:
+            return
+        cache_read = getattr(usage, "cache_read_input_tokens", 0) or 0
+        cache_write = getattr(usage, "cache_creation_input_tokens", 0) or 0
+        print(
+            f"Claude usage: input {usage.input_tokens}, cache read {cache_read}, "
+            f"cache write {cache_write}, output {usage.output_tokens} tokens"
+        )
+
+    def build_book_context(self, chapter_num):
+        """Builds the book context shared by all calls of a chapter: fixed story setup and growing summaries"""
+        setup = f"""BOOK CONTEXT
+
+STORY PREMISE: {self.story_premise}
+
+WORLD NAME: {self.world_name} (use this name consistently for the city/world)
+
+OVERALL STORY OUTLINE: {self.story_outline}
+
+DETAILED CHAPTER PLAN:
+{self.chapter_plan}
+
+"""
+        summaries = "PREVIOUS CHAPTERS SUMMARY:\n"
+        for i in range(1, chapter_num):
+            if i in self.chapter_summaries:
+                summaries += f"Chapter {i} Summary: {self.chapter_summaries[i]}\n\n"
+        return [setup, summaries]
+
     def extract_characters(self, text):
         """Extracts character information from the text and structures it"""
         characters = {}
@@ -340,14 +382,12 @@ UNRESOLVED: [main unresolved question]
         system_prompt = """You are a master storyteller specializing in creating suspenseful 
 chapter endings and smooth transitions between chapters."""
         
-        chapter_plan_prompt = f"""From this detailed chapter plan, extract ONLY the plan 
-for Chapter {chapter_num + 1}:
-
-{self.chapter_plan}
+        chapter_plan_prompt = f"""From the detailed chapter plan in the book context, extract ONLY the plan 
+for Chapter {chapter_num + 1}.
 
 Include ONLY Chapter {chapter_num + 1}'s detailed plan.
 """
-        next_chapter_plan = self.generate_text(chapter_plan_prompt)
+        next_chapter_plan = self.generate_text(chapter_plan_prompt, context=self.build_book_context(chapter_num))
         
         emotional_status = self.emotional_arc.get(chapter_num, "")
         timeline_info = self.timeline.get(chapter_num, "")
@@ -386,7 +426,7 @@ The transition should:
 Create only 1-2 paragraphs for this transition. These will be the FINAL paragraphs of the current chapter.
 """
         
-        transition = self.generate_text(prompt, system_prompt)
+        transition = self.generate_text(prompt, system_prompt, context=self.build_book_context(chapter_num))
         self.transitions[chapter_num] = transition
         return transition
 
@@ -410,14 +450,12 @@ engaging chapter openings that connect smoothly to previous events."""
             if time_match:
                 prev_end_time = time_match.group(1).strip()
         
-        chapter_plan_prompt = f"""From this detailed chapter plan, extract ONLY the plan 
-for Chapter {chapter_num}:
-
-{self.chapter_plan}
+        chapter_plan_prompt = f"""From the detailed chapter plan in the book context, extract ONLY the plan 
+for Chapter {chapter_num}.
 
 Include ONLY Chapter {chapter_num}'s detailed plan.
 """
-        this_chapter_plan = self.generate_text(chapter_plan_prompt)
+        this_chapter_plan = self.generate_text(chapter_plan_prompt, context=self.build_book_context(chapter_num))
         
         prompt = f"""Create a compelling opening paragraph for Chapter {chapter_num} that connects 
 seamlessly with the end of Chapter {chapter_num - 1}.
@@ -448,18 +486,13 @@ The opening paragraph should:
 Create a single strong opening paragraph (3-5 sentences).
 """
         
-        opener = self.generate_text(prompt, system_prompt)
+        opener = self.generate_text(prompt, system_prompt, context=self.build_book_context(chapter_num))
         return opener
 
     def validate_chapter_consistency(self, chapter_num, chapter_content):
         """Checks the chapter for inconsistencies with previous parts of the narrative"""
         system_prompt = """You are a literary editor specializing in narrative consistency.
 Your job is to identify and flag any inconsistencies in a narrative."""
-        previous_summaries = ""
-        for i in range(1, chapter_num):
-            if i in self.chapter_summaries:
-                previous_summaries += f"Chapter {i} Summary: {self.chapter_summaries[i]}\n\n"
-
         character_status = ""
         for name, data in self.characters.items():
             if data["first_appearance"] > 0:
@@ -474,13 +507,6 @@ Your job is to identify and flag any inconsistencies in a narrative."""
 
         prompt = f"""Analyze this chapter for consistency issues compared to previous chapters.
 
-STORY PREMISE: {self.story_premise}
-
-WORLD NAME: {self.world_name}
-
-PREVIOUS CHAPTERS:
-{previous_summaries}
-
 CHARACTER STATUS:
 {character_status}
 
@@ -501,18 +527,13 @@ Identify ANY inconsistencies related to:
 If any inconsistencies are found, list them in order of severity.
 If no inconsistencies are found, respond with "CONSISTENT".
 """
-        consistency_check = self.generate_text(prompt, system_prompt)
+        consistency_check = self.generate_text(prompt, system_prompt, context=self.build_book_context(chapter_num))
         return consistency_check
 
     def fix_chapter_inconsistencies(self, chapter_num, chapter_content, issues):
         """Fixes identified inconsistencies in the chapter"""
         system_prompt = """You are a professional novelist and editor who excels at maintaining narrative consistency.
 Fix all inconsistencies while preserving the core narrative."""
-        previous_summaries = ""
-        for i in range(1, chapter_num):
-            if i in self.chapter_summaries:
-                previous_summaries += f"Chapter {i} Summary: {self.chapter_summaries[i]}\n\n"
-
         character_status = ""
         for name, data in self.characters.items():
             if data["first_appearance"] > 0:
@@ -528,13 +549,6 @@ Fix all inconsistencies while preserving the core narrative."""
 
         prompt = f"""Rewrite this chapter to fix all the identified consistency issues while maintaining the same overall plot and character development.
 
-STORY PREMISE: {self.story_premise}
-
-WORLD NAME: {self.world_name} (use this name consistently for the city/world)
-
-PREVIOUS CHAPTERS:
-{previous_summaries}
-
 CHARACTER STATUS:
 {character_status}
 
@@ -557,7 +571,7 @@ Guidelines for fixing:
 
 Rewrite the complete chapter while fixing all issues.
 """
-        fixed_chapter = self.generate_text(prompt, system_prompt)
+        fixed_chapter = self.generate_text(prompt, system_prompt, context=self.build_book_context(chapter_num))
         return fixed_chapter
 
     def generate_chapter(self, chapter_num):
@@ -565,11 +579,8 @@ Rewrite the complete chapter while fixing all issues.
         system_prompt = """You are a celebrated novelist known for writing engaging, coherent chapters 
 with natural flow and character development. Your chapters have clear narrative structure and 
 maintain perfect consistency with previously established elements."""
-        context_summaries = []
-        for i in range(1, chapter_num):
-            if i in self.chapter_summaries:
-                context_summaries.append(f"Chapter {i} Summary: {self.chapter_summaries[i]}")
-        context = "\n\n".join(context_summaries)
+        # Premise, world, outline, plan and previous summaries are sent as the cached book context
+        context = self.build_book_context(chapter_num)
 
         character_context = []
         for name, data in self.characters.items():
@@ -592,13 +603,11 @@ maintain perfect consistency with previously established elements."""
         if chapter_num > 1:
             chapter_opener = self.create_next_chapter_opener(chapter_num)
 
-        chapter_plan_prompt = f"""From this detailed chapter plan, extract ONLY the plan for Chapter {chapter_num}:
-
-{self.chapter_plan}
+        chapter_plan_prompt = f"""From the detailed chapter plan in the book context, extract ONLY the plan for Chapter {chapter_num}.
 
 Include ONLY Chapter {chapter_num}'s detailed plan.
 """
-        this_chapter_plan = self.generate_text(chapter_plan_prompt)
+        this_chapter_plan = self.generate_text(chapter_plan_prompt, context=context)
 
         if self.recurring_motifs:
             chosen_motif = self.recurring_motifs[chapter_num % len(self.recurring_motifs)]
@@ -606,13 +615,7 @@ Include ONLY Chapter {chapter_num}'s detailed plan.
         else:
             motif_instruction = ""
 
-        prompt = f"""Write Chapter {chapter_num} of a novel based on the following guidelines:
-
-STORY PREMISE: {self.story_premise}
-
-WORLD NAME: {self.world_name} (use this name consistently throughout)
-
-OVERALL STORY OUTLINE: {self.story_outline}
+        prompt = f"""Write Chapter {chapter_num} of a novel based on the book context and the following guidelines:
 
 THIS CHAPTER'S DETAILED PLAN:
 {this_chapter_plan}
@@ -620,9 +623,6 @@ THIS CHAPTER'S DETAILED PLAN:
 CHARACTERS IN THIS STORY SO FAR:
 {characters_in_chapter}
 
-PREVIOUS CHAPTERS SUMMARY:
-{context}
-
 TIMELINE INFORMATION:
 {timeline_context}
 
@@ -658,7 +658,7 @@ CHAPTER STRUCTURE GUIDELINES:
 Format the chapter with proper paragraph structure and dialogue formatting. Start with the chapter title.
 """
         print(f"Generating Chapter {chapter_num}...")
-        chapter_content = self.generate_text(prompt, system_prompt)
+        chapter_content = self.generate_text(prompt, system_prompt, context=context)
 
         print(f"Checking Chapter {chapter_num} for consistency...")
         consistency_check = self.validate_chapter_consistency(chapter_num, chapter_content)
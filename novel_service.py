@@ -0,0 +1,297 @@
+import argparse
+import itertools
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from backend_pool import RateLimiter, create_session
+from batch_generator import MANIFEST_OPTIONS
+from novel_generator import PIPELINE_PROFILES, BookGenerator
+
+
+# JSON types of the request options that are not strings
+NUMBER_OPTIONS = {"chapters", "validation_threshold", "chapter_pause"}
+BOOLEAN_OPTIONS = {"speculative", "interactive"}
+FIX_MODES = ("patch", "rewrite")
+
+
+class GenerationJob:
+    """A queued book generation request with its progress event log"""
+
+    def __init__(self, job_id, options):
+        self.id = job_id
+        self.options = options
+        self.status = "queued"
+        self.events = []
+        self.metadata = None
+        self.output = None
+        self.error = None
+        self.created_at = time.time()
+        self.condition = threading.Condition()
+
+    def add_event(self, event, data):
+        """Record a progress event and wake up the streams following this job"""
+        with self.condition:
+            self.events.append({"event": event, "data": data})
+            self.condition.notify_all()
+
+    def summary(self, include_book=False):
+        """JSON-serialisable view of the job"""
+        summary = {
+            "id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "events": len(self.events),
+            "output": self.output,
+            "error": self.error,
+        }
+        if include_book and self.status == "done":
+            # Finished books live on disk only, the service keeps no copy in memory
+            with open(self.output, "r", encoding="utf-8") as f:
+                summary["book"] = f.read()
+            summary["metadata"] = self.metadata
+        return summary
+
+
+class NovelService:
+    """Runs generation jobs on a fixed set of worker threads sharing one backend pool"""
+
+    def __init__(
+        self,
+        model,
+        base_url,
+        workers=2,
+        max_rps=0,
+        max_concurrency=None,
+        hedge_percentile=None,
+        hedge_budget=0.1,
+        profile="balanced",
+        output_dir="./output/service",
+    ):
+        self.model = model
+        self.base_url = base_url
+        self.output_dir = output_dir
+        self.session = create_session(pool_size=workers * 4)
+        self.rate_limiter = RateLimiter(max_rps) if max_rps else None
+        self.max_concurrency = max_concurrency
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        # Pipeline profile of the jobs that do not set one
+        self.profile = profile
+        self.jobs = {}
+        self.job_ids = itertools.count(1)
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        for _ in range(workers):
+            threading.Thread(target=self.work, daemon=True).start()
+
+    def submit(self, options):
+        """Validate a request body and queue it as a job"""
+        if not isinstance(options, dict) or not isinstance(options.get("premise"), str) or not options["premise"].strip():
+            raise ValueError("A non-empty 'premise' is required")
+        unknown = [key for key in options if key not in MANIFEST_OPTIONS]
+        if unknown:
+            raise ValueError(f"Unknown options: {', '.join(unknown)}")
+        check_options(options)
+        with self.lock:
+            job = GenerationJob(str(next(self.job_ids)), options)
+            self.jobs[job.id] = job
+        job.add_event("queued", {"id": job.id})
+        self.pending.put(job)
+        return job
+
+    def work(self):
+        """Worker thread: run queued jobs one after another"""
+        while True:
+            job = self.pending.get()
+            self.run_job(job)
+
+    def run_job(self, job):
+        """Generate one book, streaming its progress into the job's event log"""
+        job.status = "running"
+        job.add_event("started", {"id": job.id})
+        try:
+            kwargs = {"model": self.model, "base_url": self.base_url, "profile": self.profile}
+            for key, value in job.options.items():
+                kwargs[MANIFEST_OPTIONS[key]] = value
+            generator = BookGenerator(
+                session=self.session,
+                rate_limiter=self.rate_limiter,
+                max_concurrency=self.max_concurrency,
+                hedge_percentile=self.hedge_percentile,
+                hedge_budget=self.hedge_budget,
+                progress_callback=job.add_event,
+                # Premises come from the network, never read them as server-side file paths
+                premise_from_file=False,
+                **kwargs,
+            )
+            job.output = generator.write_book(filename=os.path.join(self.output_dir, f"job_{job.id}.md"))
+            job.metadata = generator.build_metadata()
+            job.status = "done"
+            job.add_event("done", {"output": job.output, "words": generator.book_writer.words})
+        except (Exception, SystemExit) as e:
+            # SystemExit comes from create_story_outline aborting on LLM failures
+            job.status = "failed"
+            job.error = str(e) or "generation aborted"
+            job.add_event("failed", {"error": job.error})
+
+
+def check_options(options):
+    """Raise ValueError for a job option of the wrong type or out of range
+
+    The generator falls back to defaults for some bad values and fails late on others,
+    so a request is checked before it is queued and can be answered with a 400.
+    """
+    chapters = options.get("chapters", 3)
+    # JSON true and false are ints to Python
+    if isinstance(chapters, bool) or not isinstance(chapters, int) or chapters < 3:
+        raise ValueError("'chapters' must be a whole number of at least 3")
+    for key, value in options.items():
+        if key in BOOLEAN_OPTIONS:
+            if not isinstance(value, bool):
+                raise ValueError(f"'{key}' must be true or false")
+        elif key in NUMBER_OPTIONS:
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise ValueError(f"'{key}' must be a number of at least 0")
+        elif not isinstance(value, str):
+            raise ValueError(f"'{key}' must be a string")
+    if options.get("profile", "balanced") not in PIPELINE_PROFILES:
+        raise ValueError(f"Unknown 'profile', expected one of: {', '.join(PIPELINE_PROFILES)}")
+    if options.get("fix_mode", "patch") not in FIX_MODES:
+        raise ValueError(f"Unknown 'fix_mode', expected one of: {', '.join(FIX_MODES)}")
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """HTTP API: POST /jobs, GET /jobs, GET /jobs/<id>, GET /jobs/<id>/events (SSE), GET /jobs/<id>/book"""
+
+    service = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        print(f"[service] {self.address_string()} {format % args}")
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def find_job(self, job_id):
+        job = self.service.jobs.get(job_id)
+        if job is None:
+            self.send_json(404, {"error": f"No job {job_id}"})
+        return job
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok", "jobs": len(self.service.jobs)})
+            return
+        if self.path == "/jobs":
+            self.send_json(200, [job.summary() for job in list(self.service.jobs.values())])
+            return
+        match = re.fullmatch(r"/jobs/(\w+)(/events|/book)?", self.path)
+        if not match:
+            self.send_json(404, {"error": "Not found"})
+            return
+        job = self.find_job(match.group(1))
+        if job is None:
+            return
+        if match.group(2) == "/events":
+            self.stream_events(job)
+        elif match.group(2) == "/book":
+            if job.status != "done":
+                self.send_json(409, {"error": f"Job is {job.status}"})
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/markdown; charset=utf-8")
+            self.send_header("Content-Length", str(os.path.getsize(job.output)))
+            self.end_headers()
+            with open(job.output, "rb") as f:
+                shutil.copyfileobj(f, self.wfile)
+        else:
+            self.send_json(200, job.summary(include_book=True))
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            self.send_json(404, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            options = json.loads(self.rfile.read(length) or b"{}")
+            job = self.service.submit(options)
+        except (ValueError, json.JSONDecodeError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        self.send_json(202, job.summary())
+
+    def stream_events(self, job):
+        """Send the job's events as Server-Sent Events, replaying history first, until it ends"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        sent = 0
+        try:
+            while True:
+                with job.condition:
+                    if sent >= len(job.events):
+                        job.condition.wait(timeout=15)
+                    new_events = job.events[sent:]
+                if not new_events:
+                    # Comment line keeps proxies from closing an idle stream
+                    self.wfile.write(b": keep-alive\n\n")
+                    self.wfile.flush()
+                    continue
+                for event in new_events:
+                    payload = json.dumps(event["data"])
+                    self.wfile.write(f"event: {event['event']}\ndata: {payload}\n\n".encode("utf-8"))
+                sent += len(new_events)
+                self.wfile.flush()
+                if new_events[-1]["event"] in ("done", "failed"):
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve book generation as HTTP jobs with progress streaming.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument("--model", type=str, default="gemma3:12b", help="Default language model for jobs that do not set one.")
+    parser.add_argument("--ollama_url", type=str, default="http://localhost:11434", help="The URL of the Ollama API, or several comma-separated URLs to balance requests across.")
+    parser.add_argument("--workers", type=int, default=2, help="Books generated at the same time (default: 2)")
+    parser.add_argument("--max_rps", type=float, default=0, help="Global limit of LLM requests started per second, 0 for no limit (default: 0)")
+    parser.add_argument("--max_concurrency", type=int, default=None, help="Requests in flight to the backend at once across all jobs, served by priority (default: no limit)")
+    parser.add_argument("--hedge_percentile", type=float, default=None, help="Hedge an Ollama call on another host when it has no first token after this percentile of recent first-token times (default: off)")
+    parser.add_argument("--hedge_budget", type=float, default=0.1, help="Largest share of calls that may be hedged (default: 0.1)")
+    parser.add_argument("--profile", type=str, default="balanced", choices=sorted(PIPELINE_PROFILES), help="Pipeline profile of the jobs that do not set one: fast, balanced or thorough (default: balanced)")
+    parser.add_argument("--output_dir", type=str, default="./output/service", help="Where finished books are saved (default: ./output/service)")
+
+    args = parser.parse_args()
+
+    ServiceRequestHandler.service = NovelService(
+        model=args.model,
+        base_url=args.ollama_url,
+        workers=args.workers,
+        max_rps=args.max_rps,
+        max_concurrency=args.max_concurrency,
+        hedge_percentile=args.hedge_percentile,
+        hedge_budget=args.hedge_budget,
+        profile=args.profile,
+        output_dir=args.output_dir,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), ServiceRequestHandler)
+    print(f"Novel generation service listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,169 @@
+import argparse
+import collections
+import csv
+import json
+import os
+import re
+import urllib.parse
+
+from book_catalog import created_at
+from book_writer import iter_chapters
+from run_journal import compact_journal
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+CHAPTER_COLUMNS = [
+    "book", "created_at", "chapter", "words", "tension", "emotion",
+    "validated", "fix_triggered", "llm_calls", "llm_seconds", "prompt_tokens", "output_tokens",
+]
+CALL_COLUMNS = [
+    "book", "created_at", "step", "chapter", "backend", "started_at", "ok", "retries", "streamed",
+    "queue_wait", "ttft", "total_seconds", "tokens_per_second", "prompt_tokens", "output_tokens",
+    "cached_tokens", "cache_hit", "discarded",
+]
+# Column types, so every partition file has the same schema even when a column is all empty
+COLUMN_TYPES = {
+    "book": "string", "created_at": "string", "step": "string", "backend": "string",
+    "emotion": "string", "chapter": "int64", "words": "int64", "llm_calls": "int64", "retries": "int64",
+    "prompt_tokens": "int64", "output_tokens": "int64", "cached_tokens": "int64", "validated": "bool_",
+    "fix_triggered": "bool_", "ok": "bool_", "streamed": "bool_", "cache_hit": "bool_", "discarded": "bool_",
+}
+# Pipeline steps whose calls mean a chapter failed its consistency check and was fixed
+FIX_STEPS = {"fix_chapter_inconsistencies", "patch_chapter_paragraphs"}
+# "TENSION: 7", "TENSION: **7** - ...", "TENSION: 7/10"
+TENSION = re.compile(r"TENSION:\s*\**\s*(\d+(?:\.\d+)?)")
+# "EMOTION: Dread", "EMOTION: **Dread** - ...", up to the end of the first sentence
+EMOTION = re.compile(r"EMOTION:\s*\**\s*([^*\n.]+?)\s*(\*\*|\s-\s|\.|\n|$)")
+
+
+class ColumnarExporter:
+    """Flattens book metadata and call telemetry into per-chapter and per-call tables
+
+    Rows are collected column by column per partition, and every partition is written
+    as one Parquet file (with pyarrow installed) or CSV file, in a Hive-style
+    date=YYYY-MM-DD/model=NAME directory tree, so analytics tools can prune partitions
+    and read only the columns they need. The date and model are only in the directory
+    names, with the model URI-encoded (gemma3%3A12b), as Hive-style readers expect.
+    """
+
+    def __init__(self, output_dir, file_format="auto"):
+        if file_format == "auto":
+            file_format = "parquet" if pyarrow is not None else "csv"
+        if file_format == "parquet" and pyarrow is None:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow), or use --format csv")
+        self.output_dir = output_dir
+        self.file_format = file_format
+        self.tables = {"chapters": CHAPTER_COLUMNS, "calls": CALL_COLUMNS}
+        # (table, date, model) -> {column: [values]}
+        self.partitions = {}
+        self.books = 0
+
+    def add_book(self, book_path):
+        """Add the chapters and calls of one book, from its metadata or its run journal"""
+        metadata_path = book_path[:-3] + "_metadata.json"
+        journal = book_path[:-3] + "_journal.jsonl"
+        if os.path.exists(metadata_path):
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+        elif os.path.exists(journal):
+            metadata = compact_journal(journal)
+        else:
+            return False
+        calls = (metadata.get("telemetry") or {}).get("calls") or []
+        models = collections.Counter(call["model"] for call in calls if call.get("model"))
+        model = models.most_common(1)[0][0] if models else "unknown"
+        created = created_at(book_path, os.stat(book_path))
+        book = os.path.basename(book_path)[:-3]
+        common = {"book": book, "created_at": created}
+
+        for call in calls:
+            row = dict(common)
+            row.update({column: call.get(column) for column in CALL_COLUMNS if column not in common})
+            row["discarded"] = bool(call.get("discarded"))
+            self.add_row("calls", created, model, row)
+
+        per_chapter = collections.defaultdict(list)
+        for call in calls:
+            # Speculative analysis of a discarded draft describes text that is not in the book
+            if call.get("chapter") is not None and not call.get("discarded"):
+                per_chapter[call["chapter"]].append(call)
+        emotional_arc = {int(chapter): text for chapter, text in (metadata.get("emotional_arc") or {}).items()}
+        for chapter, _, text in iter_chapters(book_path, metadata.get("premise")):
+            chapter_calls = per_chapter.get(chapter, [])
+            arc = emotional_arc.get(chapter) or ""
+            tension = TENSION.search(arc)
+            emotion = EMOTION.search(arc)
+            row = dict(common)
+            row.update({
+                "chapter": chapter,
+                "words": len(text.split()),
+                "tension": float(tension.group(1)) if tension else None,
+                "emotion": emotion.group(1).strip()[:80] if emotion else None,
+                "validated": any(call["step"] == "validate_chapter_consistency" for call in chapter_calls) if calls else None,
+                "fix_triggered": any(call["step"] in FIX_STEPS for call in chapter_calls) if calls else None,
+                # Books from before the call telemetry have no per-call figures
+                "llm_calls": len(chapter_calls) if calls else None,
+                "llm_seconds": round(sum(call.get("total_seconds") or 0 for call in chapter_calls), 3) if calls else None,
+                "prompt_tokens": sum(call.get("prompt_tokens") or 0 for call in chapter_calls) if calls else None,
+                "output_tokens": sum(call.get("output_tokens") or 0 for call in chapter_calls) if calls else None,
+            })
+            self.add_row("chapters", created, model, row)
+        self.books += 1
+        return True
+
+    def add_row(self, table, created, model, row):
+        columns = self.partitions.setdefault((table, created[:10], model), {column: [] for column in self.tables[table]})
+        for column in self.tables[table]:
+            columns[column].append(row.get(column))
+
+    def write(self):
+        """Write one file per partition, replacing an earlier export's file; returns the paths"""
+        paths = []
+        for (table, date, model), columns in sorted(self.partitions.items()):
+            directory = os.path.join(self.output_dir, table, f"date={date}", f"model={urllib.parse.quote(model, safe='')}")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-0.{self.file_format}")
+            if self.file_format == "parquet":
+                schema = pyarrow.schema(
+                    [(column, getattr(pyarrow, COLUMN_TYPES.get(column, "float64"))()) for column in self.tables[table]]
+                )
+                pyarrow.parquet.write_table(pyarrow.table(columns, schema=schema), path)
+            else:
+                with open(path, "w", encoding="utf-8", newline="") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(self.tables[table])
+                    writer.writerows(zip(*(columns[column] for column in self.tables[table])))
+            paths.append(path)
+        return paths
+
+
+def find_runs(directory):
+    """Yield the book files of a directory tree that have metadata or a run journal"""
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.endswith(".md") and (
+                name[:-3] + "_metadata.json" in files or name[:-3] + "_journal.jsonl" in files
+            ):
+                yield os.path.join(root, name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export book metadata and call telemetry as partitioned columnar files.")
+    parser.add_argument("--dir", type=str, default="./output", help="Directory tree with the generated books (default: ./output)")
+    parser.add_argument("--output", type=str, default="./output/analytics", help="Export directory (default: ./output/analytics)")
+    parser.add_argument("--format", type=str, default="auto", choices=["auto", "parquet", "csv"], help="Parquet needs pyarrow; auto falls back to CSV without it (default: auto)")
+
+    args = parser.parse_args()
+
+    exporter = ColumnarExporter(args.output, file_format=args.format)
+    output = os.path.abspath(args.output)
+    for book_path in find_runs(args.dir):
+        if not os.path.abspath(book_path).startswith(output + os.sep):
+            exporter.add_book(book_path)
+    paths = exporter.write()
+    print(f"Exported {exporter.books} books to {len(paths)} {exporter.file_format} files in {args.output}")
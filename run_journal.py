@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+
+class RunJournal:
+    """Append-only JSONL log of a run's book state changes
+
+    Every change (summary recorded, character updated, chapter finalized, LLM call
+    completed, ...) is one compact line, flushed as it happens, so a crash loses at most
+    the line being written. compact_journal rebuilds the metadata JSON from it. Several
+    processes may append to the same journal one after another, like job queue workers
+    running the steps of one book.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def record(self, event, **fields):
+        """Append one event line"""
+        line = json.dumps({"event": event, "time": round(time.time(), 3), **fields}, ensure_ascii=False, separators=(",", ":"))
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        """Close the journal file"""
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+def journal_path(book_path):
+    """Journal file that belongs to a book file"""
+    return book_path[:-3] + "_journal.jsonl" if book_path.endswith(".md") else book_path + ".journal.jsonl"
+
+
+def read_journal(path):
+    """Yield the events of a journal, skipping a line cut short by a crash"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def summarize_calls(records):
+    """Aggregate LLM call telemetry records per pipeline step
+
+    Speculative analysis calls of discarded drafts are counted together under "discarded",
+    so the steps only describe text that is in the book while the totals keep every call.
+    """
+    summary = {}
+    for record in records:
+        name = "discarded" if record.get("discarded") else record["step"] or "other"
+        step = summary.setdefault(name, {
+            "calls": 0, "failed": 0, "seconds": 0.0, "queue_wait": 0.0, "prompt_tokens": 0, "output_tokens": 0,
+        })
+        step["calls"] += 1
+        step["failed"] += 0 if record["ok"] else 1
+        step["seconds"] = round(step["seconds"] + record["total_seconds"], 3)
+        step["queue_wait"] = round(step["queue_wait"] + record["queue_wait"], 3)
+        step["prompt_tokens"] += record["prompt_tokens"] or 0
+        step["output_tokens"] += record["output_tokens"] or 0
+    return summary
+
+
+def compact_journal(path):
+    """Replay a journal into the metadata saved next to a book (see BookGenerator.build_metadata)"""
+    metadata = {
+        "premise": "",
+        "world_name": "",
+        "characters": {},
+        "chapter_summaries": {},
+        "recurring_motifs": [],
+        "timeline": {},
+        "emotional_arc": {},
+    }
+    calls = []
+    for entry in read_journal(path):
+        event = entry["event"]
+        if event == "premise":
+            metadata["premise"] = entry["text"]
+        elif event == "world_name":
+            metadata["world_name"] = entry["name"]
+        elif event == "recurring_motifs":
+            metadata["recurring_motifs"] = entry["motifs"]
+        elif event == "characters":
+            metadata["characters"] = entry["characters"]
+        elif event == "character":
+            metadata["characters"][entry["name"]] = entry["data"]
+        elif event == "summary":
+            metadata["chapter_summaries"][entry["chapter"]] = entry["text"]
+        elif event == "timeline":
+            metadata["timeline"][entry["chapter"]] = entry["text"]
+        elif event == "emotional_arc":
+            metadata["emotional_arc"][entry["chapter"]] = entry["text"]
+        elif event == "llm_call":
+            calls.append(entry["call"])
+    metadata["telemetry"] = {"steps": summarize_calls(calls), "calls": calls}
+    return metadata
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild a book's _metadata.json from its run journal, e.g. after a crash.")
+    parser.add_argument("journal", type=str, help="The _journal.jsonl file of a book")
+    parser.add_argument("--output", type=str, default=None, help="Metadata file to write (default: the journal's name with _metadata.json)")
+
+    args = parser.parse_args()
+
+    output = args.output or args.journal.replace("_journal.jsonl", "_metadata.json")
+    if output == args.journal:
+        parser.error("Give --output for journals not named *_journal.jsonl")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(compact_journal(args.journal), f, indent=2)
+    print(f"Book metadata saved as {output}")
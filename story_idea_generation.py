@@ -1,35 +1,52 @@
-import requests
+import argparse
 import json
 import time
 import textwrap
 import os
 from colorama import Fore, Style, init
 
+from backend_pool import get_host_pool
+from llm_cassette import Cassette
+
 # Initialization of colorama for colored text
 init()
 
+DEFAULT_OLLAMA_URL = "http://localhost:11434"
+
 class LLMAgent:
-    def __init__(self, name, model, description, color):
+    def __init__(self, name, model, description, color, ollama_url=DEFAULT_OLLAMA_URL, cassette=None):
         self.name = name
         self.model = model
         self.description = description
         self.color = color
         self.history = []
+        # One or more comma-separated Ollama endpoints; agents with the same list share one host pool
+        self.host_pool = get_host_pool(ollama_url)
+        # Optional llm_cassette.Cassette recording or replaying the agent's replies, keyed by agent name
+        self.cassette = cassette
     
     def think(self, prompt, max_tokens=1000):
+        """Returns the model's response, recording it to or replaying it from the cassette when one is set"""
+        if self.cassette is None:
+            return self.request(prompt, max_tokens)
+        key = self.cassette.request_key(self.model, prompt, max_tokens)
+        if self.cassette.replaying:
+            return self.cassette.replay(key, self.name, None)
+        response = self.request(prompt, max_tokens)
+        self.cassette.record(key, self.name, None, response)
+        return response
+
+    def request(self, prompt, max_tokens):
         """Sends a request to the Ollama API and receives a response from the model"""
         try:
-            response = requests.post(
-                'http://localhost:11434/api/generate',
-                json={
-                    'model': self.model,
-                    'prompt': prompt,
-                    'max_tokens': max_tokens,
-                    'stream': False
-                }
-            )
-            response.raise_for_status()
-            return response.json()['response'].strip()
+            payload = {
+                'model': self.model,
+                'prompt': prompt,
+                'max_tokens': max_tokens,
+                'stream': False
+            }
+            with self.host_pool.request('/api/generate', self.model, payload) as response:
+                return response.json()['response'].strip()
         except Exception as e:
             print(f"Error while requesting model {self.model}: {e}")
             return f"[Generation error from {self.name}]"
@@ -45,48 +62,62 @@ def clear_screen():
     """Clears the terminal screen"""
     os.system('cls' if os.name == 'nt' else 'clear')
 
-def create_story_system():
+def create_story_system(ollama_url=DEFAULT_OLLAMA_URL, cassette=None):
     """Creates and returns three agents for story generation"""
     architect = LLMAgent(
         "Architect", 
         "gemma2:27b", 
         "A structural analyst with a deep understanding of genre conventions and narrative structures",
-        Fore.WHITE
+        Fore.WHITE,
+        ollama_url,
+        cassette
     )
     
     visionary = LLMAgent(
         "Visionary", 
         "mistral:latest", 
         "A creative dreamer with unconventional thinking and original ideas",
-        Fore.WHITE
+        Fore.WHITE,
+        ollama_url,
+        cassette
     )
     
     critic = LLMAgent(
         "Critic", 
         "hermes3:latest", 
         "An analyst with a deep understanding of the audience and the appeal of ideas",
-        Fore.WHITE
+        Fore.WHITE,
+        ollama_url,
+        cassette
     )
     
     return [architect, visionary, critic]
 
-def run_story_generation():
-    """Main function to start the story generation process"""
-    clear_screen()
+def run_story_generation(ollama_url=DEFAULT_OLLAMA_URL, theme=None, cassette=None):
+    """Main function to start the story generation process
+
+    With a theme given the run is non-interactive: no prompt and no screen clearing.
+    """
+    interactive = theme is None
+    if interactive:
+        clear_screen()
     print(Fore.WHITE + """
 ──────────────────────────────────────────────────────────────────────────────────
             CREATIVE MIX OF LLM AGENTS SYSTEM FOR BOOK PLOT GENERATION
 ──────────────────────────────────────────────────────────────────────────────────
     """ + Style.RESET_ALL)
     
-    agents = create_story_system()
+    agents = create_story_system(ollama_url, cassette)
     
     # Introducing agents
     for agent in agents:
         print(f"{Fore.WHITE}{agent.name}: {agent.description}{Style.RESET_ALL}")
     
-    print("\n" + Fore.WHITE + "Briefly state the theme or idea of your book:" + Style.RESET_ALL)
-    user_input = input("> ")
+    if interactive:
+        print("\n" + Fore.WHITE + "Briefly state the theme or idea of your book:" + Style.RESET_ALL)
+        user_input = input("> ")
+    else:
+        user_input = theme
     
     # Creating the initial prompt for each agent
     initial_prompts = {
@@ -110,7 +141,8 @@ def run_story_generation():
     all_proposals = []
     final_plot = ""
     
-    clear_screen()
+    if interactive:
+        clear_screen()
     print(Fore.WHITE + f"BOOK PLOT GENERATION ON THE THEME: '{user_input}'\n" + Style.RESET_ALL)
     
     print(Fore.WHITE + "ITERATION 1: Initial proposals\n" + Style.RESET_ALL)
@@ -183,21 +215,41 @@ def run_story_generation():
             final_plot = agents[0].think(final_prompt)
     
     # Output final result
-    clear_screen()
+    if interactive:
+        clear_screen()
     print(Fore.WHITE + f"FINAL BOOK PLOT ON THE THEME: '{user_input}'\n" + Style.RESET_ALL)
     print(Fore.WHITE + final_plot + Style.RESET_ALL)
     
     return final_plot
 
 if __name__ == "__main__":
-    # Checking Ollama API availability
+    parser = argparse.ArgumentParser(description="Generate a book plot with a discussion between LLM agents.")
+    parser.add_argument("--ollama_url", type=str, default=DEFAULT_OLLAMA_URL, help="The URL of the Ollama API, or several comma-separated URLs to balance requests across.")
+    parser.add_argument("--theme", type=str, default=None, help="Theme of the book; asked for in the console if omitted")
+    parser.add_argument("--record", type=str, default=None, help="Record the agents' replies to this cassette file (default: off)")
+    parser.add_argument("--replay", type=str, default=None, help="Replay the agents' replies from this cassette file instead of calling the models (default: off)")
+    parser.add_argument("--replay_match", type=str, default="exact", choices=["exact", "step"], help="Match replayed calls by their exact request or by agent and call order (default: exact)")
+    args = parser.parse_args()
+
+    if args.record and args.replay:
+        parser.error("--record and --replay cannot be used together")
+    cassette = None
+    if args.record:
+        cassette = Cassette(args.record, mode="record")
+    elif args.replay:
+        cassette = Cassette(args.replay, mode="replay", match=args.replay_match)
+
     try:
-        response = requests.get('http://localhost:11434/api/tags')
-        if response.status_code != 200:
-            raise Exception("Ollama API is unavailable")
-    except Exception as e:
-        print(f"{Fore.WHITE}Error while connecting to Ollama API: {e}{Style.RESET_ALL}")
-        print(f"{Fore.WHITE}Make sure that Ollama is running and accessible at http://localhost:11434{Style.RESET_ALL}")
-        exit()
-    
-    run_story_generation()
+        # Checking Ollama API availability, a replay does not need it
+        if cassette is None or not cassette.replaying:
+            host_pool = get_host_pool(args.ollama_url)
+            host_pool.refresh(force=True)
+            if not any(host["healthy"] for host in host_pool.hosts):
+                print(f"{Fore.WHITE}Error while connecting to Ollama API: no endpoint answered{Style.RESET_ALL}")
+                print(f"{Fore.WHITE}Make sure that Ollama is running and accessible at {args.ollama_url}{Style.RESET_ALL}")
+                exit()
+
+        run_story_generation(args.ollama_url, theme=args.theme, cassette=cassette)
+    finally:
+        if cassette is not None:
+            cassette.close()